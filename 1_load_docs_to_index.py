@@ -2,11 +2,15 @@ import os
 import json 
 import openai 
 from dotenv import load_dotenv
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+from embeddings import generate_embeddings, embed_in_batches, embedding_engine
+from ingest_pipeline import run_pipeline
+from index_manifest import (load_manifest, save_manifest, schema_hash, same_fields, live_documents,
+                            document_hash, diff_documents, format_diff)
+from embedding_cache import EmbeddingCache
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient  
-from azure.search.documents.models import Vector  
+from azure.core.exceptions import ResourceNotFoundError
+from clients import ClientFactory
+from rate_limiter import rate_limiter, BULK
 from azure.search.documents.indexes.models import (  
     SearchIndex,  
     SearchField,  
@@ -33,19 +37,29 @@ index_name = config_details["SEARCH_INDEX_NAME"]
 key = config_details["SEARCH_ADMIN_KEY"]
 credential = AzureKeyCredential(key)
 
+# one pool of keep-alive connections shared by the search clients and the openai calls
+clients = ClientFactory(pool_maxsize=config_details.get("HTTP_POOL_MAXSIZE", 32))
+
 # create the acs client to issue queries
-search_client = SearchClient(endpoint=service_endpoint, index_name=index_name, credential=credential)
+search_client = clients.search_client(service_endpoint, index_name, credential)
 
 # create the index client
-index_client = SearchIndexClient(endpoint=service_endpoint, credential=credential)
+index_client = clients.search_index_client(service_endpoint, credential)
 
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 openai.api_type = os.environ["OPENAI_API_TYPE"]
 openai.api_base = os.environ["OPENAI_API_BASE"]
 openai.api_version = os.environ["OPENAI_API_VERSION"]
+clients.configure_openai()
+
+# embedding requests wait for the deployment's RPM/TPM budget (RATE_LIMITS in config.json) instead of
+# running into 429s, and pause together when the service asks them to
+rate_limiter.configure_from(config_details)
+rate_limiter.instrument_session(clients.session)
 
-deployment_name = config_details['DEPLOYMENT_NAME'] # You need to use the 0613 version of gpt-35-turbo or gpt-4
+# open the connections now instead of on the first embedding / upload request
+clients.warm_up([service_endpoint, openai.api_base])
 
 # Create a search index
 fields = [
@@ -82,40 +96,111 @@ semantic_settings = SemanticSettings(configurations=[semantic_config])
 # Create the search index with the semantic settings
 index = SearchIndex(name=index_name, fields=fields, 
                     vector_search=vector_search, semantic_settings=semantic_settings)
-result = index_client.delete_index(index)
-print(f' {index_name} deleted')
-result = index_client.create_index(index)
-print(f' {result.name} created')
-
-# function to generate embeddings for title and content fields, and to query embeddings
-@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
-def generate_embeddings(text):
-    response = openai.Embedding.create(
-        input=text, engine="text-embedding-ada-002")
-    embeddings = response['data'][0]['embedding']
-    return embeddings
-
-batch_size = 100
-counter = 0
-documents = []
-search_client = SearchClient(endpoint=service_endpoint, index_name=index_name, credential=credential)
-
-with open("recipes_final.jsonl", "r") as j_in:
-    for line in j_in:
-        counter += 1 
-        json_recipe = json.loads(line)
+
+# "incremental" only creates the index when it is missing or its schema changed and only sends changed recipes,
+# "full" deletes and recreates the index and re-uploads everything
+sync_mode = config_details.get("SYNC_MODE", "incremental")
+manifest_path = config_details.get("INDEX_MANIFEST_PATH", "index_manifest.json")
+manifest = load_manifest(manifest_path, index_name)
+current_schema_hash = schema_hash(index)
+
+def get_live_index(name):
+    try:
+        return index_client.get_index(name)
+    except ResourceNotFoundError:
+        return None
+
+live_index = get_live_index(index_name) if sync_mode != "full" else None
+
+# without a manifest (first incremental run, or a deleted manifest) the live index is compared with ours field by
+# field; one with the same fields is kept and only the manifest is rebuilt, by re-sending every recipe to it
+if manifest["schema_hash"] is None:
+    schema_changed = live_index is not None and not same_fields(live_index, index)
+else:
+    schema_changed = manifest["schema_hash"] != current_schema_hash
+
+if sync_mode == "full" or (live_index is not None and schema_changed):
+    if sync_mode != "full":
+        print(f' {index_name} schema changed')
+    result = index_client.delete_index(index)
+    print(f' {index_name} deleted')
+    result = index_client.create_index(index)
+    print(f' {result.name} created')
+    manifest["documents"] = {}
+elif live_index is None:
+    result = index_client.create_index(index)
+    print(f' {result.name} created')
+    manifest["documents"] = {}
+elif manifest["schema_hash"] is None:
+    print(f' {index_name} exists without a manifest, syncing every document into it')
+    # recipes it holds that are no longer in the source are deleted after the sync like any other removed recipe
+    manifest["documents"] = live_documents(search_client)
+else:
+    print(f' {index_name} is up to date, syncing documents')
+manifest["schema_hash"] = current_schema_hash
+
+# cache embeddings on disk so unchanged recipes are never re-embedded
+embedding_cache = EmbeddingCache(config_details.get("EMBEDDING_CACHE_DIR", ".embedding_cache"))
+
+# "batched" groups many recipes per embedding request, "single" embeds one recipe per request
+embedding_mode = config_details.get("EMBEDDING_MODE", "batched")
+embedding_batch_size = 16
+
+# documents per upload request, and how many embedding / upload requests may be in flight at once
+batch_size = config_details.get("UPLOAD_BATCH_SIZE", 100)
+embed_workers = 4
+upload_workers = 2
+
+# stream the recipes that are new or changed since the last sync, hashing every line as it is read
+recipe_hashes = {}
+previous_documents = dict(manifest["documents"])
+
+def read_changed_recipes():
+    with open("recipes_final.jsonl", "r") as j_in:
+        for line in j_in:
+            json_recipe = json.loads(line)
+            recipe_hash = document_hash(json_recipe, embedding_engine)
+            recipe_hashes[json_recipe['recipe_id']] = recipe_hash
+            if previous_documents.get(json_recipe['recipe_id']) != recipe_hash:
+                yield json_recipe
+
+def embed_recipes(recipes):
+    if embedding_mode == "batched":
+        recipe_vectors = embed_in_batches([recipe['recipe'] for recipe in recipes],
+                                          embedding_batch_size, 1, cache=embedding_cache)
+    else:
+        recipe_vectors = [generate_embeddings(recipe['recipe'], cache=embedding_cache, priority=BULK)
+                          for recipe in recipes]
+    documents = []
+    for json_recipe, recipe_vector in zip(recipes, recipe_vectors):
         json_recipe['total_time'] = int(json_recipe['total_time'].split(' ')[0])
-        json_recipe['recipe_vector'] = generate_embeddings(json_recipe['recipe'])
-        json_recipe["@search.action"] = "upload"
+        json_recipe['recipe_vector'] = recipe_vector
+        json_recipe["@search.action"] = "mergeOrUpload"
         documents.append(json_recipe)
-        if counter % batch_size == 0:
-            # Load content into index
-            result = search_client.upload_documents(documents)  
-            print(f"Uploaded {len(documents)} documents") 
-            documents = []
-            
-            
-if documents != []:
-    # Load content into index
-    result = search_client.upload_documents(documents)  
-    print(f"Uploaded {len(documents)} documents") 
+    return documents
+
+def send_documents(documents):
+    # merge_or_upload leaves the other documents in the index untouched
+    search_client.merge_or_upload_documents(documents)
+    for document in documents:
+        manifest["documents"][document['recipe_id']] = recipe_hashes[document['recipe_id']]
+    print(f"Uploaded {len(documents)} documents")
+
+report = run_pipeline(read_changed_recipes(), embed_recipes, send_documents,
+                      embedding_batch_size=embedding_batch_size, batch_size=batch_size,
+                      embed_workers=embed_workers, upload_workers=upload_workers)
+print(report)
+
+# summarise what changed since the last sync and remove recipes that are gone
+diff = diff_documents(previous_documents, recipe_hashes)
+if diff["removed"]:
+    search_client.delete_documents([{"recipe_id": recipe_id} for recipe_id in diff["removed"]])
+    for recipe_id in diff["removed"]:
+        del manifest["documents"][recipe_id]
+    print(f"Deleted {len(diff['removed'])} documents")
+
+save_manifest(manifest_path, manifest)
+print(f"Sync complete: {format_diff(diff)}")
+print(f"Embedding cache: {embedding_cache.stats()}")
+print(f"Connection pools: {clients.pool_stats()}")
+print(f"Rate limits: {rate_limiter.stats()}")
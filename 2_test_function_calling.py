@@ -2,26 +2,7 @@ import os
 import json 
 import openai 
 from dotenv import load_dotenv
-from tenacity import retry, wait_random_exponential, stop_after_attempt
-from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient  
-from azure.search.documents.models import Vector  
-from azure.search.documents.indexes.models import (  
-    SearchIndex,  
-    SearchField,  
-    SearchFieldDataType,  
-    SimpleField,  
-    SearchableField,  
-    SearchIndex,  
-    SemanticConfiguration,  
-    PrioritizedFields,  
-    SemanticField,  
-    SearchField,  
-    SemanticSettings,  
-    VectorSearch,  
-    HnswVectorSearchAlgorithmConfiguration,
-)
+from router import router
 
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
@@ -29,7 +10,10 @@ openai.api_type = os.environ["OPENAI_API_TYPE"]
 openai.api_base = os.environ["OPENAI_API_BASE"]
 openai.api_version = os.environ["OPENAI_API_VERSION"]
 
-deployment_id='gpt-35-turbo'
+# OPENAI_ENDPOINTS (a JSON list, see router.py) spreads the requests over several endpoints
+router.configure_from(os.environ)
+
+deployment_id = os.environ.get("OPENAI_DEPLOYMENT_NAME", 'gpt-35-turbo')
 
 messages = [{"role": "user", "content": "Help me find a good lasagna recipe."}]
 
@@ -58,8 +42,9 @@ functions = [
     }
 ]
 
-response = openai.ChatCompletion.create(
-    deployment_id='gpt-35-turbo',
+response = router.create(
+    openai.ChatCompletion,
+    deployment_id,
     messages = messages,
     functions=functions,
     temperature=0.2,
@@ -1,27 +1,25 @@
 import os
 import json 
+import hashlib
+import functools
 import openai 
 from dotenv import load_dotenv
-from tenacity import retry, wait_random_exponential, stop_after_attempt
+from embeddings import generate_embeddings, embed_in_batches
+from local_search import LocalRecipeIndex
+from ann_index import IVFIndex
+from odata_filter import parse_filter, combine_filters, ODataFilterError
+from streaming import stream_conversation
+from semantic_cache import SemanticCache, cached_conversation, cached_stream
+from tool_cache import memoize_functions, MemoryBackend
+from embedding_cache import EmbeddingCache
+from typing import Optional
+from tool_registry import ToolRegistry
 from azure.core.credentials import AzureKeyCredential
-from azure.search.documents import SearchClient
-from azure.search.documents.indexes import SearchIndexClient  
 from azure.search.documents.models import Vector  
-from azure.search.documents.indexes.models import (  
-    SearchIndex,  
-    SearchField,  
-    SearchFieldDataType,  
-    SimpleField,  
-    SearchableField,  
-    SearchIndex,  
-    SemanticConfiguration,  
-    PrioritizedFields,  
-    SemanticField,  
-    SearchField,  
-    SemanticSettings,  
-    VectorSearch,  
-    HnswVectorSearchAlgorithmConfiguration,
-)
+from clients import ClientFactory
+from tracing import tracer, exporters_from_config
+from rate_limiter import rate_limiter, estimate_chat_tokens
+from router import router
 
 # load config values
 with open(r'config.json') as config_file:
@@ -33,71 +31,130 @@ index_name = config_details["SEARCH_INDEX_NAME"]
 key = config_details["SEARCH_ADMIN_KEY"]
 credential = AzureKeyCredential(key)
 
-# create the acs client to issue queries
-search_client = SearchClient(endpoint=service_endpoint, index_name=index_name, credential=credential)
+# one pool of keep-alive connections shared by the search client and the openai calls
+clients = ClientFactory(pool_maxsize=config_details.get("HTTP_POOL_MAXSIZE", 32),
+                        read_timeout=config_details.get("HTTP_READ_TIMEOUT", 60))
 
-# create the index client
-index_client = SearchIndexClient(endpoint=service_endpoint, credential=credential)
+# create the acs client to issue queries
+search_client = clients.search_client(service_endpoint, index_name, credential)
 
 load_dotenv()
 openai.api_key = os.environ["OPENAI_API_KEY"]
 openai.api_type = os.environ["OPENAI_API_TYPE"]
 openai.api_base = os.environ["OPENAI_API_BASE"]
 openai.api_version = os.environ["OPENAI_API_VERSION"]
-
-# function to generate embeddings for title and content fields, and to query embeddings
-@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6))
-def generate_embeddings(text):
-    response = openai.Embedding.create(
-        input=text, engine="text-embedding-ada-002")
-    embeddings = response['data'][0]['embedding']
-    return embeddings
-
-functions = [
-    {
-        "name": "query_recipes",
-        "description": "Retrieve recipes from the Azure Cognitive Search index",
-        "parameters": {
-            "type": "object",
-            "properties": {
-                "query": {
-                    "type": "string",
-                    "description": "The query string to search for recipes",
-                },
-                "ingredients_filter": {
-                    "type": "string",
-                    "description": "The odata filter to apply for the ingredients field. Only actual ingredient names should be used in this filter. If you're not sure something is an ingredient, don't include this filter. Example: ingredients/any(i: i eq 'salt' or i eq 'pepper')",
-                },
-                "time_filter": {
-                    "type": "string",
-                    "description": "The odata filter to apply for the total_time field. If a user asks for a quick or easy recipe, you should filter down to recipes that will take less than 30 minutes. Example: total_time lt 25",
-                }
-            },
-            "required": ["query"],
-        },
-    }
-]
+clients.configure_openai()
+
+# time every model call, tool call, embedding request and search; TRACE_JSONL, TRACE_OTLP and TRACE_PROMETHEUS
+# in config.json name the files the spans and aggregates are written to
+tracer.exporters.extend(exporters_from_config(config_details))
+tracer.instrument_session(clients.session)
+
+# RPM/TPM budgets per deployment (RATE_LIMITS in config.json); the service's rate-limit headers adjust them
+rate_limiter.configure_from(config_details)
+rate_limiter.instrument_session(clients.session, key_for=router.limit_key)
+
+# OPENAI_ENDPOINTS in config.json spreads the chat and embedding requests over several endpoints, with
+# failover between them; without it every request goes to OPENAI_API_BASE
+router.configure_from(config_details, session=clients.session)
+if router.endpoints:
+    router.start_health_checks(config_details.get("HEALTH_CHECK_INTERVAL", 30))
+
+# cache query embeddings on disk so repeated queries skip the embedding round-trip
+embedding_cache = EmbeddingCache(config_details.get("EMBEDDING_CACHE_DIR", ".embedding_cache"))
+
+# "azure" queries the Azure Cognitive Search index, "local" searches recipes_final.jsonl in-process
+search_backend = config_details.get("SEARCH_BACKEND", "azure")
+
+# open the connections at start-up so the user's first request does not pay for the TLS handshakes
+clients.warm_up([service_endpoint if search_backend == "azure" else None, openai.api_base]
+                + [endpoint.api_base for endpoint in router.endpoints])
+local_index = None
+if search_backend == "local":
+    # LOCAL_VECTOR_STORAGE trades a little recall for memory: "float32", "float16", "int8" or "pq"
+    local_index = LocalRecipeIndex.from_jsonl(
+        "recipes_final.jsonl", lambda texts: embed_in_batches(texts, cache=embedding_cache),
+        vector_storage=config_details.get("LOCAL_VECTOR_STORAGE", "float32"),
+        rerank_path=config_details.get("RERANK_VECTORS_PATH", ".rerank_vectors.npy"))
+
+    # "ivf" answers unfiltered vector queries from an approximate index saved on disk, "exact" scores every recipe
+    if config_details.get("LOCAL_VECTOR_INDEX", "exact") == "ivf":
+        ann_path = config_details.get("ANN_INDEX_PATH", ".ann_index")
+        # read once: a quantized store decodes all of its vectors on every access
+        vectors = local_index.vectors
+        if os.path.exists(ann_path):
+            ann = IVFIndex.load(ann_path)
+        else:
+            ann = IVFIndex(vectors.shape[1], nlist=config_details.get("ANN_NLIST", 64),
+                           nprobe=config_details.get("ANN_NPROBE", 8))
+            ann.train(vectors)
+        # bring the saved index in line with the current recipes: drop removed ones, and (re-)add new ones
+        # and those whose text changed since the index was saved, compared by a hash of the embedded text
+        recipe_hashes = {recipe['recipe_id']: hashlib.sha256(recipe['recipe'].encode("utf-8")).hexdigest()
+                         for recipe in local_index.recipes}
+        stale = [recipe_id for recipe_id in ann.row_by_id if recipe_id not in recipe_hashes]
+        missing = [recipe_id for recipe_id, recipe_hash in recipe_hashes.items()
+                   if ann.hash_by_id.get(recipe_id) != recipe_hash]
+        ann.delete(stale)
+        if missing:
+            ann.add(missing, vectors[[local_index.position_by_id[recipe_id] for recipe_id in missing]],
+                    hashes=[recipe_hashes[recipe_id] for recipe_id in missing])
+        if stale or missing:
+            ann.save(ann_path)
+        local_index.ann = ann
 
 # define function to call acs
-
-def query_recipes(query, ingredients_filter=None, time_filter=None):
-    filter = ""
-    if ingredients_filter and time_filter:
-        filter = f"{time_filter} and {ingredients_filter}"
-    elif ingredients_filter:
-        filter = ingredients_filter
-    elif time_filter:
-        filter = time_filter
-
-    results = search_client.search(
-        query_type="semantic",
-        query_language="en-us",
-        semantic_configuration_name="my-semantic-config",
-        search_text=query,
-        vectors=[Vector(value=generate_embeddings(query), k=3, fields="recipe_vector")],
-        filter=filter,
-        select=["recipe_id", "recipe", "recipe_category", "recipe_name", "description"],
-    )
+# its functions schema is derived from the signature and docstring below
+
+registry = ToolRegistry()
+
+@registry.tool()
+def query_recipes(query: str, ingredients_filter: Optional[str] = None, time_filter: Optional[str] = None):
+    """Retrieve recipes from the Azure Cognitive Search index
+
+    Args:
+        query: The query string to search for recipes
+        ingredients_filter: The odata filter to apply for the ingredients field. Only actual ingredient names
+            should be used in this filter. If you're not sure something is an ingredient, don't include this
+            filter. Example: ingredients/any(i: i eq 'salt' or i eq 'pepper')
+        time_filter: The odata filter to apply for the total_time field. If a user asks for a quick or easy
+            recipe, you should filter down to recipes that will take less than 30 minutes. Example: total_time lt 25
+    """
+    # each filter is parenthesized, so a top-level 'or' in one of them cannot escape the 'and'
+    filter = combine_filters(time_filter, ingredients_filter)
+
+    # reject malformed filters from the model here instead of paying for a failed search request
+    if filter:
+        try:
+            parse_filter(filter)
+        except ODataFilterError as error:
+            return f"Invalid filter: {error}. Fix the filter or call the function without it."
+
+    select = ["recipe_id", "recipe", "recipe_category", "recipe_name", "description"]
+    query_vector = generate_embeddings(query, cache=embedding_cache)
+    # the SDK sends the request on the first iteration and fetches further pages while iterating,
+    # so the span reads all results
+    with tracer.span("search", kind="search", backend=search_backend, filtered=bool(filter)) as span:
+        if local_index is not None:
+            results = local_index.search(
+                search_text=query,
+                vector=query_vector,
+                vector_k=3,
+                filter=filter,
+                select=select,
+            )
+        else:
+            results = search_client.search(
+                query_type="semantic",
+                query_language="en-us",
+                semantic_configuration_name="my-semantic-config",
+                search_text=query,
+                vectors=[Vector(value=query_vector, k=3, fields="recipe_vector")],
+                filter=filter,
+                select=select,
+            )
+        results = list(results)
+        span.set(results=len(results))
 
     n = 1
     recipes_for_prompt = ""
@@ -109,16 +166,25 @@ def query_recipes(query, ingredients_filter=None, time_filter=None):
 
 # end to end flow
 
-def run_conversation(messages, functions, available_functions, deployment_id):
+def run_conversation(messages, functions, available_functions, deployment_id, stream=False, metrics=None):
+
+    # with stream=True, return a generator of content deltas instead of the final response; it goes through the
+    # same tracing, rate limiter and router as the calls below (see streaming.py)
+    if stream:
+        return stream_conversation(messages, functions, available_functions, deployment_id,
+                                   temperature=0.2, max_rounds=1, metrics=metrics)
 
     # send the conversation and available functions to GPT
-    response = openai.ChatCompletion.create(
-        deployment_id=deployment_id,
-        messages=messages,
-        functions=functions,
-        function_call="auto",
-        temperature=0.2
-    )
+    with tracer.span("chat_completion", kind="model", deployment=deployment_id) as span:
+        response = span.record_usage(router.create(
+            openai.ChatCompletion,
+            deployment_id,
+            estimate_chat_tokens(messages, functions),
+            messages=messages,
+            functions=functions,
+            function_call="auto",
+            temperature=0.2
+        ))
     response_message = response["choices"][0]["message"]
 
     # check if the model wants to call a function
@@ -136,7 +202,8 @@ def run_conversation(messages, functions, available_functions, deployment_id):
         function_to_call = available_functions[function_name]
 
         function_args = json.loads(response_message["function_call"]["arguments"])
-        function_response = function_to_call(**function_args)
+        with tracer.span(function_name, kind="tool"):
+            function_response = function_to_call(**function_args)
 
         print("Output of function call:")
         print(function_response)
@@ -168,10 +235,13 @@ def run_conversation(messages, functions, available_functions, deployment_id):
             print(message)
         print()
 
-        second_response = openai.ChatCompletion.create(
-            messages = messages,
-            deployment_id=deployment_id
-        )
+        with tracer.span("chat_completion", kind="model", deployment=deployment_id) as span:
+            second_response = span.record_usage(router.create(
+                openai.ChatCompletion,
+                deployment_id,
+                estimate_chat_tokens(messages),
+                messages = messages
+            ))
 
         return second_response
     else:
@@ -187,11 +257,52 @@ You are designed to be an interactive assistant, so you can ask users clarifying
 messages = [{"role": "system", "content": system_message},
             {"role": "user", "content": "I want to make a pasta dish that takes less than 60 minutes to make."}]
 
-deployment_name='gpt-35-turbo'
-
-available_functions = {'query_recipes': query_recipes}
-
-result = run_conversation(messages, functions, available_functions, deployment_name)
-
-print("Final response:")
-print(result['choices'][0]['message']['content'])
\ No newline at end of file
+deployment_name = os.environ.get("OPENAI_DEPLOYMENT_NAME", 'gpt-35-turbo')
+
+functions = registry.functions()
+available_functions = registry.available_functions()
+
+# memoize query_recipes for identical arguments; call tool_cache.invalidate('query_recipes') after re-indexing
+tool_cache = MemoryBackend(max_entries=512)
+available_functions = memoize_functions(available_functions, ttls={'query_recipes': 600}, backend=tool_cache)
+
+# set SEMANTIC_CACHE to true in config.json to answer near-identical requests from a semantic cache
+stream_metrics = []
+conversation_runner = run_conversation
+stream_runner = functools.partial(run_conversation, stream=True, metrics=stream_metrics)
+semantic_cache = None
+if config_details.get("SEMANTIC_CACHE", False):
+    semantic_cache = SemanticCache(lambda text: generate_embeddings(text, cache=embedding_cache),
+                                   threshold=config_details.get("SEMANTIC_CACHE_THRESHOLD", 0.95),
+                                   ttl_seconds=config_details.get("SEMANTIC_CACHE_TTL", 3600))
+    # answers built from the recipe index go stale when the loader re-syncs it
+    semantic_cache.watch_file(config_details.get("INDEX_MANIFEST_PATH", "index_manifest.json"), "query_recipes")
+    conversation_runner = cached_conversation(semantic_cache, run_conversation)
+    stream_runner = cached_stream(semantic_cache, stream_runner)
+
+# set STREAM to true in config.json to print the final answer as it is generated
+if config_details.get("STREAM", False):
+    print("Final response:")
+    with tracer.span("conversation", stream=True):
+        for delta in stream_runner(messages, functions, available_functions, deployment_name):
+            print(delta, end="", flush=True)
+    print()
+    for call_metrics in stream_metrics:
+        print(f"Time to first token: {call_metrics['time_to_first_token']:.2f}s "
+              f"(total {call_metrics['total_time']:.2f}s)")
+else:
+    with tracer.span("conversation"):
+        result = conversation_runner(messages, functions, available_functions, deployment_name)
+
+    print("Final response:")
+    print(result['choices'][0]['message']['content'])
+if semantic_cache is not None:
+    print(f"Semantic cache: {semantic_cache.stats()}")
+print(f"Embedding cache: {embedding_cache.stats()}")
+print(f"Connection pools: {clients.pool_stats()}")
+print(f"Rate limits: {rate_limiter.stats()}")
+if router.endpoints:
+    print(f"Endpoints: {router.stats()}")
+    router.close()
+tracer.print_summary()
+tracer.close()
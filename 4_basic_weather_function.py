@@ -2,6 +2,7 @@ import openai
 import json
 import os
 from dotenv import load_dotenv
+from router import router
 
 # load env variables
 load_dotenv()
@@ -10,7 +11,10 @@ openai.api_type = os.environ["OPENAI_API_TYPE"]
 openai.api_base = os.environ["OPENAI_API_BASE"]
 openai.api_version = os.environ["OPENAI_API_VERSION"]
 
-deployment_name = 'gpt-35-turbo'
+# OPENAI_ENDPOINTS (a JSON list, see router.py) spreads the requests over several endpoints
+router.configure_from(os.environ)
+
+deployment_name = os.environ.get("OPENAI_DEPLOYMENT_NAME", 'gpt-35-turbo')
 
 # call the model with the user query and the set of defined functions in the functions parameter
 # the model can choose if it calls a function. If so, the content will be a stringfied JSON object
@@ -37,8 +41,9 @@ def get_function_call(messages, function_call = "auto"):
     ]
 
     # call the model with the user query (messages) and the functions defined in the functions parameter
-    response = openai.ChatCompletion.create(
-        deployment_id = deployment_name,
+    response = router.create(
+        openai.ChatCompletion,
+        deployment_name,
         messages = messages,
         functions = functions,
         function_call = function_call
@@ -1,10 +1,18 @@
 import openai
 import json
 import os
+import time
 from dotenv import load_dotenv
-import pytz
-from datetime import datetime
-import pandas as pd
+from streaming import stream_conversation
+from tool_cache import memoize_functions, MemoryBackend, ToolCacheStats
+from parallel_tools import as_tools, assistant_tool_calls_message, execute_tool_calls, ToolCallTrace
+from schema_validator import ArgumentValidator
+from tools import registry
+from context_window import ContextWindow
+from clients import ClientFactory
+from tracing import tracer
+from rate_limiter import rate_limiter, estimate_chat_tokens
+from router import router
 
 # load env variables
 load_dotenv()
@@ -13,146 +21,59 @@ openai.api_type = os.environ["OPENAI_API_TYPE"]
 openai.api_base = os.environ["OPENAI_API_BASE"]
 openai.api_version = os.environ["OPENAI_API_VERSION"]
 
-deployment_id = 'gpt-35-turbo'
+# reuse keep-alive connections for every model call, opened before the first request
+clients = ClientFactory().configure_openai()
+# OPENAI_ENDPOINTS (a JSON list, see router.py) spreads the requests over several endpoints with failover
+router.configure_from(os.environ, session=clients.session)
+clients.warm_up([openai.api_base] + [endpoint.api_base for endpoint in router.endpoints])
+# record the HTTP requests and payload sizes of every span, see tracing.py
+tracer.instrument_session(clients.session)
+# hold requests back while the deployment answers 429, instead of sending them into the same limit again
+rate_limiter.instrument_session(clients.session, key_for=router.limit_key)
 
-# function 1 get current time
+deployment_id = os.environ.get("OPENAI_DEPLOYMENT_NAME", 'gpt-35-turbo')
 
-def get_current_time(location):
-    try:
-        # get the timezone for the city
-        timezone = pytz.timezone(location)
+# the tools (get_current_time, stock market data and analytics, calculator) are defined in tools.py;
+# their schemas are derived from the function signatures and docstrings by the registry
 
-        # get current time in timezone
-        now = datetime.now(timezone)
-        current_time = now.strftime("%I:%M:%S %p")
-
-        return current_time
-    except:
-        return "Sorry, I couldn't find the timezone for that location"
-    
-# function 2 get stock market data
-
-def get_stock_market_data(index):
-
-    available_indices = ["S&P 500", "NASDAQ Composite", "Dow Jones Industrial Average", "Financial Times Stock Exchange 100 Index"]
-
-    if index not in available_indices:
-        return "Invalid index. Please choose from 'S&P 500', 'NASDAQ Composite', 'Dow Jones Industrial Average', 'Financial Times Stock Exchange 100 Index'."
-
-    # Read the CSV file
-    data = pd.read_csv('stock_data.csv')
-
-    # Filter data for the given index
-    data_filtered = data[data['Index'] == index]
-
-    # Remove 'Index' column
-    data_filtered = data_filtered.drop(columns=['Index'])
-
-    # Convert the DataFrame into a dictionary
-    hist_dict = data_filtered.to_dict()
-
-    for key, value_dict in hist_dict.items():
-        hist_dict[key] = {k: v for k, v in value_dict.items()}
-
-    return json.dumps(hist_dict)
-
-# function 3 calculator
-
-import math
-
-def calculator(num1, num2, operator):
-    if operator == '+':
-        return str(num1 + num2)
-    elif operator == '-':
-        return str(num1 - num2)
-    elif operator == '*':
-        return str(num1 * num2)
-    elif operator == '/':
-        return str(num1 / num2)
-    elif operator == '**':
-        return str(num1 ** num2)
-    elif operator == 'sqrt':
-        return str(math.sqrt(num1))
-    else:
-        return "Invalid operator"
-    
 # 1. Call the model with the user query and a set of functions defined in the functions parameter
 # 2. The model can choose to call a function; if so, the content will be a stringfied JSON object adhering to your custom schema 
 # 3. Parse the string into JSON in your code, and call your function with the provided arguments if they exist
 # 4. Call the model again by appending the function response as a new message, and let the model summarize the results back to the user
 
-functions = [
-        {
-            "name": "get_current_time",
-            "description": "Get the current time in a given location",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "location": {
-                        "type": "string",
-                        "description": "The location name. The pytz is used to get the timezone for that location. Location names should be in a format like America/New_York, Asia/Bangkok, Europe/London",
-                    }
-                },
-                "required": ["location"],
-            },
-        },
-        {
-            "name": "get_stock_market_data",
-            "description": "Get the stock market data for a given index",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "index": {
-                        "type": "string",
-                        "enum": ["S&P 500", "NASDAQ Composite", "Dow Jones Industrial Average", "Financial Times Stock Exchange 100 Index"]},
-                },
-                "required": ["index"],
-            },    
-        },
-             {
-            "name": "calculator",
-            "description": "A simple calculator used to perform basic arithmetic operations",
-            "parameters": {
-                "type": "object",
-                "properties": {
-                    "num1": {"type": "number"},
-                    "num2": {"type": "number"},
-                    "operator": {"type": "string", "enum": ["+", "-", "*", "/", "**", "sqrt"]},
-                },
-                "required": ["num1", "num2", "operator"],
-            },
-        }
-    ]
+functions = registry.functions()
 
-available_functions = {
-            "get_current_time": get_current_time,
-            "get_stock_market_data": get_stock_market_data,
-            "calculator": calculator,
-        } 
+available_functions = registry.available_functions()
 
-# define a helper function to validate the function call
+# memoize tool results: a repeated call with the same arguments within the TTL reuses the previous result
+# get_current_time is never cached; use SqliteBackend("tool_cache.sqlite") to share results between workers
+tool_cache_stats = ToolCacheStats()
+available_functions = memoize_functions(
+    available_functions,
+    ttls={"get_stock_market_data": 60, "calculator": 24 * 3600},
+    non_cacheable={"get_current_time"},
+    backend=MemoryBackend(max_entries=256),
+    stats=tool_cache_stats,
+)
 
-import inspect
+# define a helper to validate the function call
 
-# helper method used to check if the correct arguments are provided to a function
-def check_args(function, args):
-    sig = inspect.signature(function)
-    params = sig.parameters
+# the functions schemas are compiled once into checkers for types, enums and required arguments
+# check_args(function, args) returns None when the call is valid, otherwise a JSON error for the model
+argument_validator = ArgumentValidator(functions, available_functions)
+check_args = argument_validator.check
 
-    # Check if there are extra arguments
-    for name in args:
-        if name not in params:
-            return False
-    # Check if the required arguments are provided 
-    for name, param in params.items():
-        if param.default is param.empty and name not in args:
-            return False
-
-    return True
+# every model call gets a span with its latency and token usage, waits for its turn on the deployment and
+# goes to the endpoint the router picks
+def create_chat_completion(deployment_id, **kwargs):
+    with tracer.span("chat_completion", kind="model", deployment=deployment_id) as span:
+        return span.record_usage(router.create(
+            openai.ChatCompletion, deployment_id,
+            estimate_chat_tokens(kwargs["messages"], kwargs.get("functions") or kwargs.get("tools")), **kwargs))
 
 def run_conversation(messages, functions, available_functions, deployment_id):
 
-    response = openai.ChatCompletion.create(
+    response = create_chat_completion(
         deployment_id=deployment_id,
         messages=messages,
         functions=functions,
@@ -172,11 +93,10 @@ def run_conversation(messages, functions, available_functions, deployment_id):
             return "Function" + function_name + "does not exist"
         function_to_call = available_functions[function_name]
 
-        # verify function has correct number of arguments
+        # verify the arguments match the function schema; errors are sent back to the model
         function_args = json.loads(response_message["function_call"]["arguments"])
-        if check_args(function_to_call, function_args) is False:
-            return "Invalid number of arguments for function: " + function_name
-        function_response = function_to_call(**function_args)
+        with tracer.span(function_name, kind="tool"):
+            function_response = check_args(function_to_call, function_args) or function_to_call(**function_args)
         
         print("Output of function call:")
         print(function_response)
@@ -208,7 +128,7 @@ def run_conversation(messages, functions, available_functions, deployment_id):
             print(message)
         print()
 
-        second_response = openai.ChatCompletion.create(
+        second_response = create_chat_completion(
             messages=messages,
             deployment_id=deployment_id
         )  # get a new response from GPT where it can see the function response
@@ -219,19 +139,38 @@ def run_conversation(messages, functions, available_functions, deployment_id):
 # assistant_response = run_conversation(messages, functions, available_functions, deployment_id)
 # print(assistant_response['choices'][0]['message'])
 
-def run_multiturn_conversation(messages, functions, available_functions, deployment_name):
+def run_multiturn_conversation(messages, functions, available_functions, deployment_name, stream=False, metrics=None,
+                               parallel_tool_calls=False, max_iterations=10, tool_timeout=30, trace=None,
+                               context_window=None):
+    # with stream=True, return a generator of content deltas; tools start as soon as their arguments are complete
+    if stream:
+        return stream_conversation(messages, functions, available_functions, deployment_name,
+                                   temperature=0, metrics=metrics, validate=check_args, context_window=context_window)
+
+    # with parallel_tool_calls=True the model may ask for several tools in one message (tools / tool_calls format)
+    if parallel_tool_calls:
+        return run_parallel_tool_conversation(messages, functions, available_functions, deployment_name,
+                                              max_iterations, tool_timeout, trace, context_window)
+
+    trace = trace if trace is not None else ToolCallTrace()
+    # messages keeps the full history; each request sends what fits the context window's token budget
+    prompt = context_window.fit if context_window is not None else lambda messages, functions: messages
+
     # Step 1: send the conversation and available functions to GPT
 
-    response = openai.ChatCompletion.create(
+    response = create_chat_completion(
         deployment_id=deployment_name,
-        messages=messages,
+        messages=prompt(messages, functions),
         functions=functions,
         function_call="auto", 
         temperature=0
     )
+    trace.record_model_call()
 
     # Step 2: check if GPT wanted to call a function
-    while response["choices"][0]["finish_reason"] == 'function_call':
+    iterations = 0
+    while response["choices"][0]["finish_reason"] == 'function_call' and iterations < max_iterations:
+        iterations += 1
         response_message = response["choices"][0]["message"]
         print("Recommended Function call:")
         print(response_message.get("function_call"))
@@ -247,11 +186,12 @@ def run_multiturn_conversation(messages, functions, available_functions, deploym
             return "Function " + function_name + " does not exist"
         function_to_call = available_functions[function_name]  
         
-        # verify function has correct number of arguments
+        # verify the arguments match the function schema; errors are sent back to the model so it can retry
         function_args = json.loads(response_message["function_call"]["arguments"])
-        if check_args(function_to_call, function_args) is False:
-            return "Invalid number of arguments for function: " + function_name
-        function_response = function_to_call(**function_args)
+        tool_started = time.perf_counter()
+        with tracer.span(function_name, kind="tool"):
+            function_response = check_args(function_to_call, function_args) or function_to_call(**function_args)
+        trace.record_round(1, time.perf_counter() - tool_started)
         
         print("Output of function call:")
         print(function_response)
@@ -285,21 +225,106 @@ def run_multiturn_conversation(messages, functions, available_functions, deploym
             print(message)
         print()
 
-        response = openai.ChatCompletion.create(
-            messages=messages,
+        response = create_chat_completion(
+            messages=prompt(messages, functions),
             deployment_id=deployment_name,
             function_call="auto",
             functions=functions,
             temperature=0
         )  # get a new response from GPT where it can see the function response
+        trace.record_model_call()
+
+    # the model still wants a function after max_iterations: its message is a call, not an answer
+    if response["choices"][0]["finish_reason"] == 'function_call':
+        return "Too many function calls: stopped after " + str(max_iterations) + " iterations"
+    return response
+
+def run_parallel_tool_conversation(messages, functions, available_functions, deployment_name,
+                                   max_iterations=10, tool_timeout=30, trace=None, context_window=None):
+    trace = trace if trace is not None else ToolCallTrace()
+    tools = as_tools(functions)
+    prompt = context_window.fit if context_window is not None else lambda messages, tools: messages
+
+    response = create_chat_completion(
+        deployment_id=deployment_name,
+        messages=prompt(messages, tools),
+        tools=tools,
+        tool_choice="auto",
+        temperature=0
+    )
+    trace.record_model_call()
+
+    iterations = 0
+    while response["choices"][0]["finish_reason"] == 'tool_calls' and iterations < max_iterations:
+        iterations += 1
+        response_message = response["choices"][0]["message"]
+        print(f"Recommended tool calls ({len(response_message['tool_calls'])}):")
+        for tool_call in response_message["tool_calls"]:
+            print(tool_call["function"])
+        print()
 
+        # run all requested calls concurrently, then append every result before asking the model again
+        tool_started = time.perf_counter()
+        tool_messages = execute_tool_calls(response_message["tool_calls"], available_functions,
+                                           timeout=tool_timeout, validate=check_args)
+        trace.record_round(len(tool_messages), time.perf_counter() - tool_started)
+
+        print("Output of tool calls:")
+        for tool_message in tool_messages:
+            print(tool_message["content"])
+        print()
+
+        messages.append(assistant_tool_calls_message(response_message))
+        messages.extend(tool_messages)
+
+        response = create_chat_completion(
+            messages=prompt(messages, tools),
+            deployment_id=deployment_name,
+            tools=tools,
+            tool_choice="auto",
+            temperature=0
+        )
+        trace.record_model_call()
+
+    if response["choices"][0]["finish_reason"] == 'tool_calls':
+        return "Too many tool calls: stopped after " + str(max_iterations) + " iterations"
     return response
 
 # Can add system prompting to guide the model to call functions and perform in specific ways
 next_messages = [{"role": "system", "content": "Assistant is a helpful assistant that helps users get answers to questions. Assistant has access to several tools and sometimes you may need to call multiple tools in sequence to get answers for your users."}]
 next_messages.append({"role": "user", "content": "How much did S&P 500 change between July 12 and July 13? Use the calculator."})
 
-assistant_response = run_multiturn_conversation(next_messages, functions, available_functions, deployment_id)
+# parallel tool calls need API version 2023-12-01-preview or later; older versions use the function_call loop
+parallel_tool_calls = os.environ["OPENAI_API_VERSION"] >= "2023-12-01"
+conversation_trace = ToolCallTrace()
+
+# keep every request under a prompt budget: long tool outputs are cut, the oldest turns dropped
+context_window = ContextWindow(max_prompt_tokens=3000, max_tool_tokens=1000)
+
+# only send the tools relevant to this conversation (chosen by keyword); fewer schemas, fewer prompt tokens
+conversation_functions = registry.functions(registry.select(next_messages))
+
+with tracer.span("conversation"):
+    assistant_response = run_multiturn_conversation(next_messages, conversation_functions, available_functions,
+                                                    deployment_id, parallel_tool_calls=parallel_tool_calls,
+                                                    trace=conversation_trace, context_window=context_window)
 print("Final Response:")
-print(assistant_response["choices"][0]["message"])
-print("Conversation complete!") 
\ No newline at end of file
+# the loops return a string when they give up, e.g. on an unknown function or after max_iterations
+print(assistant_response if isinstance(assistant_response, str) else assistant_response["choices"][0]["message"])
+print("Conversation complete!")
+print(f"Trace: {conversation_trace.summary()}")
+print(f"Tool cache: {tool_cache_stats.as_dict()}")
+print(f"Context window: {context_window.last_stats}")
+print(f"Rate limits: {rate_limiter.stats()}")
+if router.endpoints:
+    print(f"Endpoints: {router.stats()}")
+    router.close()
+tracer.print_summary()
+
+# streaming: print the answer as it is generated and report time to first token for every model call
+# stream_metrics = []
+# for delta in run_multiturn_conversation(next_messages, conversation_functions, available_functions, deployment_id,
+#                                         stream=True, metrics=stream_metrics):
+#     print(delta, end="", flush=True)
+# print()
+# print(stream_metrics) 
\ No newline at end of file
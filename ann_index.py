@@ -0,0 +1,176 @@
+import os
+import json
+import numpy as np
+from vector_ops import normalize_rows, top_k
+
+# inverted-file (IVF) approximate nearest neighbour index for the local recipe store
+# vectors are clustered around nlist k-means centroids; a query only scores the vectors in its
+# nprobe closest clusters, so search cost grows with n * nprobe / nlist instead of n.
+# entries are keyed by recipe_id and can be inserted or deleted at any time; save() writes plain
+# .npy files that load() maps into memory, so opening a large index does not read it up front.
+# add() can record a content hash per id (hash_by_id), saved with the index, so a caller can tell
+# which saved vectors are out of date and re-add them
+
+
+def kmeans(vectors, n_clusters, iterations=10, seed=0):
+    rng = np.random.default_rng(seed)
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(vectors @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        empty = counts == 0
+        # restart empty clusters from random points so every list stays useful
+        sums[empty] = vectors[rng.choice(len(vectors), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class IVFIndex:
+    def __init__(self, dim, nlist=64, nprobe=8):
+        self.dim = dim
+        self.nlist = nlist
+        self.nprobe = nprobe
+        self.centroids = None
+        self._vectors = np.zeros((0, dim), dtype=np.float32)
+        self._assignments = np.zeros(0, dtype=np.int32)
+        self._live = np.zeros(0, dtype=bool)
+        self._size = 0
+        self.ids = []
+        self.row_by_id = {}
+        self.hash_by_id = {}
+        self._lists = None
+
+    def __len__(self):
+        return len(self.row_by_id)
+
+    def train(self, vectors, iterations=10, seed=0):
+        vectors = normalize_rows(vectors)
+        # a sample of a few dozen points per list is enough to place the centroids
+        sample_size = min(len(vectors), self.nlist * 64)
+        sample = vectors[np.random.default_rng(seed).choice(len(vectors), sample_size, replace=False)]
+        self.centroids = kmeans(sample, self.nlist, iterations, seed)
+        self.nlist = len(self.centroids)
+        self._lists = None
+
+    def _reserve(self, extra):
+        needed = self._size + extra
+        if needed <= len(self._vectors) and self._vectors.flags.writeable:
+            return
+        capacity = max(needed, 2 * len(self._vectors), 1024)
+        vectors = np.zeros((capacity, self.dim), dtype=np.float32)
+        vectors[:self._size] = self._vectors[:self._size]
+        assignments = np.zeros(capacity, dtype=np.int32)
+        assignments[:self._size] = self._assignments[:self._size]
+        live = np.zeros(capacity, dtype=bool)
+        live[:self._size] = self._live[:self._size]
+        self._vectors, self._assignments, self._live = vectors, assignments, live
+
+    # hashes: optional content hash per id, e.g. of the text the vector was embedded from
+    def add(self, ids, vectors, hashes=None):
+        if self.centroids is None:
+            raise ValueError("IVFIndex must be trained before vectors are added")
+        vectors = normalize_rows(np.atleast_2d(vectors))
+        # inserting an existing id replaces its vector
+        self.delete([recipe_id for recipe_id in ids if recipe_id in self.row_by_id])
+        self._reserve(len(ids))
+        rows = np.arange(self._size, self._size + len(ids))
+        self._vectors[rows] = vectors
+        self._assignments[rows] = np.argmax(vectors @ self.centroids.T, axis=1)
+        self._live[rows] = True
+        for recipe_id, row in zip(ids, rows):
+            self.ids.append(recipe_id)
+            self.row_by_id[recipe_id] = int(row)
+        if hashes is not None:
+            self.hash_by_id.update(zip(ids, hashes))
+        self._size += len(ids)
+        self._lists = None
+
+    def delete(self, ids):
+        for recipe_id in ids:
+            row = self.row_by_id.pop(recipe_id, None)
+            self.hash_by_id.pop(recipe_id, None)
+            if row is not None:
+                if not self._live.flags.writeable:
+                    self._live = self._live.copy()
+                self._live[row] = False
+        if ids:
+            self._lists = None
+
+    def _inverted_lists(self):
+        # rows of each cluster, built lazily with one argsort after inserts or deletes
+        if self._lists is None:
+            live_rows = np.flatnonzero(self._live[:self._size])
+            assignments = self._assignments[live_rows]
+            order = np.argsort(assignments, kind="stable")
+            bounds = np.searchsorted(assignments[order], np.arange(self.nlist + 1))
+            sorted_rows = live_rows[order]
+            self._lists = [sorted_rows[bounds[i]:bounds[i + 1]] for i in range(self.nlist)]
+        return self._lists
+
+    # returns, for each query, a list of (recipe_id, cosine similarity) best first
+    def search(self, query_vectors, k, nprobe=None):
+        nprobe = min(nprobe or self.nprobe, self.nlist)
+        query_vectors = normalize_rows(np.atleast_2d(query_vectors))
+        lists = self._inverted_lists()
+        probes = top_k(query_vectors @ self.centroids.T, nprobe)
+        results = []
+        for query, probe in zip(query_vectors, probes):
+            rows = np.concatenate([lists[cluster] for cluster in probe])
+            if len(rows) == 0:
+                results.append([])
+                continue
+            scores = self._vectors[rows] @ query
+            best = top_k(scores, k)
+            results.append([(self.ids[rows[i]], float(scores[i])) for i in best])
+        return results
+
+    def save(self, path):
+        os.makedirs(path, exist_ok=True)
+        # compact out deleted rows into memory first: the current arrays may be memory-mapped from
+        # the very files being written, and reading them after those files are rewritten would fault
+        live_rows = np.flatnonzero(self._live[:self._size])
+        vectors = np.array(self._vectors[live_rows], dtype=np.float32)
+        assignments = np.array(self._assignments[live_rows], dtype=np.int32)
+        live_ids = [self.ids[row] for row in live_rows]
+        meta = {"dim": self.dim, "nprobe": self.nprobe, "ids": live_ids,
+                "hashes": [self.hash_by_id.get(recipe_id) for recipe_id in live_ids]}
+        # each file is written next to its target and swapped in, so a reader never sees half a file
+        for name, array in [("centroids.npy", self.centroids), ("vectors.npy", vectors), ("assignments.npy", assignments)]:
+            target = os.path.join(path, name)
+            with open(target + ".tmp", "wb") as array_file:
+                np.save(array_file, array)
+            os.replace(target + ".tmp", target)
+        target = os.path.join(path, "ids.json")
+        with open(target + ".tmp", "w") as ids_file:
+            json.dump(meta, ids_file)
+        os.replace(target + ".tmp", target)
+        # carry on from the compacted in-memory copy
+        self._vectors, self._assignments = vectors, assignments
+        self._live = np.ones(len(live_ids), dtype=bool)
+        self._size = len(live_ids)
+        self.ids = live_ids
+        self.row_by_id = {recipe_id: row for row, recipe_id in enumerate(live_ids)}
+        self._lists = None
+
+    @classmethod
+    def load(cls, path, mmap=True):
+        mode = "r" if mmap else None
+        with open(os.path.join(path, "ids.json"), "r") as ids_file:
+            meta = json.load(ids_file)
+        centroids = np.load(os.path.join(path, "centroids.npy"))
+        index = cls(meta["dim"], nlist=len(centroids), nprobe=meta["nprobe"])
+        index.centroids = centroids
+        # memory-mapped arrays are read-only; the first insert copies them into writable memory
+        index._vectors = np.load(os.path.join(path, "vectors.npy"), mmap_mode=mode)
+        index._assignments = np.load(os.path.join(path, "assignments.npy"), mmap_mode=mode)
+        index._size = len(index._vectors)
+        index._live = np.ones(index._size, dtype=bool)
+        index.ids = meta["ids"]
+        index.row_by_id = {recipe_id: row for row, recipe_id in enumerate(index.ids)}
+        # indexes saved before hashes were recorded have none; their ids count as changed
+        index.hash_by_id = {recipe_id: content_hash for recipe_id, content_hash in zip(index.ids, meta.get("hashes") or [])
+                            if content_hash is not None}
+        return index
@@ -0,0 +1,235 @@
+import json
+import asyncio
+import functools
+import contextlib
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, retry_if_exception_type, wait_random_exponential, stop_after_attempt
+from tracing import tracer, retry_hook
+from rate_limiter import estimate_chat_tokens, INTERACTIVE
+from router import router
+from embeddings import generate_embeddings_async, embedding_engine
+from streaming import StreamState, append_function_messages
+
+# asyncio version of the function-calling loop in run_multiturn_conversation
+# one event loop can drive thousands of conversations at once: every model and embedding call is awaited,
+# synchronous tools (query_recipes, get_stock_market_data, ...) run in a thread pool, and a semaphore per
+# deployment caps how many requests are in flight against it, so throughput is bound by the API limits.
+# every model call also takes a ticket from the process-wide rate limiter at the runner's priority, so
+# a batch run at BULK priority yields to interactive conversations in the same process
+
+# errors worth sending a model request again for; the rest (bad request, authentication, ...) fail right away
+retryable_errors = (openai.error.RateLimitError, openai.error.APIError, openai.error.Timeout,
+                    openai.error.APIConnectionError, openai.error.ServiceUnavailableError, openai.error.TryAgain)
+
+backoff = wait_random_exponential(min=1, max=20)
+
+
+# a 429 was reported to the rate limiter, which holds every request to the deployment until its Retry-After has
+# passed, so the next attempt goes straight back to the limiter; other errors back off like the embedding calls
+def wait_for_retry(retry_state):
+    if isinstance(retry_state.outcome.exception(), openai.error.RateLimitError):
+        return 0
+    return backoff(retry_state)
+
+
+retry_request = retry(retry=retry_if_exception_type(retryable_errors), wait=wait_for_retry,
+                      stop=stop_after_attempt(6), before_sleep=retry_hook, reraise=True)
+
+
+class AsyncConversationRunner:
+    def __init__(self, available_functions, max_concurrent_requests=32, tool_workers=32, max_rounds=10,
+                 validate=None, aiosession=None, priority=INTERACTIVE):
+        self.available_functions = available_functions
+        self.priority = priority
+        self.validate = validate
+        # optional pooled aiohttp session (clients.create_aiohttp_session); without one openai opens a new
+        # session, and so new connections, for every request
+        self.aiosession = aiosession
+        self.max_concurrent_requests = max_concurrent_requests
+        self.max_rounds = max_rounds
+        self._semaphores = {}
+        self._in_flight = {}
+        self._executor = ThreadPoolExecutor(max_workers=tool_workers, thread_name_prefix="tool")
+
+    def _semaphore(self, deployment_id):
+        # created lazily so the runner can be built outside of the event loop
+        if deployment_id not in self._semaphores:
+            self._semaphores[deployment_id] = asyncio.Semaphore(self.max_concurrent_requests)
+        return self._semaphores[deployment_id]
+
+    async def _take_slot(self, deployment_id):
+        await self._semaphore(deployment_id).acquire()
+        self._in_flight[deployment_id] = self._in_flight.get(deployment_id, 0) + 1
+
+    def _release_slot(self, deployment_id):
+        self._in_flight[deployment_id] -= 1
+        self._semaphore(deployment_id).release()
+
+    @contextlib.asynccontextmanager
+    async def _slot(self, deployment_id):
+        await self._take_slot(deployment_id)
+        try:
+            yield
+        finally:
+            self._release_slot(deployment_id)
+
+    def in_flight(self):
+        return dict(self._in_flight)
+
+    def _use_session(self):
+        # openai.aiosession is a context variable, so setting it here only affects the current task
+        if self.aiosession is not None:
+            openai.aiosession.set(self.aiosession)
+
+    # one span per model call, around the retries, like the synchronous loops
+    async def chat(self, deployment_id, **kwargs):
+        with tracer.span("chat_completion", kind="model", deployment=deployment_id) as span:
+            return span.record_usage(await self._create_chat(deployment_id, **kwargs))
+
+    # the router picks the endpoint, takes the rate limiter ticket for it at the runner's priority and
+    # reports the outcome to the limiter; the limiter hands the unused part of the estimate back
+    def _send(self, deployment_id, kwargs):
+        return router.acreate(openai.ChatCompletion, deployment_id,
+                              estimate_chat_tokens(kwargs["messages"], kwargs.get("functions")), self.priority,
+                              **kwargs)
+
+    # the backoff between attempts happens outside the semaphore so it does not hold a slot; every attempt
+    # waits for the limiter, so a retry after a 429 also waits out the Retry-After. that wait is inside the
+    # slot, since the budget waited for is that of the endpoint the router picks for the attempt
+    @retry_request
+    async def _create_chat(self, deployment_id, **kwargs):
+        self._use_session()
+        async with self._slot(deployment_id):
+            return await self._send(deployment_id, kwargs)
+
+    # only opening the stream is retried; once chunks have been yielded the request cannot be repeated.
+    # each attempt takes the deployment slot and a successful one returns with it held, so the backoff
+    # between attempts does not hold a slot; the caller releases it once the stream has been read.
+    # a stream reports no usage, so the estimate stays charged
+    @retry_request
+    async def _open_stream(self, deployment_id, **kwargs):
+        await self._take_slot(deployment_id)
+        try:
+            return await self._send(deployment_id, dict(kwargs, stream=True))
+        except BaseException:
+            self._release_slot(deployment_id)
+            raise
+
+    # like a chat call, each attempt holds the engine's slot and the backoff between attempts does not
+    async def embed(self, text, engine=embedding_engine, cache=None):
+        self._use_session()
+        return await generate_embeddings_async(text, engine, cache, self.priority, slot=lambda: self._slot(engine))
+
+    async def call_tool(self, function_name, function_args):
+        with tracer.span(function_name, kind="tool"):
+            return await self._invoke(self.available_functions[function_name], function_args)
+
+    async def _invoke(self, function_to_call, function_args):
+        if asyncio.iscoroutinefunction(function_to_call):
+            return await function_to_call(**function_args)
+        loop = asyncio.get_running_loop()
+        return await loop.run_in_executor(self._executor, functools.partial(function_to_call, **function_args))
+
+    async def run_conversation(self, messages, functions, deployment_id, temperature=0):
+        response = await self.chat(deployment_id, messages=messages, functions=functions,
+                                   function_call="auto", temperature=temperature)
+
+        rounds = 0
+        while response["choices"][0]["finish_reason"] == "function_call" and rounds < self.max_rounds:
+            rounds += 1
+            response_message = response["choices"][0]["message"]
+            function_name = response_message["function_call"]["name"]
+
+            # verify function exists
+            if function_name not in self.available_functions:
+                return "Function " + function_name + " does not exist"
+
+            function_args = json.loads(response_message["function_call"]["arguments"])
+            function_response = None
+            if self.validate is not None:
+                # an error string is sent back to the model instead of calling the tool
+                function_response = self.validate(self.available_functions[function_name], function_args)
+            if not isinstance(function_response, str):
+                function_response = await self.call_tool(function_name, function_args)
+
+            # adding assistant response and function response to messages
+            messages.append(
+                {
+                    "role": response_message["role"],
+                    "function_call": {
+                        "name": function_name,
+                        "arguments": response_message["function_call"]["arguments"],
+                    },
+                    "content": None
+                }
+            )
+            messages.append(
+                {
+                    "role": "function",
+                    "name": function_name,
+                    "content": function_response,
+                }
+            )
+
+            response = await self.chat(deployment_id, messages=messages, functions=functions,
+                                       function_call="auto", temperature=temperature)
+
+        if response["choices"][0]["finish_reason"] == "function_call":
+            return "Too many function calls: stopped after " + str(self.max_rounds) + " rounds"
+        return response
+
+    # async generator over the content deltas of a conversation, see streaming.stream_conversation
+    async def stream_conversation(self, messages, functions, deployment_id, temperature=0, metrics=None):
+        async def traced_tool(function_to_call, function_args):
+            with tracer.span(function_to_call.__name__, kind="tool"):
+                return await self._invoke(function_to_call, function_args)
+
+        def start_tool(function_to_call, function_args):
+            return asyncio.ensure_future(traced_tool(function_to_call, function_args))
+
+        self._use_session()
+        for round_number in range(self.max_rounds + 1):
+            state = StreamState(self.available_functions, start_tool if round_number < self.max_rounds else None,
+                                self.validate)
+            with tracer.span("chat_completion", kind="model", deployment=deployment_id, stream=True):
+                response = await self._open_stream(deployment_id, messages=messages, functions=functions,
+                                                   function_call="auto", temperature=temperature)
+                # hold the deployment slot until the whole stream has been read
+                try:
+                    async for chunk in response:
+                        content = state.update(chunk)
+                        if content:
+                            yield content
+                finally:
+                    self._release_slot(deployment_id)
+            state.finish()
+            if metrics is not None:
+                metrics.append(state.metrics)
+
+            call = state.function_call
+            if call is None:
+                return
+            if round_number == self.max_rounds:
+                yield "Too many function calls: stopped after " + str(self.max_rounds) + " rounds"
+                return
+            if call.name not in self.available_functions:
+                yield "Function " + call.name + " does not exist"
+                return
+            if state.validation_error is not None:
+                append_function_messages(messages, call, state.validation_error)
+                continue
+            if state.tool_future is None:
+                yield "Invalid arguments for function: " + call.name
+                return
+            append_function_messages(messages, call, await state.tool_future)
+
+    # run many independent conversations concurrently; each item is a list of messages
+    # failures are returned in place of the response instead of cancelling the other conversations
+    async def run_conversations(self, conversations, functions, deployment_id, temperature=0):
+        tasks = [self.run_conversation(messages, functions, deployment_id, temperature)
+                 for messages in conversations]
+        return await asyncio.gather(*tasks, return_exceptions=True)
+
+    def close(self):
+        self._executor.shutdown(wait=False)
@@ -0,0 +1,294 @@
+import os
+import json
+import time
+import asyncio
+import hashlib
+import argparse
+import openai
+from dotenv import load_dotenv
+from tenacity import AsyncRetrying, retry_if_exception_type, stop_after_attempt, wait_random_exponential
+from async_conversation import AsyncConversationRunner, retryable_errors
+from clients import create_aiohttp_session
+from rate_limiter import rate_limiter, BULK
+from schema_validator import ArgumentValidator
+from tools import registry
+from tracing import quantile
+
+# runs a JSONL file of conversations through the function-calling loop, many at a time, for offline evaluation
+#   python batch_runner.py prompts.jsonl results.jsonl --concurrency 32
+# one conversation per input line:
+#   {"id": "q1", "messages": [{"role": "user", "content": "..."}], "functions": ["get_stock_change", "calculator"]}
+#   {"id": "q2", "prompt": "What time is it in Europe/London?"}
+# "functions" names tools of tools.py and defaults to registry.select(); "deployment" overrides --deployment.
+# one result per line is appended to the output as soon as its conversation finishes, with the final answer,
+# every tool call with its arguments and result, the usage of the last model call and the time taken.
+# the output is also the checkpoint: started again after a crash, conversations already in it are skipped
+# and a line cut off by the crash is dropped. conversations that failed on a retryable error are run again and
+# get a second line, the last one counts; those that cannot succeed on a second run (invalid input line,
+# unknown function, the loop giving up) count as done. identical conversations (same
+# messages, functions and deployment) are sent once; the copies get a "duplicate" line pointing at the first.
+# the input is read as the workers need it, so the file can be larger than memory.
+# every model call takes a BULK ticket from the process-wide rate limiter (--rpm/--tpm set the deployment's
+# budget) and is retried on its own by the runner, waiting out a 429's Retry-After in the limiter. a
+# conversation whose call still fails after those retries is started over, at most --retries times in all;
+# the errors that lead there are those of async_conversation.retryable_errors, anything else is recorded
+# as a failed result
+
+
+def conversation_key(messages, function_names, deployment):
+    canonical = json.dumps([deployment, messages, sorted(function_names) if function_names is not None else None],
+                           sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(canonical.encode("utf-8")).hexdigest()
+
+
+def read_conversations(path, deployment, prompt_field="prompt", system_message=None):
+    with open(path, encoding="utf-8") as input_file:
+        for line_number, line in enumerate(input_file, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+                if not isinstance(record, dict):
+                    raise ValueError("expected a JSON object")
+                messages = record.get("messages") or [{"role": "user", "content": record[prompt_field]}]
+                if not isinstance(messages, list) or not all(isinstance(message, dict) and "role" in message
+                                                             for message in messages):
+                    raise ValueError("messages must be a list of objects with a role")
+                functions = record.get("functions")
+                if functions is not None and not (isinstance(functions, list)
+                                                  and all(isinstance(name, str) for name in functions)):
+                    raise ValueError("functions must be a list of function names")
+            except (ValueError, KeyError) as error:
+                yield {"id": str(line_number), "error": f"Invalid input line {line_number}: {error}"}
+                continue
+            if system_message and messages[0]["role"] != "system":
+                messages = [{"role": "system", "content": system_message}] + messages
+            conversation = {
+                "id": str(record.get("id", line_number)),
+                "messages": messages,
+                "functions": functions,
+                "deployment": record.get("deployment") or deployment,
+            }
+            conversation["key"] = conversation_key(messages, conversation["functions"], conversation["deployment"])
+            yield conversation
+
+
+# keys and ids already in the output; a torn last line (crash mid-write) is cut off so appending continues cleanly
+def load_checkpoint(path, retry_errors=True):
+    done_keys, done_ids = {}, set()
+    if not os.path.exists(path):
+        return done_keys, done_ids
+    valid_bytes = 0
+    with open(path, "rb") as output_file:
+        for line in output_file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                break
+            valid_bytes += len(line)
+            if record["status"] == "error" and record.get("retryable") and retry_errors:
+                continue
+            done_ids.add(record["id"])
+            # copies of a failed conversation fail the same way; they are not pointed at it as duplicates
+            if record["status"] == "ok":
+                done_keys.setdefault(record["key"], record["id"])
+    if valid_bytes < os.path.getsize(path):
+        with open(path, "r+b") as output_file:
+            output_file.truncate(valid_bytes)
+    return done_keys, done_ids
+
+
+# the tool calls the loop appended to messages after the original ones
+def tool_trace(messages, start):
+    trace = []
+    for message in messages[start:]:
+        if message.get("function_call"):
+            trace.append({"name": message["function_call"]["name"],
+                          "arguments": message["function_call"]["arguments"], "result": None})
+        elif message["role"] == "function" and trace:
+            trace[-1]["result"] = message["content"]
+    return trace
+
+
+class BatchStats:
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.completed = 0
+        self.errors = 0
+        self.resumed = 0
+        self.duplicates = 0
+        self.tool_calls = 0
+        self.tokens = 0
+        self.latencies = []
+
+    def report(self):
+        elapsed = time.perf_counter() - self.started
+        p50, p95, p99 = (quantile(self.latencies, q) for q in (0.5, 0.95, 0.99))
+        return (f"{self.completed} done ({self.errors} failed), {self.resumed} resumed, {self.duplicates} duplicates "
+                f"in {elapsed:.0f}s: {self.completed / elapsed if elapsed else 0:.2f} conversations/s, "
+                f"{self.tool_calls} tool calls, {self.tokens} tokens, latency p50 {p50:.1f}s p95 {p95:.1f}s p99 {p99:.1f}s")
+
+
+class BatchRunner:
+    def __init__(self, runner, concurrency=16, retries=3, retry_errors=True, report_every=30):
+        self.runner = runner
+        self.concurrency = concurrency
+        self.retries = retries
+        self.retry_errors = retry_errors
+        self.report_every = report_every
+        self.stats = BatchStats()
+        self._output = None
+
+    def _write(self, record):
+        self._output.write(json.dumps(record, ensure_ascii=False, default=str) + "\n")
+        self._output.flush()
+
+    async def _converse(self, conversation):
+        unknown = [name for name in conversation["functions"] or [] if name not in registry.tools]
+        if unknown:
+            return {"id": conversation["id"], "key": conversation["key"], "status": "error",
+                    "error": "Unknown functions: " + ", ".join(unknown)}
+        messages = [dict(message) for message in conversation["messages"]]
+        functions = registry.functions(conversation["functions"] if conversation["functions"] is not None
+                                       else registry.select(messages))
+        started = time.perf_counter()
+        response = await self.runner.run_conversation(messages, functions, conversation["deployment"])
+        record = {"id": conversation["id"], "key": conversation["key"], "status": "ok",
+                  "seconds": time.perf_counter() - started, "tool_calls": tool_trace(messages, len(conversation["messages"]))}
+        if isinstance(response, str):
+            # the loop gave up, e.g. the model asked for a function that does not exist
+            record.update(status="error", error=response)
+        else:
+            choice = response["choices"][0]
+            record.update(response=choice["message"].get("content"), finish_reason=choice["finish_reason"],
+                          usage=response.get("usage"))
+        return record
+
+    async def _run_one(self, conversation):
+        try:
+            # a last resort after the runner's own retries of each call: each attempt starts the conversation
+            # over, from a fresh copy of its messages
+            async for attempt in AsyncRetrying(retry=retry_if_exception_type(retryable_errors), reraise=True,
+                                               wait=wait_random_exponential(min=10, max=120),
+                                               stop=stop_after_attempt(self.retries)):
+                with attempt:
+                    return await self._converse(conversation)
+        except Exception as error:
+            return {"id": conversation["id"], "key": conversation["key"], "status": "error",
+                    "error": f"{type(error).__name__}: {error}", "retryable": isinstance(error, retryable_errors)}
+
+    async def _worker(self, queue, in_flight, finished):
+        while True:
+            conversation = await queue.get()
+            if conversation is None:
+                return
+            record = await self._run_one(conversation)
+            self._write(record)
+            self.stats.completed += 1
+            if record["status"] == "error":
+                self.stats.errors += 1
+            else:
+                self.stats.latencies.append(record["seconds"])
+                self.stats.tool_calls += len(record["tool_calls"])
+                self.stats.tokens += (record.get("usage") or {}).get("total_tokens", 0)
+                finished[record["key"]] = record["id"]
+            for duplicate_id in in_flight.pop(conversation["key"])[1:]:
+                if record["status"] == "error":
+                    self._write(dict(record, id=duplicate_id))
+                else:
+                    self._write({"id": duplicate_id, "key": record["key"], "status": "duplicate",
+                                 "duplicate_of": record["id"]})
+
+    async def _reporter(self):
+        while True:
+            await asyncio.sleep(self.report_every)
+            print(self.stats.report(), flush=True)
+
+    async def run(self, conversations, output_path):
+        finished, done_ids = load_checkpoint(output_path, self.retry_errors)
+        in_flight = {}
+        queue = asyncio.Queue(maxsize=self.concurrency * 2)
+        self._output = open(output_path, "a", encoding="utf-8")
+        workers = [asyncio.ensure_future(self._worker(queue, in_flight, finished)) for _ in range(self.concurrency)]
+        reporter = asyncio.ensure_future(self._reporter())
+        try:
+            for conversation in conversations:
+                if conversation["id"] in done_ids:
+                    self.stats.resumed += 1
+                elif "error" in conversation:
+                    self._write({"id": conversation["id"], "key": None, "status": "error",
+                                 "error": conversation["error"]})
+                    self.stats.errors += 1
+                elif conversation["key"] in finished:
+                    self._write({"id": conversation["id"], "key": conversation["key"], "status": "duplicate",
+                                 "duplicate_of": finished[conversation["key"]]})
+                    self.stats.duplicates += 1
+                elif conversation["key"] in in_flight:
+                    in_flight[conversation["key"]].append(conversation["id"])
+                    self.stats.duplicates += 1
+                else:
+                    in_flight[conversation["key"]] = [conversation["id"]]
+                    # waits while the workers are busy, so the input is only read as fast as it is processed
+                    await queue.put(conversation)
+            for _ in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        finally:
+            reporter.cancel()
+            for worker in workers:
+                worker.cancel()
+            self._output.close()
+        return self.stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a JSONL file of conversations through the function-calling loop")
+    parser.add_argument("input")
+    parser.add_argument("output")
+    parser.add_argument("--concurrency", type=int, default=16, help="conversations in progress at once")
+    parser.add_argument("--max-requests", type=int, default=32, help="model requests in flight per deployment")
+    parser.add_argument("--deployment", default=os.environ.get("OPENAI_DEPLOYMENT_NAME", "gpt-35-turbo"))
+    parser.add_argument("--prompt-field", default="prompt", help="field holding the user message when there are no messages")
+    parser.add_argument("--system", default=None, help="system message added to conversations without one")
+    parser.add_argument("--rpm", type=int, default=None, help="requests per minute the deployment allows")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens per minute the deployment allows")
+    parser.add_argument("--retries", type=int, default=2,
+                        help="attempts per conversation once a model call has used up its own retries")
+    parser.add_argument("--keep-errors", action="store_true",
+                        help="do not retry conversations that failed on a retryable error in an earlier run")
+    parser.add_argument("--report-every", type=float, default=30, help="seconds between progress lines")
+    args = parser.parse_args()
+
+    load_dotenv()
+    openai.api_key = os.environ["OPENAI_API_KEY"]
+    openai.api_type = os.environ["OPENAI_API_TYPE"]
+    openai.api_base = os.environ["OPENAI_API_BASE"]
+    openai.api_version = os.environ["OPENAI_API_VERSION"]
+
+    available_functions = registry.available_functions()
+    validator = ArgumentValidator(registry.functions(), available_functions)
+    # without limits the limiter still holds the deployment back after a 429 and learns its rate from it
+    if args.rpm or args.tpm:
+        rate_limiter.configure(args.deployment, args.rpm, args.tpm)
+
+    async def run():
+        session = create_aiohttp_session(limit_per_host=args.max_requests)
+        # bulk priority: interactive requests sharing the process and the limiter go first
+        runner = AsyncConversationRunner(available_functions, max_concurrent_requests=args.max_requests,
+                                         validate=validator.check, aiosession=session, priority=BULK)
+        batch = BatchRunner(runner, args.concurrency, args.retries, not args.keep_errors, args.report_every)
+        try:
+            return await batch.run(read_conversations(args.input, args.deployment, args.prompt_field, args.system),
+                                   args.output)
+        finally:
+            runner.close()
+            await session.close()
+
+    stats = asyncio.run(run())
+    print(stats.report())
+    print(f"Rate limits: {rate_limiter.stats()}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+import time
+import argparse
+import tempfile
+import numpy as np
+from ann_index import IVFIndex
+from vector_ops import normalize_rows, top_k
+
+# recall-vs-latency benchmark of the IVF index against exact (brute force) search
+# uses synthetic clustered vectors so it runs offline at any corpus size:
+#   python benchmark_ann.py --n 200000 --dim 1536 --nlist 512
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--n", type=int, default=100000)
+parser.add_argument("--dim", type=int, default=1536)
+parser.add_argument("--queries", type=int, default=200)
+parser.add_argument("--k", type=int, default=10)
+parser.add_argument("--nlist", type=int, default=256)
+parser.add_argument("--nprobe", type=int, nargs="+", default=[1, 2, 4, 8, 16, 32])
+args = parser.parse_args()
+
+# clustered data resembles real embeddings better than uniform noise
+rng = np.random.default_rng(0)
+centers = rng.normal(size=(max(args.n // 500, 1), args.dim)).astype(np.float32)
+vectors = normalize_rows(centers[rng.integers(len(centers), size=args.n)]
+                         + 0.6 * rng.normal(size=(args.n, args.dim)).astype(np.float32))
+queries = normalize_rows(vectors[rng.choice(args.n, args.queries, replace=False)]
+                         + 0.1 * rng.normal(size=(args.queries, args.dim)).astype(np.float32))
+ids = [str(i) for i in range(args.n)]
+
+# one query at a time, the way query_recipes issues them
+start = time.perf_counter()
+exact = np.stack([top_k(vectors @ query, args.k) for query in queries])
+exact_ms = (time.perf_counter() - start) * 1000 / args.queries
+truth = [set(map(str, row)) for row in exact]
+print(f"exact search: {exact_ms:.3f} ms/query")
+
+start = time.perf_counter()
+index = IVFIndex(args.dim, nlist=args.nlist)
+index.train(vectors)
+index.add(ids, vectors)
+print(f"built IVF index (nlist={index.nlist}) in {time.perf_counter() - start:.1f}s")
+
+with tempfile.TemporaryDirectory() as path:
+    index.save(path)
+    start = time.perf_counter()
+    index = IVFIndex.load(path)
+    print(f"loaded memory-mapped index in {(time.perf_counter() - start) * 1000:.1f} ms")
+
+    print(f"{'nprobe':>6} {'recall@' + str(args.k):>10} {'ms/query':>9} {'speedup':>8}")
+    for nprobe in args.nprobe:
+        start = time.perf_counter()
+        results = index.search(queries, args.k, nprobe=nprobe)
+        ann_ms = (time.perf_counter() - start) * 1000 / args.queries
+        recall = np.mean([len(truth[i] & {recipe_id for recipe_id, _ in result}) / args.k
+                          for i, result in enumerate(results)])
+        print(f"{nprobe:>6} {recall:>10.3f} {ann_ms:>9.3f} {exact_ms / ann_ms:>7.1f}x")
@@ -0,0 +1,202 @@
+import json
+import time
+import random
+import asyncio
+import argparse
+import numpy as np
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from mock_server import MockServer
+from clients import ClientFactory, create_aiohttp_session
+from async_conversation import AsyncConversationRunner
+from streaming import stream_conversation
+from schema_validator import ArgumentValidator
+from embeddings import embed_in_batches
+from ingest_pipeline import run_pipeline
+from tools import registry
+
+# reproducible load test of the client code against mock_server.py, so it runs on a CI box without network
+# the same seed gives the same conversations and the same simulated latencies; only the client code varies
+#   python benchmark_conversations.py --conversations 500 --concurrency 32 --mode async
+#   python benchmark_conversations.py --suite ingest --recipes 500
+#   python benchmark_conversations.py --mode stream --fixtures session.jsonl   (replays a recorded session)
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--suite", choices=["conversations", "ingest", "all"], default="conversations")
+parser.add_argument("--mode", choices=["async", "stream"], default="async",
+                    help="AsyncConversationRunner, or streaming.stream_conversation on a thread pool")
+parser.add_argument("--conversations", type=int, default=200)
+parser.add_argument("--concurrency", type=int, default=16)
+parser.add_argument("--recipes", type=int, default=200)
+parser.add_argument("--chat-latency", default="lognormal:400:0.5")
+parser.add_argument("--chunk-latency", default="fixed:10")
+parser.add_argument("--embedding-latency", default="lognormal:60:0.4")
+parser.add_argument("--search-latency", default="lognormal:80:0.4")
+parser.add_argument("--error-rate", type=float, default=0.0)
+parser.add_argument("--rpm", type=int, default=None)
+parser.add_argument("--fixtures", default=None, help="replay this recorded session instead of synthetic responses")
+parser.add_argument("--seed", type=int, default=0)
+parser.add_argument("--output", default=None, help="also write the results as JSON")
+args = parser.parse_args()
+
+server = MockServer(chat_latency=args.chat_latency, chunk_latency=args.chunk_latency,
+                    embedding_latency=args.embedding_latency, search_latency=args.search_latency,
+                    error_rate=args.error_rate, rpm=args.rpm, fixtures=args.fixtures,
+                    mode="replay" if args.fixtures else "synthetic", seed=args.seed).start()
+openai.api_key = "mock"
+openai.api_type = "azure"
+openai.api_base = server.url
+openai.api_version = "2023-07-01-preview"
+clients = ClientFactory(pool_maxsize=args.concurrency).configure_openai()
+deployment_id = "gpt-35-turbo"
+
+indices = ["S&P 500", "NASDAQ Composite", "Dow Jones Industrial Average", "Financial Times Stock Exchange 100 Index"]
+locations = ["America/New_York", "Europe/London", "Asia/Bangkok", "Australia/Sydney"]
+templates = [
+    "How much did {index} change between July 12 and July 13?",
+    "Compare {index} and {other} between July 12 and July 13.",
+    "What are the daily returns of {index}?",
+    "What time is it in {location}?",
+    "What is the square root of {number}? Use the calculator.",
+    "Show me the stock market data for {index}.",
+]
+
+
+def scripted_conversations(count, seed):
+    rng = random.Random(seed)
+    conversations = []
+    for _ in range(count):
+        index, other = rng.sample(indices, 2)
+        prompt = rng.choice(templates).format(index=index, other=other, location=rng.choice(locations),
+                                              number=rng.randint(2, 10000))
+        conversations.append([{"role": "user", "content": prompt}])
+    return conversations
+
+
+def percentiles(values):
+    if not values:
+        return {}
+    p50, p95, p99 = np.percentile(values, [50, 95, 99])
+    return {"p50_ms": p50 * 1000, "p95_ms": p95 * 1000, "p99_ms": p99 * 1000, "max_ms": max(values) * 1000}
+
+
+available_functions = registry.available_functions()
+validator = ArgumentValidator(registry.functions(), available_functions)
+
+
+async def run_async(conversations):
+    session = create_aiohttp_session(limit_per_host=args.concurrency)
+    runner = AsyncConversationRunner(available_functions, max_concurrent_requests=args.concurrency,
+                                     validate=validator.check, aiosession=session)
+    limit = asyncio.Semaphore(args.concurrency)
+
+    async def timed(messages):
+        async with limit:
+            started = time.perf_counter()
+            try:
+                await runner.run_conversation(messages, registry.functions(registry.select(messages)), deployment_id)
+                return time.perf_counter() - started, None
+            except Exception as error:
+                return time.perf_counter() - started, repr(error)
+
+    try:
+        return await asyncio.gather(*(timed(messages) for messages in conversations))
+    finally:
+        runner.close()
+        await session.close()
+
+
+def run_stream(conversations):
+    def timed(messages):
+        metrics = []
+        started = time.perf_counter()
+        try:
+            for _ in stream_conversation(messages, registry.functions(registry.select(messages)), available_functions,
+                                         deployment_id, metrics=metrics, validate=validator.check):
+                pass
+            return time.perf_counter() - started, None, metrics
+        except Exception as error:
+            return time.perf_counter() - started, repr(error), metrics
+
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        return list(executor.map(timed, conversations))
+
+
+def conversation_suite():
+    conversations = scripted_conversations(args.conversations, args.seed)
+    started = time.perf_counter()
+    if args.mode == "async":
+        outcomes = asyncio.run(run_async(conversations))
+        first_tokens = []
+    else:
+        outcomes = run_stream(conversations)
+        first_tokens = [metrics[0]["time_to_first_token"] for _, _, metrics in outcomes if metrics]
+    elapsed = time.perf_counter() - started
+    latencies = [outcome[0] for outcome in outcomes if outcome[1] is None]
+    errors = [outcome[1] for outcome in outcomes if outcome[1] is not None]
+    result = {
+        "mode": args.mode,
+        "conversations": len(conversations),
+        "concurrency": args.concurrency,
+        "seconds": elapsed,
+        "conversations_per_second": len(latencies) / elapsed,
+        "errors": len(errors),
+        "latency": percentiles(latencies),
+    }
+    if first_tokens:
+        result["time_to_first_token"] = percentiles(first_tokens)
+    if errors:
+        result["first_error"] = errors[0]
+    return result
+
+
+def ingest_suite():
+    recipes = []
+    with open("recipes_final.jsonl") as j_in:
+        for line in j_in:
+            recipes.append(json.loads(line))
+    recipes = [dict(recipes[position % len(recipes)], recipe_id=str(position)) for position in range(args.recipes)]
+    search_client = clients.search_client(server.url, "recipes", credential=_key_credential())
+
+    def embed(batch):
+        vectors = embed_in_batches([recipe["recipe"] for recipe in batch], 16, 1)
+        return [dict(recipe, recipe_vector=vector, total_time=int(str(recipe["total_time"]).split(" ")[0]))
+                for recipe, vector in zip(batch, vectors)]
+
+    report = run_pipeline(iter(recipes), embed, search_client.merge_or_upload_documents,
+                          embedding_batch_size=16, batch_size=100, embed_workers=4, upload_workers=2)
+    queries = ["pasta", "chicken", "vegetarian curry", "quick dessert"] * 25
+    started = time.perf_counter()
+    latencies = []
+    for query in queries:
+        query_started = time.perf_counter()
+        list(search_client.search(search_text=query, filter="total_time lt 60", top=3,
+                                  select=["recipe_id", "recipe_name"]))
+        latencies.append(time.perf_counter() - query_started)
+    return {
+        "documents": args.recipes,
+        "pipeline": str(report),
+        "queries": len(queries),
+        "queries_per_second": len(queries) / (time.perf_counter() - started),
+        "query_latency": percentiles(latencies),
+    }
+
+
+def _key_credential():
+    from azure.core.credentials import AzureKeyCredential
+    return AzureKeyCredential("mock")
+
+
+results = {}
+if args.suite in ("conversations", "all"):
+    results["conversations"] = conversation_suite()
+if args.suite in ("ingest", "all"):
+    results["ingest"] = ingest_suite()
+results["server"] = dict(server.state.stats)
+results["connection_pools"] = clients.pool_stats()
+server.stop()
+
+print(json.dumps(results, indent=2, default=float))
+if args.output:
+    with open(args.output, "w") as output_file:
+        json.dump(results, output_file, indent=2, default=float)
@@ -0,0 +1,76 @@
+import os
+import sys
+import time
+import argparse
+import tempfile
+import numpy as np
+import openai
+from dotenv import load_dotenv
+from embeddings import embed_in_batches
+from embedding_cache import EmbeddingCache
+from local_search import load_recipes
+from quantization import build_vector_store
+from vector_ops import normalize_rows, top_k
+
+# memory and recall@k of the compact vector stores on recipes_final.jsonl
+# recipe vectors come from the embedding cache (missing ones are embedded with the configured OpenAI resource);
+# bytes/vector excludes fixed overhead (PQ codebooks), which the total includes
+# --synthetic uses random vectors of the same shape when no embeddings are available offline
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--k", type=int, default=10)
+parser.add_argument("--pq-m", type=int, default=96)
+parser.add_argument("--rerank", type=int, default=50)
+parser.add_argument("--cache-dir", default=".embedding_cache")
+parser.add_argument("--synthetic", action="store_true")
+args = parser.parse_args()
+
+recipes = load_recipes("recipes_final.jsonl")
+if args.synthetic:
+    vectors = np.random.default_rng(0).normal(size=(len(recipes), 1536))
+else:
+    load_dotenv()
+    if "OPENAI_API_KEY" in os.environ:
+        openai.api_key = os.environ["OPENAI_API_KEY"]
+        openai.api_type = os.environ["OPENAI_API_TYPE"]
+        openai.api_base = os.environ["OPENAI_API_BASE"]
+        openai.api_version = os.environ["OPENAI_API_VERSION"]
+    cache = EmbeddingCache(args.cache_dir)
+    try:
+        vectors = embed_in_batches([recipe['recipe'] for recipe in recipes], cache=cache)
+    except Exception as error:
+        sys.exit(f"Could not load recipe embeddings ({error}); run with --synthetic to use random vectors")
+vectors = normalize_rows(vectors)
+
+# each recipe is used as a query against all recipes; the float32 ranking is the ground truth
+queries = vectors
+truth = top_k(queries @ vectors.T, args.k)
+
+# what the loader used to hold per document: a Python list of 1536 boxed floats
+python_list_bytes = sys.getsizeof(vectors[0].tolist()) + sum(sys.getsizeof(x) for x in vectors[0].tolist())
+print(f"{len(recipes)} recipes, {vectors.shape[1]} dimensions, k={args.k}")
+print(f"{'storage':<16} {'bytes/vector':>12} {'total KB':>9} {'vs list':>8} {'recall@' + str(args.k):>10} {'ms/query':>9}")
+print(f"{'python list':<16} {python_list_bytes:>12} {python_list_bytes * len(recipes) / 1024:>9.0f} {1:>7.0f}x")
+
+with tempfile.TemporaryDirectory() as path:
+    # full-precision vectors on disk, memory-mapped, as the re-ranking source for product quantization
+    rerank_path = os.path.join(path, "vectors.npy")
+    np.save(rerank_path, vectors)
+    rerank_source = np.load(rerank_path, mmap_mode="r")
+
+    configurations = [
+        ("float32", "float32", {}),
+        ("float16", "float16", {}),
+        ("int8", "int8", {}),
+        (f"pq m={args.pq_m}", "pq", {"m": args.pq_m}),
+        (f"pq m={args.pq_m}+rerank", "pq", {"m": args.pq_m, "rerank_source": rerank_source, "rerank": args.rerank}),
+    ]
+    for label, kind, options in configurations:
+        store = build_vector_store(kind, vectors, **options)
+        start = time.perf_counter()
+        positions, _ = store.search(queries, args.k)
+        elapsed_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        recall = np.mean([len(set(found) & set(expected)) / args.k for found, expected in zip(positions, truth)])
+        per_vector = store.bytes_per_vector
+        print(f"{label:<16} {per_vector:>12.0f} {store.nbytes / 1024:>9.0f} {python_list_bytes / per_vector:>7.0f}x "
+              f"{recall:>10.3f} {elapsed_ms:>9.3f}")
@@ -0,0 +1,44 @@
+import json
+import timeit
+import argparse
+import pandas as pd
+from stock_store import StockDataStore
+
+# compares the original get_stock_market_data (pd.read_csv on every call) with the preloaded StockDataStore
+#   python benchmark_stock_store.py --number 2000
+
+parser = argparse.ArgumentParser()
+parser.add_argument("--path", default="stock_data.csv")
+parser.add_argument("--index", default="S&P 500")
+parser.add_argument("--number", type=int, default=1000)
+args = parser.parse_args()
+
+
+# the original implementation from 5_multiple_functions.py
+def get_stock_market_data_pandas(index):
+    data = pd.read_csv(args.path)
+    data_filtered = data[data['Index'] == index]
+    data_filtered = data_filtered.drop(columns=['Index'])
+    hist_dict = data_filtered.to_dict()
+    for key, value_dict in hist_dict.items():
+        hist_dict[key] = {k: v for k, v in value_dict.items()}
+    return json.dumps(hist_dict)
+
+
+store = StockDataStore(args.path)
+
+# both paths must produce the same data
+assert json.loads(get_stock_market_data_pandas(args.index)) == json.loads(store.get_json(args.index))
+
+benchmarks = [
+    ("pandas read_csv per call", lambda: get_stock_market_data_pandas(args.index)),
+    ("store, cached JSON", lambda: store.get_json(args.index)),
+    ("store, date range", lambda: store.get_json(args.index, "2023-07-12", "2023-07-13")),
+    ("store, columnar lookup", lambda: store.get(args.index).column("Close")),
+]
+baseline = None
+print(f"{'':<26} {'us/call':>10} {'speedup':>9}")
+for label, call in benchmarks:
+    seconds = timeit.timeit(call, number=args.number) / args.number
+    baseline = baseline or seconds
+    print(f"{label:<26} {seconds * 1e6:>10.2f} {baseline / seconds:>8.0f}x")
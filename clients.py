@@ -0,0 +1,125 @@
+import time
+import requests
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from requests.adapters import HTTPAdapter
+from openai.api_requestor import TIMEOUT_SECS as openai_default_timeout
+
+# one pool of keep-alive HTTP connections shared by the OpenAI calls and the Azure Cognitive Search clients
+# openai 0.28 and azure-core both send requests through a requests.Session, so installing a single tuned session
+# (openai.requestssession, and RequestsTransport(session=...) for the search clients) means TCP and TLS
+# connections are set up once per host and reused by every call and thread. warm_up() opens them at process
+# start, so the first user request does not pay for the handshakes, and pool_stats() shows how busy the pools are.
+# requests/urllib3 speak HTTP/1.1 only, so HTTP/2 is not available with these transports; pool_maxsize bounds
+# the number of parallel connections per host instead.
+# async code (openai acreate) uses aiohttp; create_aiohttp_session() builds the equivalent pooled session
+
+
+class SharedSession(requests.Session):
+    def __init__(self, timeout=None):
+        super().__init__()
+        self.timeout = timeout
+
+    def request(self, method, url, **kwargs):
+        # openai passes its 600 s default when a call sets no request_timeout; use the pool's timeout instead
+        if self.timeout is not None and kwargs.get("timeout") in (None, openai_default_timeout):
+            kwargs["timeout"] = self.timeout
+        return super().request(method, url, **kwargs)
+
+    # openai closes its session every few minutes to refresh it; the shared session must outlive that
+    def close(self):
+        pass
+
+    def shutdown(self):
+        super().close()
+
+
+class ClientFactory:
+    def __init__(self, pool_connections=10, pool_maxsize=32, connect_timeout=5, read_timeout=60):
+        self.pool_maxsize = pool_maxsize
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.session = SharedSession(timeout=(connect_timeout, read_timeout))
+        # pool_connections: hosts kept in the pool manager, pool_maxsize: connections kept per host
+        # pool_block makes callers wait for a free connection rather than open throwaway ones past the limit
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        self._search_clients = {}
+        self.warm_up_seconds = {}
+
+    # route every openai.* call made in this process through the shared session
+    def configure_openai(self):
+        openai.requestssession = self.session
+        return self
+
+    def transport(self):
+        from azure.core.pipeline.transport import RequestsTransport
+        return RequestsTransport(session=self.session, session_owner=False,
+                                 connection_timeout=self.connect_timeout, read_timeout=self.read_timeout)
+
+    # one SearchClient per endpoint and index; a single call can still override read_timeout=...
+    def search_client(self, endpoint, index_name, credential):
+        from azure.search.documents import SearchClient
+        key = ("search", endpoint, index_name)
+        if key not in self._search_clients:
+            self._search_clients[key] = SearchClient(endpoint=endpoint, index_name=index_name,
+                                                     credential=credential, transport=self.transport())
+        return self._search_clients[key]
+
+    def search_index_client(self, endpoint, credential):
+        from azure.search.documents.indexes import SearchIndexClient
+        key = ("index", endpoint)
+        if key not in self._search_clients:
+            self._search_clients[key] = SearchIndexClient(endpoint=endpoint, credential=credential,
+                                                          transport=self.transport())
+        return self._search_clients[key]
+
+    # open a connection (DNS, TCP, TLS) to every URL in parallel; the HTTP status does not matter, only that
+    # the connection ends up in the pool. returns {url: seconds} or {url: error message}
+    def warm_up(self, urls, timeout=5):
+        def connect(url):
+            started = time.perf_counter()
+            try:
+                self.session.get(url, timeout=timeout).close()
+            except requests.RequestException as error:
+                return url, f"failed: {error}"
+            return url, time.perf_counter() - started
+
+        urls = [url for url in urls if url]
+        with ThreadPoolExecutor(max_workers=max(len(urls), 1)) as executor:
+            self.warm_up_seconds.update(executor.map(connect, urls))
+        return self.warm_up_seconds
+
+    # per host: connections opened and requests sent over the pool's lifetime, connections in use and idle
+    def pool_stats(self):
+        stats = {}
+        for adapter in set(self.session.adapters.values()):
+            pools = adapter.poolmanager.pools
+            for key in pools.keys():
+                pool = pools.get(key)
+                if pool is None:
+                    continue
+                # the queue holds idle connections plus None placeholders for connections not opened yet
+                idle = sum(1 for connection in list(pool.pool.queue) if connection is not None) if pool.pool else 0
+                available = pool.pool.qsize() if pool.pool else 0
+                stats[f"{pool.scheme}://{pool.host}:{pool.port}"] = {
+                    "connections_opened": pool.num_connections,
+                    "requests": pool.num_requests,
+                    "in_use": self.pool_maxsize - available,
+                    "idle": idle,
+                    "maxsize": self.pool_maxsize,
+                }
+        return stats
+
+    def close(self):
+        for client in self._search_clients.values():
+            client.close()
+        self.session.shutdown()
+
+
+# pooled aiohttp session for openai's async calls; set it with openai.aiosession.set(session) inside the event loop
+def create_aiohttp_session(limit=100, limit_per_host=32, keepalive_timeout=30):
+    import aiohttp
+    connector = aiohttp.TCPConnector(limit=limit, limit_per_host=limit_per_host, keepalive_timeout=keepalive_timeout)
+    return aiohttp.ClientSession(connector=connector)
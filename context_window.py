@@ -0,0 +1,174 @@
+import json
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+# keeps the prompt of a function-calling conversation inside a token budget
+# ContextWindow.fit(messages, functions) returns the messages to send for the next request without touching
+# the conversation history itself:
+#   1. function/tool results longer than max_tool_tokens are cut to their head and tail
+#   2. if the prompt is still over max_prompt_tokens, the oldest turns are dropped ("drop") or replaced by a
+#      one-line note of what was asked and which tools were called ("summarize"); system messages, the latest
+#      user message and the last keep_last_turns turns are always kept, and a function call is never separated
+#      from its result. earlier tool rounds of the current turn can go too, so a long chain of function calls
+#      after one question still fits
+# token counts are cached per message, so each request only counts the messages added since the last one.
+# with tiktoken installed counts are exact for the model's encoding, otherwise they are estimated at
+# four characters per token
+
+# per-message overhead of the chat format, see the OpenAI cookbook "How to count tokens with tiktoken"
+tokens_per_message = 3
+tokens_per_name = 1
+tokens_per_reply = 3
+
+truncation_marker = "\n... [{} tokens truncated] ...\n"
+
+
+class TokenCounter:
+    def __init__(self, encoding_name="cl100k_base"):
+        self.encoding = tiktoken.get_encoding(encoding_name) if tiktoken is not None else None
+
+    def count(self, text):
+        if not text:
+            return 0
+        if self.encoding is not None:
+            return len(self.encoding.encode(text))
+        return (len(text) + 3) // 4
+
+    # keep the first and last part of text so that it fits max_tokens
+    def truncate(self, text, max_tokens):
+        total = self.count(text)
+        if total <= max_tokens:
+            return text
+        keep = max(max_tokens - 10, 2)
+        head, tail = keep * 2 // 3, keep - keep * 2 // 3
+        marker = truncation_marker.format(total - keep)
+        if self.encoding is not None:
+            tokens = self.encoding.encode(text)
+            return self.encoding.decode(tokens[:head]) + marker + self.encoding.decode(tokens[-tail:])
+        return text[:head * 4] + marker + text[-tail * 4:]
+
+
+class ContextWindow:
+    def __init__(self, max_prompt_tokens=3000, max_tool_tokens=1000, keep_last_turns=2, policy="drop",
+                 counter=None):
+        if policy not in ("drop", "summarize"):
+            raise ValueError(f"Unknown policy {policy!r}, use 'drop' or 'summarize'")
+        self.max_prompt_tokens = max_prompt_tokens
+        self.max_tool_tokens = max_tool_tokens
+        self.keep_last_turns = keep_last_turns
+        self.policy = policy
+        self.counter = counter or TokenCounter()
+        # id(message) -> (message, fitted message, its tokens, tokens of the original); the message is kept so
+        # that its id cannot be reused while the entry exists
+        self._cache = {}
+        self._functions_tokens = {}
+        self.last_stats = {}
+
+    def _fitted(self, message):
+        entry = self._cache.get(id(message))
+        if entry is None or entry[0] is not message:
+            tokens = self.message_tokens(message)
+            fitted, fitted_tokens = message, tokens
+            if message["role"] in ("function", "tool") and message.get("content"):
+                content = self.counter.truncate(str(message["content"]), self.max_tool_tokens)
+                if content != message["content"]:
+                    fitted = dict(message, content=content)
+                    fitted_tokens = self.message_tokens(fitted)
+            entry = (message, fitted, fitted_tokens, tokens)
+        return entry
+
+    def message_tokens(self, message):
+        tokens = tokens_per_message + self.counter.count(message.get("content") or "")
+        if message.get("name"):
+            tokens += tokens_per_name + self.counter.count(message["name"])
+        if message.get("function_call"):
+            tokens += self.counter.count(message["function_call"]["name"])
+            tokens += self.counter.count(message["function_call"]["arguments"])
+        for tool_call in message.get("tool_calls") or []:
+            tokens += self.counter.count(tool_call["function"]["name"])
+            tokens += self.counter.count(tool_call["function"]["arguments"])
+        return tokens
+
+    def functions_tokens(self, functions):
+        if not functions:
+            return 0
+        key = id(functions)
+        if key not in self._functions_tokens:
+            # the service renders functions differently, but the JSON size is a close upper bound
+            self._functions_tokens[key] = (functions, self.counter.count(json.dumps(functions)))
+        return self._functions_tokens[key][1]
+
+    # tokens of a prompt as fit() would send it
+    def count(self, messages, functions=None):
+        return sum(self._fitted(message)[2] for message in messages) + self.functions_tokens(functions) + tokens_per_reply
+
+    # a turn starts with a user or assistant message; function and tool results belong to the call before them
+    @staticmethod
+    def _turns(messages):
+        turns = []
+        for position, message in enumerate(messages):
+            if message["role"] in ("function", "tool") and turns:
+                turns[-1].append(position)
+            else:
+                turns.append([position])
+        return turns
+
+    def _summary(self, messages):
+        questions = [message["content"] for message in messages if message["role"] == "user" and message.get("content")]
+        calls = [message["function_call"]["name"] for message in messages if message.get("function_call")]
+        calls += [tool_call["function"]["name"] for message in messages for tool_call in message.get("tool_calls") or []]
+        text = f"Earlier in this conversation ({len(messages)} messages omitted)"
+        if questions:
+            text += " the user asked: " + " | ".join(self.counter.truncate(question, 40) for question in questions)
+        if calls:
+            text += ". Tools called: " + ", ".join(calls)
+        return {"role": "system", "content": text + "."}
+
+    def fit(self, messages, functions=None):
+        entries = [self._fitted(message) for message in messages]
+        self._cache = {id(entry[0]): entry for entry in entries}
+        fitted = [entry[1] for entry in entries]
+        counts = [entry[2] for entry in entries]
+        overhead = self.functions_tokens(functions) + tokens_per_reply
+        original_tokens = sum(entry[3] for entry in entries) + overhead
+        total = sum(counts) + overhead
+
+        dropped = []
+        if total > self.max_prompt_tokens:
+            turns = self._turns(messages)
+            # system messages, the latest user message and the most recent turns (a function call with its
+            # result counts as one) are never dropped
+            last_user_turn = max((number for number, turn in enumerate(turns) if messages[turn[0]]["role"] == "user"),
+                                 default=None)
+            droppable = [turn for number, turn in enumerate(turns[:max(len(turns) - self.keep_last_turns, 0)])
+                         if number != last_user_turn and messages[turn[0]]["role"] != "system"]
+            for turn in droppable:
+                if total <= self.max_prompt_tokens:
+                    break
+                dropped.extend(turn)
+                total -= sum(counts[position] for position in turn)
+
+        if dropped:
+            dropped_positions = set(dropped)
+            kept = [message for position, message in enumerate(fitted) if position not in dropped_positions]
+            if self.policy == "summarize":
+                summary = self._summary([messages[position] for position in sorted(dropped)])
+                total += self.message_tokens(summary)
+                # after the leading system messages
+                insert_at = next((position for position, message in enumerate(kept) if message["role"] != "system"), len(kept))
+                kept.insert(insert_at, summary)
+            fitted = kept
+
+        self.last_stats = {
+            "messages": len(messages),
+            "sent_messages": len(fitted),
+            "dropped_messages": len(dropped),
+            "truncated_messages": sum(1 for entry in entries if entry[1] is not entry[0]),
+            "original_tokens": original_tokens,
+            "prompt_tokens": total,
+            "over_budget": total > self.max_prompt_tokens,
+        }
+        return fitted
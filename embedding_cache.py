@@ -0,0 +1,118 @@
+import os
+import mmap
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+
+# persistent embedding cache keyed by a hash of (engine, text)
+# vectors are appended as float32 to a single data file that is read back through mmap,
+# and an append-only index file maps each key to its offset and dimension in that file.
+# a small LRU dict sits on top so hot vectors (popular queries) never touch the disk
+
+
+def cache_key(engine, text):
+    return hashlib.sha256(f"{engine}\0{text}".encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path=".embedding_cache", max_memory_items=2048):
+        self.path = path
+        self.max_memory_items = max_memory_items
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._memory = OrderedDict()
+        self._offsets = {}
+        self._lock = threading.Lock()
+        self._mmap = None
+        self._mapped_size = 0
+
+        os.makedirs(path, exist_ok=True)
+        self._data_path = os.path.join(path, "vectors.f32")
+        self._index_path = os.path.join(path, "index.tsv")
+        open(self._data_path, "ab").close()
+        self._load_index()
+
+    def _load_index(self):
+        if not os.path.exists(self._index_path):
+            return
+        data_size = os.path.getsize(self._data_path)
+        with open(self._index_path, "r") as index_file:
+            for line in index_file:
+                parts = line.rstrip("\n").split("\t")
+                if len(parts) != 3:
+                    continue  # ignore a partially written last line
+                key, offset, dim = parts[0], int(parts[1]), int(parts[2])
+                # skip entries whose vector bytes never made it to disk
+                if offset + dim * 4 <= data_size:
+                    self._offsets[key] = (offset, dim)
+
+    def _read_vector(self, offset, dim):
+        end = offset + dim * 4
+        if self._mmap is None or end > self._mapped_size:
+            if self._mmap is not None:
+                self._mmap.close()
+            with open(self._data_path, "rb") as data_file:
+                self._mmap = mmap.mmap(data_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self._mapped_size = len(self._mmap)
+        vector = array("f")
+        vector.frombytes(self._mmap[offset:end])
+        return vector.tolist()
+
+    def _remember(self, key, vector):
+        self._memory[key] = vector
+        self._memory.move_to_end(key)
+        if len(self._memory) > self.max_memory_items:
+            self._memory.popitem(last=False)
+
+    def get(self, engine, text):
+        key = cache_key(engine, text)
+        with self._lock:
+            vector = self._memory.get(key)
+            if vector is not None:
+                self._memory.move_to_end(key)
+                self.hits += 1
+                return vector
+            location = self._offsets.get(key)
+            if location is None:
+                self.misses += 1
+                return None
+            vector = self._read_vector(*location)
+            self._remember(key, vector)
+            self.hits += 1
+            self.disk_hits += 1
+            return vector
+
+    def put(self, engine, text, vector):
+        key = cache_key(engine, text)
+        with self._lock:
+            if key not in self._offsets:
+                with open(self._data_path, "ab") as data_file:
+                    offset = data_file.tell()
+                    data_file.write(array("f", vector).tobytes())
+                with open(self._index_path, "a") as index_file:
+                    index_file.write(f"{key}\t{offset}\t{len(vector)}\n")
+                self._offsets[key] = (offset, len(vector))
+            self._remember(key, list(vector))
+
+    def __len__(self):
+        return len(self._offsets)
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._offsets),
+            "memory_entries": len(self._memory),
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._mmap is not None:
+                self._mmap.close()
+                self._mmap = None
+                self._mapped_size = 0
@@ -0,0 +1,95 @@
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from tenacity import retry, wait_random_exponential, stop_after_attempt
+from tracing import tracer, retry_hook
+from rate_limiter import estimate_embedding_tokens, INTERACTIVE, BULK
+from router import router
+
+# shared embedding helpers used by the index loader and the query path
+# openai must already be configured (api_key, api_base, ...) by the calling script
+
+embedding_engine = "text-embedding-ada-002"
+
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6), before_sleep=retry_hook)
+def _create_embeddings(texts, engine, priority):
+    # the router picks the endpoint when several are configured, and every attempt waits for its turn on the
+    # deployment there, so retries also respect the rate limits and Retry-After
+    return router.create(openai.Embedding, engine, estimate_embedding_tokens(texts), priority, input=texts)
+
+# one span per request, around the retries, so their count and backoff are recorded on it
+# query embeddings are interactive, embeddings for indexing are bulk and wait behind them
+def _request_embeddings(texts, engine, priority=INTERACTIVE):
+    with tracer.span("embeddings", kind="embedding", engine=engine,
+                     inputs=len(texts) if isinstance(texts, list) else 1) as span:
+        response = span.record_usage(_create_embeddings(texts, engine, priority))
+    # the service does not guarantee the order of the returned items, so sort them back by index
+    data = sorted(response['data'], key=lambda item: item['index'])
+    return [item['embedding'] for item in data]
+
+# function to generate embeddings for title and content fields, and to query embeddings
+def generate_embeddings(text, engine=embedding_engine, cache=None, priority=INTERACTIVE):
+    if cache is not None:
+        embeddings = cache.get(engine, text)
+        if embeddings is not None:
+            return embeddings
+    embeddings = _request_embeddings(text, engine, priority)[0]
+    if cache is not None:
+        cache.put(engine, text, embeddings)
+    return embeddings
+
+# function to embed a list of texts in a single request; the retry policy applies to the whole batch
+def generate_embeddings_batch(texts, engine=embedding_engine, priority=BULK):
+    return _request_embeddings(list(texts), engine, priority)
+
+# function to embed many texts with a bounded number of batch requests in flight, keeping input order
+# texts already in the cache (and duplicates within the input) are not sent to the service
+def embed_in_batches(texts, embedding_batch_size=16, max_concurrent_batches=4,
+                     engine=embedding_engine, cache=None, priority=BULK):
+    vectors = {}
+    missing = []
+    for text in texts:
+        if text in vectors:
+            continue
+        cached = cache.get(engine, text) if cache is not None else None
+        vectors[text] = cached
+        if cached is None:
+            missing.append(text)
+
+    batches = [missing[i:i + embedding_batch_size] for i in range(0, len(missing), embedding_batch_size)]
+    with ThreadPoolExecutor(max_workers=max_concurrent_batches) as executor:
+        # executor.map yields results in submission order, whatever order the batches finish in
+        results = executor.map(lambda batch: generate_embeddings_batch(batch, engine, priority), batches)
+        for batch, batch_vectors in zip(batches, results):
+            for text, vector in zip(batch, batch_vectors):
+                vectors[text] = vector
+                if cache is not None:
+                    cache.put(engine, text, vector)
+
+    return [vectors[text] for text in texts]
+
+@retry(wait=wait_random_exponential(min=1, max=20), stop=stop_after_attempt(6), before_sleep=retry_hook)
+async def _create_embeddings_async(texts, engine, priority, slot=None):
+    # aiohttp requests bypass the instrumented session; the router reports their outcome to the limiter
+    if slot is None:
+        return await router.acreate(openai.Embedding, engine, estimate_embedding_tokens(texts), priority, input=texts)
+    async with slot():
+        return await router.acreate(openai.Embedding, engine, estimate_embedding_tokens(texts), priority, input=texts)
+
+async def _request_embeddings_async(texts, engine, priority=INTERACTIVE, slot=None):
+    with tracer.span("embeddings", kind="embedding", engine=engine,
+                     inputs=len(texts) if isinstance(texts, list) else 1) as span:
+        response = span.record_usage(await _create_embeddings_async(texts, engine, priority, slot))
+    data = sorted(response['data'], key=lambda item: item['index'])
+    return [item['embedding'] for item in data]
+
+# asyncio version of generate_embeddings for the async conversation runner
+# slot: async context manager factory held around each attempt only, not during the backoff between them
+async def generate_embeddings_async(text, engine=embedding_engine, cache=None, priority=INTERACTIVE, slot=None):
+    if cache is not None:
+        embeddings = cache.get(engine, text)
+        if embeddings is not None:
+            return embeddings
+    embeddings = (await _request_embeddings_async(text, engine, priority, slot))[0]
+    if cache is not None:
+        cache.put(engine, text, embeddings)
+    return embeddings
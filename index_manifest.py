@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+
+# manifest of what was last pushed to the search index: a hash of the index schema
+# and a content hash per recipe_id, used to send only the documents that changed
+
+
+def _hash_json(value):
+    payload = json.dumps(value, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+# hash of the index definition as we create it (fields, vector search and semantic settings)
+def schema_hash(index):
+    return _hash_json(index.serialize())
+
+
+# whether a live index (index_client.get_index) has the fields of index: names, types, key and vector dimensions.
+# the service fills in defaults the local definition leaves out, so the two cannot be compared by schema_hash
+def same_fields(live_index, index):
+    def fields(search_index):
+        return {field.name: (field.type, bool(field.key), getattr(field, "vector_search_dimensions", None))
+                for field in search_index.fields}
+    return fields(live_index) == fields(index)
+
+
+# the keys of every document in a live index, with unknown hashes: adopted without a manifest, the index may hold
+# documents the source no longer has, and these entries let diff_documents report them as removed
+def live_documents(search_client, key_field="recipe_id"):
+    return {document[key_field]: None for document in search_client.search("*", select=[key_field])}
+
+
+# hash of the document content plus the embedding engine, so switching engines re-embeds everything
+def document_hash(document, engine):
+    return _hash_json({"engine": engine, "document": document})
+
+
+def load_manifest(path, index_name):
+    empty = {"index_name": index_name, "schema_hash": None, "documents": {}}
+    if not os.path.exists(path):
+        return empty
+    with open(path, "r") as manifest_file:
+        manifest = json.load(manifest_file)
+    # a manifest written for another index says nothing about this one
+    if manifest.get("index_name") != index_name:
+        return empty
+    return manifest
+
+
+def save_manifest(path, manifest):
+    # write to a temporary file first so a crash never leaves a truncated manifest behind
+    tmp_path = path + ".tmp"
+    with open(tmp_path, "w") as manifest_file:
+        json.dump(manifest, manifest_file, indent=1, sort_keys=True)
+    os.replace(tmp_path, path)
+
+
+# compare the hashes in the manifest with the hashes of the current documents
+def diff_documents(previous, current):
+    added = [key for key in current if key not in previous]
+    changed = [key for key in current if key in previous and previous[key] != current[key]]
+    removed = [key for key in previous if key not in current]
+    unchanged = len(current) - len(added) - len(changed)
+    return {"added": added, "changed": changed, "removed": removed, "unchanged": unchanged}
+
+
+def format_diff(diff):
+    return (f"{len(diff['added'])} added, {len(diff['changed'])} changed, "
+            f"{len(diff['removed'])} removed, {diff['unchanged']} unchanged")
@@ -0,0 +1,192 @@
+import time
+import queue
+import threading
+
+# staged producer/consumer pipeline for loading documents into the index:
+#   reader -> embed_queue -> embedder pool -> embedded_queue -> batcher -> upload_queue -> uploader pool
+# every queue is bounded, so a slow stage blocks the stages before it (backpressure) and
+# only a few batches are ever held in memory, however large the input is
+
+_DONE = object()
+
+
+class StageStats:
+    def __init__(self, name):
+        self.name = name
+        self.items = 0
+        self.busy_seconds = 0.0
+        self.queue_samples = 0
+        self.queue_depth_total = 0
+        self.queue_depth_max = 0
+        self.started = None
+        self.finished = None
+        self._lock = threading.Lock()
+
+    def record(self, items, busy_seconds):
+        with self._lock:
+            if self.started is None:
+                self.started = time.perf_counter() - busy_seconds
+            self.items += items
+            self.busy_seconds += busy_seconds
+            self.finished = time.perf_counter()
+
+    def sample_queue(self, depth):
+        with self._lock:
+            self.queue_samples += 1
+            self.queue_depth_total += depth
+            self.queue_depth_max = max(self.queue_depth_max, depth)
+
+    def as_dict(self):
+        elapsed = (self.finished - self.started) if self.started is not None else 0.0
+        return {
+            "stage": self.name,
+            "docs": self.items,
+            "docs_per_second": self.items / elapsed if elapsed > 0 else 0.0,
+            "busy_seconds": self.busy_seconds,
+            "output_queue_depth_avg": self.queue_depth_total / self.queue_samples if self.queue_samples else 0.0,
+            "output_queue_depth_max": self.queue_depth_max,
+        }
+
+
+class PipelineReport:
+    def __init__(self, stages, elapsed):
+        self.stages = stages
+        self.elapsed = elapsed
+
+    def as_dicts(self):
+        return [stage.as_dict() for stage in self.stages]
+
+    def __str__(self):
+        lines = [f"Pipeline finished in {self.elapsed:.2f}s"]
+        for stage in self.as_dicts():
+            lines.append(f"  {stage['stage']:<9} {stage['docs']:>7} docs  {stage['docs_per_second']:>9.1f} docs/s  "
+                         f"busy {stage['busy_seconds']:.2f}s  "
+                         f"queue avg {stage['output_queue_depth_avg']:.1f} max {stage['output_queue_depth_max']}")
+        return "\n".join(lines)
+
+
+# put an item on a bounded queue, giving up if another stage has failed so nothing deadlocks
+def _put(target, item, stop, stats=None):
+    while not stop.is_set():
+        try:
+            target.put(item, timeout=0.1)
+            if stats is not None:
+                stats.sample_queue(target.qsize())
+            return True
+        except queue.Full:
+            continue
+    return False
+
+
+def _get(source, stop):
+    while not stop.is_set():
+        try:
+            return source.get(timeout=0.1)
+        except queue.Empty:
+            continue
+    return _DONE
+
+
+# records: any iterable of documents (read lazily)
+# embed_batch(documents) -> documents with their vectors, called with up to embedding_batch_size documents
+# upload_batch(documents) -> None, called with up to batch_size documents
+def run_pipeline(records, embed_batch, upload_batch, embedding_batch_size=16, batch_size=100,
+                 embed_workers=4, upload_workers=2, queue_size=8):
+    stop = threading.Event()
+    errors = []
+    embed_queue = queue.Queue(maxsize=queue_size)
+    embedded_queue = queue.Queue(maxsize=queue_size)
+    upload_queue = queue.Queue(maxsize=queue_size)
+
+    reader_stats = StageStats("reader")
+    embedder_stats = StageStats("embedder")
+    batcher_stats = StageStats("batcher")
+    uploader_stats = StageStats("uploader")
+
+    def guarded(stage):
+        def run():
+            try:
+                stage()
+            except BaseException as error:
+                errors.append(error)
+                stop.set()
+        return run
+
+    def reader():
+        chunk = []
+        started = time.perf_counter()
+        for record in records:
+            chunk.append(record)
+            if len(chunk) == embedding_batch_size:
+                reader_stats.record(len(chunk), time.perf_counter() - started)
+                if not _put(embed_queue, chunk, stop, reader_stats):
+                    return
+                chunk = []
+                started = time.perf_counter()
+        if chunk:
+            reader_stats.record(len(chunk), time.perf_counter() - started)
+            _put(embed_queue, chunk, stop, reader_stats)
+        for _ in range(embed_workers):
+            _put(embed_queue, _DONE, stop)
+
+    def embedder():
+        while True:
+            chunk = _get(embed_queue, stop)
+            if chunk is _DONE:
+                break
+            started = time.perf_counter()
+            embedded = embed_batch(chunk)
+            embedder_stats.record(len(embedded), time.perf_counter() - started)
+            if not _put(embedded_queue, embedded, stop, embedder_stats):
+                return
+        _put(embedded_queue, _DONE, stop)
+
+    def batcher():
+        pending = []
+        finished_embedders = 0
+        while finished_embedders < embed_workers:
+            chunk = _get(embedded_queue, stop)
+            if chunk is _DONE:
+                if stop.is_set():
+                    return
+                finished_embedders += 1
+                continue
+            started = time.perf_counter()
+            pending.extend(chunk)
+            while len(pending) >= batch_size:
+                batch, pending = pending[:batch_size], pending[batch_size:]
+                batcher_stats.record(len(batch), time.perf_counter() - started)
+                if not _put(upload_queue, batch, stop, batcher_stats):
+                    return
+                started = time.perf_counter()
+        if pending:
+            batcher_stats.record(len(pending), 0.0)
+            _put(upload_queue, pending, stop, batcher_stats)
+        for _ in range(upload_workers):
+            _put(upload_queue, _DONE, stop)
+
+    def uploader():
+        while True:
+            batch = _get(upload_queue, stop)
+            if batch is _DONE:
+                break
+            started = time.perf_counter()
+            upload_batch(batch)
+            uploader_stats.record(len(batch), time.perf_counter() - started)
+
+    threads = [threading.Thread(target=guarded(reader), name="ingest-reader")]
+    threads += [threading.Thread(target=guarded(embedder), name=f"ingest-embedder-{i}") for i in range(embed_workers)]
+    threads += [threading.Thread(target=guarded(batcher), name="ingest-batcher")]
+    threads += [threading.Thread(target=guarded(uploader), name=f"ingest-uploader-{i}") for i in range(upload_workers)]
+
+    started = time.perf_counter()
+    for thread in threads:
+        thread.daemon = True
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    if errors:
+        raise errors[0]
+    return PipelineReport([reader_stats, embedder_stats, batcher_stats, uploader_stats],
+                          time.perf_counter() - started)
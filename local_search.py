@@ -0,0 +1,169 @@
+import re
+import json
+import math
+import numpy as np
+from collections import Counter, defaultdict
+from odata_filter import FilterIndex
+from vector_ops import normalize_rows, top_k
+from quantization import build_vector_store
+
+# in-process hybrid search over the recipes, used as a drop-in backend for query_recipes
+# vectors live in one contiguous matrix (rows normalised, so a dot product is the cosine similarity),
+# text search is BM25 over recipe_name, description and recipe, and the two rankings are merged
+# with reciprocal rank fusion like the hybrid queries of Azure Cognitive Search
+
+text_fields = ["recipe_name", "description", "recipe"]
+
+stop_words = {"a", "an", "and", "are", "as", "at", "be", "by", "for", "from", "in", "into", "is", "it",
+              "of", "on", "or", "that", "the", "to", "with", "me", "i", "want", "make", "recipe"}
+
+_token_pattern = re.compile(r"[a-z0-9]+")
+
+
+def tokenize(text):
+    tokens = []
+    for token in _token_pattern.findall(text.lower()):
+        if token in stop_words:
+            continue
+        # very light stemming so "tomatoes" matches "tomato" and "noodles" matches "noodle"
+        if len(token) > 4 and token.endswith("oes"):
+            token = token[:-2]
+        elif len(token) > 3 and token.endswith("s") and not token.endswith("ss"):
+            token = token[:-1]
+        tokens.append(token)
+    return tokens
+
+
+# read recipes_final.jsonl the same way the loader does
+def load_recipes(path):
+    recipes = []
+    with open(path, "r") as j_in:
+        for line in j_in:
+            json_recipe = json.loads(line)
+            if isinstance(json_recipe['total_time'], str):
+                json_recipe['total_time'] = int(json_recipe['total_time'].split(' ')[0])
+            recipes.append(json_recipe)
+    return recipes
+
+
+class LocalRecipeIndex:
+    # ann: optional approximate index (ann_index.IVFIndex) keyed by recipe_id, used for unfiltered vector queries
+    # vector_storage: "float32", "float16", "int8" or "pq" (see quantization.py), store_options go to that store
+    def __init__(self, recipes, vectors, k1=1.2, b=0.75, ann=None, vector_storage="float32", store_options=None):
+        self.recipes = recipes
+        self.vector_store = build_vector_store(vector_storage, vectors, **(store_options or {}))
+        self.ann = ann
+        self.position_by_id = {recipe['recipe_id']: position for position, recipe in enumerate(recipes)}
+        self.k1 = k1
+        self.b = b
+        self._build_bm25()
+        self.filter_index = FilterIndex(recipes)
+
+    @classmethod
+    def from_jsonl(cls, path, embed_texts, rerank_path=None, **kwargs):
+        # embed_texts(list of str) -> list of vectors, e.g. embeddings.embed_in_batches with a cache
+        # rerank_path: with vector_storage="pq", the full vectors are saved there and memory-mapped as the
+        # rerank source, so the shortlist from the PQ codes is re-scored exactly without keeping them in memory
+        recipes = load_recipes(path)
+        vectors = embed_texts([recipe['recipe'] for recipe in recipes])
+        if rerank_path is not None and kwargs.get("vector_storage") == "pq":
+            np.save(rerank_path, normalize_rows(np.asarray(vectors, dtype=np.float32)))
+            kwargs["store_options"] = dict(kwargs.get("store_options") or {},
+                                           rerank_source=np.load(rerank_path, mmap_mode="r"))
+        return cls(recipes, vectors, **kwargs)
+
+    def __len__(self):
+        return len(self.recipes)
+
+    # normalised float32 vectors: the full vectors of the rerank source when the store has one, otherwise
+    # decoded from the store when it is quantized
+    @property
+    def vectors(self):
+        rerank_source = getattr(self.vector_store, "rerank_source", None)
+        if rerank_source is not None:
+            return np.asarray(rerank_source, dtype=np.float32)
+        return self.vector_store.decode()
+
+    def _build_bm25(self):
+        postings = defaultdict(lambda: ([], []))
+        lengths = np.zeros(len(self.recipes), dtype=np.float32)
+        for position, recipe in enumerate(self.recipes):
+            tokens = []
+            for field in text_fields:
+                tokens.extend(tokenize(recipe.get(field) or ""))
+            lengths[position] = len(tokens)
+            for term, count in Counter(tokens).items():
+                postings[term][0].append(position)
+                postings[term][1].append(count)
+
+        self.doc_lengths = lengths
+        self.average_length = float(lengths.mean()) if len(lengths) else 0.0
+        self.postings = {}
+        n = len(self.recipes)
+        for term, (ids, counts) in postings.items():
+            idf = math.log(1 + (n - len(ids) + 0.5) / (len(ids) + 0.5))
+            self.postings[term] = (np.asarray(ids, dtype=np.int64), np.asarray(counts, dtype=np.float32), idf)
+
+    def text_scores(self, query):
+        scores = np.zeros(len(self.recipes), dtype=np.float32)
+        length_norm = self.k1 * (1 - self.b + self.b * self.doc_lengths / max(self.average_length, 1e-9))
+        for term in set(tokenize(query)):
+            entry = self.postings.get(term)
+            if entry is None:
+                continue
+            ids, counts, idf = entry
+            scores[ids] += idf * counts * (self.k1 + 1) / (counts + length_norm[ids])
+        return scores
+
+    # candidates: optional array of row positions; only those documents are ranked
+    def text_search(self, query, k, candidates=None):
+        scores = self.text_scores(query)
+        if candidates is not None:
+            scores = scores[candidates]
+        order = top_k(scores, k)
+        order = order[scores[order] > 0]
+        positions = order if candidates is None else candidates[order]
+        return positions, scores[order]
+
+    # batched cosine top-k: query_vectors is (m, d), returns (m, k) positions and scores
+    def vector_search(self, query_vectors, k, candidates=None):
+        query_vectors = normalize_rows(np.atleast_2d(query_vectors))
+        return self.vector_store.search(query_vectors, k, candidates)
+
+    # filter: OData filter text, applied before scoring so only matching recipes are ranked
+    def search(self, search_text, vector, vector_k=3, top=50, filter=None, candidates=None, select=None, rrf_k=60):
+        if filter:
+            filtered = self.filter_index.candidates(filter)
+            candidates = filtered if candidates is None else np.intersect1d(filtered, candidates)
+        if candidates is not None:
+            candidates = np.asarray(candidates, dtype=np.int64)
+            if len(candidates) == 0:
+                return []
+
+        fused = defaultdict(float)
+        if vector is not None:
+            if self.ann is not None and candidates is None:
+                # the approximate index only shortlists; the store scores the shortlist like an exact query,
+                # so a PQ store re-ranks it against the full vectors
+                shortlist = max(vector_k, getattr(self.vector_store, "rerank", 0))
+                ann_positions = np.asarray([self.position_by_id[recipe_id]
+                                            for recipe_id, _ in self.ann.search(vector, shortlist)[0]], dtype=np.int64)
+                positions = self.vector_search(vector, vector_k, ann_positions)[0][0] if len(ann_positions) else []
+            else:
+                # filtered queries score their (already pruned) candidates exactly
+                positions = self.vector_search(vector, vector_k, candidates)[0][0]
+            for rank, position in enumerate(positions):
+                fused[int(position)] += 1.0 / (rrf_k + rank + 1)
+        if search_text:
+            positions, _ = self.text_search(search_text, top, candidates)
+            for rank, position in enumerate(positions):
+                fused[int(position)] += 1.0 / (rrf_k + rank + 1)
+
+        ranked = sorted(fused.items(), key=lambda item: item[1], reverse=True)[:top]
+        results = []
+        for position, score in ranked:
+            recipe = self.recipes[position]
+            result = {field: recipe.get(field) for field in select} if select else dict(recipe)
+            result["@search.score"] = score
+            results.append(result)
+        return results
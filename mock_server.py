@@ -0,0 +1,616 @@
+import re
+import json
+import time
+import base64
+import random
+import hashlib
+import argparse
+import threading
+import numpy as np
+from collections import Counter, deque
+from urllib.parse import urlsplit
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+# local stand-in for Azure OpenAI (chat completions, including function_call / tool_calls and streaming,
+# and embeddings) and Azure Cognitive Search (document upload and hybrid search), for load tests without network
+#   python mock_server.py --port 8000 --chat-latency lognormal:400:0.5 --rpm 600
+#   OPENAI_API_BASE=http://127.0.0.1:8000  and  "SEARCH_SERVICE_ENDPOINT": "http://127.0.0.1:8000" in config.json
+# responses are synthetic but shaped like the real ones: the model answers a user message by calling the function
+# whose name and description best match it (arguments filled from the schema and the message) and answers a
+# function result with text. latency is drawn from a configurable distribution per endpoint, 429s can be
+# injected at random or by requests/tokens per minute per deployment, and real sessions can be recorded through
+# --upstream and replayed from the fixture file later.
+# the index management API (SearchIndexClient) refuses non-https endpoints; pass --certfile/--keyfile to serve TLS
+
+
+# "fixed:50", "uniform:20:80", "normal:100:20" or "lognormal:400:0.5" (median ms, sigma), all in milliseconds
+class LatencyModel:
+    def __init__(self, spec="fixed:0"):
+        parts = spec.split(":")
+        self.distribution = parts[0]
+        self.params = [float(part) for part in parts[1:]]
+        if self.distribution not in ("fixed", "uniform", "normal", "lognormal"):
+            raise ValueError(f"Unknown latency distribution {spec!r}")
+
+    def sample(self, rng):
+        if self.distribution == "fixed":
+            ms = self.params[0] if self.params else 0.0
+        elif self.distribution == "uniform":
+            ms = rng.uniform(self.params[0], self.params[1])
+        elif self.distribution == "normal":
+            ms = rng.gauss(self.params[0], self.params[1])
+        else:
+            ms = self.params[0] * np.exp(rng.gauss(0.0, self.params[1] if len(self.params) > 1 else 0.5))
+        return max(ms, 0.0) / 1000
+
+
+def estimate_tokens(value):
+    text = value if isinstance(value, str) else json.dumps(value)
+    return max(len(text) // 4, 1)
+
+
+# requests and tokens per minute per deployment over a sliding window, like the Azure OpenAI quota
+class QuotaWindow:
+    def __init__(self, rpm=None, tpm=None):
+        self.rpm = rpm
+        self.tpm = tpm
+        self._events = {}
+        self._lock = threading.Lock()
+
+    # None when admitted, otherwise the seconds until the request would fit
+    def admit(self, deployment, tokens, now):
+        with self._lock:
+            events = self._events.setdefault(deployment, deque())
+            while events and events[0][0] <= now - 60:
+                events.popleft()
+            used_tokens = sum(event[1] for event in events)
+            if (self.rpm and len(events) >= self.rpm) or (self.tpm and used_tokens + tokens > self.tpm):
+                return max(events[0][0] + 60 - now, 0.1) if events else 1.0
+            events.append((now, tokens))
+            return None
+
+    def remaining(self, deployment):
+        with self._lock:
+            events = self._events.get(deployment, ())
+            return {
+                "requests": None if not self.rpm else max(self.rpm - len(events), 0),
+                "tokens": None if not self.tpm else max(self.tpm - sum(event[1] for event in events), 0),
+            }
+
+
+def request_key(method, path, body):
+    return hashlib.sha256(f"{method} {urlsplit(path).path} {json.dumps(body, sort_keys=True)}".encode()).hexdigest()
+
+
+# request/response pairs in a JSONL file, keyed by method, path and canonical request body
+# repeated identical requests replay the recorded responses in order
+class FixtureStore:
+    def __init__(self, path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._responses = {}
+        self._next = Counter()
+        try:
+            with open(path) as fixture_file:
+                for line in fixture_file:
+                    if line.strip():
+                        entry = json.loads(line)
+                        self._responses.setdefault(entry["key"], []).append(entry)
+        except FileNotFoundError:
+            pass
+
+    def __len__(self):
+        return sum(len(entries) for entries in self._responses.values())
+
+    def lookup(self, key):
+        with self._lock:
+            entries = self._responses.get(key)
+            if not entries:
+                return None
+            entry = entries[self._next[key] % len(entries)]
+            self._next[key] += 1
+            return entry
+
+    def record(self, entry):
+        with self._lock:
+            self._responses.setdefault(entry["key"], []).append(entry)
+            with open(self.path, "a") as fixture_file:
+                fixture_file.write(json.dumps(entry) + "\n")
+
+
+_word_pattern = re.compile(r"[a-z0-9&]+")
+
+
+# synthetic chat model: calls the best matching function for a new user message, answers function results with text
+class MockModel:
+    def __init__(self, function_rounds=1):
+        self.function_rounds = function_rounds
+
+    @staticmethod
+    def _functions(body):
+        if body.get("tools"):
+            return [tool["function"] for tool in body["tools"]], True
+        return body.get("functions") or [], False
+
+    def respond(self, body):
+        messages = body.get("messages", [])
+        functions, use_tools = self._functions(body)
+        last_user = max((position for position, message in enumerate(messages) if message["role"] == "user"), default=-1)
+        user_text = (messages[last_user].get("content") or "") if last_user >= 0 else ""
+        results = sum(1 for message in messages[last_user + 1:] if message["role"] in ("function", "tool"))
+
+        if functions and body.get("function_call") != "none" and body.get("tool_choice") != "none" \
+                and results < self.function_rounds:
+            function = self._choose(functions, user_text, messages[last_user + 1:])
+            calls = self._arguments(function, user_text)
+            if use_tools:
+                tool_calls = [{"id": f"call_{hashlib.sha1(json.dumps([function['name'], arguments, position]).encode()).hexdigest()[:12]}",
+                               "type": "function",
+                               "function": {"name": function["name"], "arguments": json.dumps(arguments)}}
+                              for position, arguments in enumerate(calls)]
+                return {"role": "assistant", "content": None, "tool_calls": tool_calls}, "tool_calls"
+            return {"role": "assistant", "content": None,
+                    "function_call": {"name": function["name"], "arguments": json.dumps(calls[0])}}, "function_call"
+
+        last = messages[-1] if messages else {"content": ""}
+        source = str(last.get("content") or "")
+        answer = f"Here is what I found for \"{user_text[:80]}\": {source[:160]}" if last.get("role") in ("function", "tool") \
+            else f"This is a mock answer to \"{user_text[:120]}\"."
+        return {"role": "assistant", "content": answer}, "stop"
+
+    @staticmethod
+    def _choose(functions, user_text, turn_messages):
+        words = set(_word_pattern.findall(user_text.lower()))
+        called = {message.get("name") for message in turn_messages if message["role"] == "function"}
+
+        def score(function):
+            text = (function["name"].replace("_", " ") + " " + function.get("description", "")).lower()
+            return (function["name"] not in called, len(words & set(_word_pattern.findall(text))))
+        return max(functions, key=score)
+
+    # one argument set per call; several enum values named in the message give several (parallel) calls
+    def _arguments(self, function, user_text):
+        properties = function.get("parameters", {}).get("properties", {})
+        required = function.get("parameters", {}).get("required", [])
+        lowered = user_text.lower()
+        arguments = {}
+        fan_out = None
+        for name, schema in properties.items():
+            mentioned = [value for value in schema.get("enum", []) if str(value).lower() in lowered]
+            if schema.get("type") == "array" and "enum" in schema.get("items", {}):
+                mentioned = [value for value in schema["items"]["enum"] if str(value).lower() in lowered]
+                arguments[name] = mentioned or schema["items"]["enum"][:2]
+            elif name in required or mentioned:
+                arguments[name] = mentioned[0] if mentioned else self._value(name, schema, user_text)
+                if len(mentioned) > 1 and fan_out is None:
+                    fan_out = (name, mentioned)
+        if fan_out is None:
+            return [arguments]
+        return [dict(arguments, **{fan_out[0]: value}) for value in fan_out[1]]
+
+    @staticmethod
+    def _value(name, schema, user_text):
+        if "enum" in schema:
+            return schema["enum"][0]
+        kind = schema.get("type")
+        if kind in ("number", "integer"):
+            return 1
+        if kind == "boolean":
+            return False
+        if kind == "array":
+            return []
+        if kind == "object":
+            return {}
+        if "date" in name:
+            return "2023-07-13" if "end" in name else "2023-07-12"
+        if "location" in name:
+            return "America/New_York"
+        return user_text
+
+
+def mock_embedding(text, dimensions):
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "little")
+    vector = np.random.default_rng(seed).standard_normal(dimensions).astype(np.float32)
+    return vector / np.linalg.norm(vector)
+
+
+# documents of one search index, searched with the in-process hybrid index of local_search.py
+class MockSearchIndex:
+    def __init__(self, key_field="recipe_id", definition=None):
+        self.key_field = key_field
+        self.definition = definition
+        self.documents = {}
+        self._search_index = None
+        self._vector_field = None
+        self._lock = threading.Lock()
+
+    def index(self, actions):
+        results = []
+        with self._lock:
+            for action in actions:
+                action = dict(action)
+                kind = action.pop("@search.action", "upload")
+                key = str(action.get(self.key_field))
+                if kind == "delete":
+                    self.documents.pop(key, None)
+                elif kind in ("merge", "mergeOrUpload") and key in self.documents:
+                    self.documents[key].update(action)
+                elif kind == "merge":
+                    results.append({"key": key, "status": False, "errorMessage": "Document not found.", "statusCode": 404})
+                    continue
+                else:
+                    self.documents[key] = action
+                results.append({"key": key, "status": True, "errorMessage": None, "statusCode": 200})
+            self._search_index = None
+        return results
+
+    def _index_for(self, vector_field):
+        from local_search import LocalRecipeIndex
+        with self._lock:
+            if self._search_index is None or self._vector_field != vector_field:
+                documents = list(self.documents.values())
+                dimensions = next((len(document[vector_field]) for document in documents
+                                   if vector_field and document.get(vector_field)), 1)
+                vectors = np.asarray([document.get(vector_field) or np.zeros(dimensions) for document in documents],
+                                     dtype=np.float32).reshape(len(documents), dimensions)
+                self._search_index = LocalRecipeIndex(documents, vectors)
+                self._vector_field = vector_field
+            return self._search_index
+
+    def search(self, body):
+        vectors = body.get("vectors") or []
+        vector_query = vectors[0] if vectors else None
+        vector_field = vector_query["fields"].split(",")[0] if vector_query else None
+        search_index = self._index_for(vector_field)
+        if not len(search_index):
+            return []
+        select = body["select"].split(",") if body.get("select") else None
+        results = search_index.search(
+            search_text=body.get("search") if body.get("search") not in (None, "*") else None,
+            vector=np.asarray(vector_query["value"], dtype=np.float32) if vector_query else None,
+            vector_k=vector_query.get("k", 3) if vector_query else 3,
+            top=body.get("top") or 50,
+            filter=body.get("filter"),
+        )
+        for result in results:
+            result.pop(vector_field, None)
+        if select:
+            results = [{**{field: result.get(field) for field in select}, "@search.score": result["@search.score"]}
+                       for result in results]
+        return results
+
+
+class MockState:
+    def __init__(self, chat_latency="fixed:0", embedding_latency="fixed:0", search_latency="fixed:0",
+                 chunk_latency="fixed:0", error_rate=0.0, rpm=None, tpm=None, dimensions=1536, function_rounds=1,
+                 fixtures=None, mode="synthetic", upstream=None, seed=0):
+        if mode not in ("synthetic", "record", "replay"):
+            raise ValueError(f"Unknown mode {mode!r}")
+        if mode == "record" and not upstream:
+            raise ValueError("record mode needs an upstream URL")
+        if mode == "record" and not fixtures:
+            raise ValueError("record mode needs a fixtures file")
+        self.latency = {"chat": LatencyModel(chat_latency), "embeddings": LatencyModel(embedding_latency),
+                        "search": LatencyModel(search_latency), "chunk": LatencyModel(chunk_latency)}
+        self.error_rate = error_rate
+        self.quota = QuotaWindow(rpm, tpm)
+        self.dimensions = dimensions
+        self.model = MockModel(function_rounds)
+        self.fixtures = FixtureStore(fixtures) if fixtures else None
+        self.mode = mode
+        self.upstream = upstream.rstrip("/") if upstream else None
+        self.indexes = {}
+        self.stats = Counter()
+        self._rng = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def random(self):
+        with self._lock:
+            return self._rng.random()
+
+    def sample_latency(self, kind):
+        with self._lock:
+            return self.latency[kind].sample(self._rng)
+
+    def search_index(self, name):
+        with self._lock:
+            if name not in self.indexes:
+                self.indexes[name] = MockSearchIndex()
+            return self.indexes[name]
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] += 1
+
+
+class MockHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    state = None
+
+    routes = [
+        ("POST", re.compile(r"^/openai/deployments/(?P<name>[^/]+)/chat/completions$"), "chat"),
+        ("POST", re.compile(r"^/openai/deployments/(?P<name>[^/]+)/embeddings$"), "embeddings"),
+        ("POST", re.compile(r"^/indexes\('(?P<name>[^']+)'\)/docs/search\.post\.search$"), "search"),
+        ("POST", re.compile(r"^/indexes\('(?P<name>[^']+)'\)/docs/search\.index$"), "index_documents"),
+        ("GET", re.compile(r"^/indexes\('(?P<name>[^']+)'\)/docs/\$count$"), "count_documents"),
+        ("GET", re.compile(r"^/indexes\('(?P<name>[^']+)'\)$"), "get_index"),
+        ("PUT", re.compile(r"^/indexes\('(?P<name>[^']+)'\)$"), "put_index"),
+        ("DELETE", re.compile(r"^/indexes\('(?P<name>[^']+)'\)$"), "delete_index"),
+        ("POST", re.compile(r"^/indexes$"), "put_index"),
+        ("GET", re.compile(r"^/_stats$"), "get_stats"),
+    ]
+
+    def log_message(self, format, *args):
+        pass
+
+    def _dispatch(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        raw = self.rfile.read(length) if length else b""
+        try:
+            body = json.loads(raw) if raw else {}
+        except ValueError:
+            return self._json(400, {"error": {"code": "BadRequest", "message": "Invalid JSON body"}})
+
+        path = urlsplit(self.path).path
+        for method, pattern, handler_name in self.routes:
+            match = pattern.match(path)
+            if method == self.command and match:
+                break
+        else:
+            if self.command == "GET":
+                return self._json(200, {"status": "ok"})  # warm-up and health checks
+            return self._json(404, {"error": {"code": "NotFound", "message": f"No route for {self.command} {path}"}})
+
+        state = self.state
+        state.count(handler_name)
+        key = request_key(self.command, self.path, body)
+        if handler_name in ("chat", "embeddings", "search", "index_documents"):
+            if self._throttled(handler_name, match.group("name"), body):
+                return
+            if state.mode == "replay" and state.fixtures is not None:
+                entry = state.fixtures.lookup(key)
+                if entry is not None:
+                    state.count("replayed")
+                    time.sleep(entry.get("elapsed", 0.0))
+                    return self._send(entry["status"], entry["body"].encode(), entry["headers"])
+            if state.mode == "record":
+                return self._proxy(key, raw, body)
+        getattr(self, "_" + handler_name)(match.group("name") if "name" in pattern.groupindex else None, body)
+
+    do_GET = do_POST = do_PUT = do_DELETE = _dispatch
+
+    def _throttled(self, handler_name, deployment, body):
+        state = self.state
+        tokens = estimate_tokens(body.get("messages") or body.get("input") or "") + (body.get("max_tokens") or 0)
+        retry_after = None
+        if handler_name in ("chat", "embeddings"):
+            retry_after = state.quota.admit(deployment, tokens, time.monotonic())
+        if retry_after is None and state.error_rate and state.random() < state.error_rate:
+            retry_after = 1.0
+        if retry_after is None:
+            return False
+        state.count("throttled")
+        self._json(429, {"error": {"code": "429", "message": "Requests to the API have exceeded the call rate limit. "
+                                                             f"Please retry after {retry_after:.0f} seconds."}},
+                   {"Retry-After": str(max(int(np.ceil(retry_after)), 1)), "retry-after-ms": str(int(retry_after * 1000)),
+                    "x-ratelimit-remaining-requests": "0", "x-ratelimit-remaining-tokens": "0"})
+        return True
+
+    def _rate_limit_headers(self, deployment):
+        remaining = self.state.quota.remaining(deployment)
+        headers = {}
+        if remaining["requests"] is not None:
+            headers["x-ratelimit-remaining-requests"] = str(remaining["requests"])
+        if remaining["tokens"] is not None:
+            headers["x-ratelimit-remaining-tokens"] = str(remaining["tokens"])
+        return headers
+
+    def _proxy(self, key, raw, body):
+        import requests
+        started = time.perf_counter()
+        headers = {name: value for name, value in self.headers.items()
+                   if name.lower() in ("api-key", "authorization", "content-type", "accept")}
+        response = requests.request(self.command, self.state.upstream + self.path, data=raw, headers=headers, timeout=120)
+        entry = {
+            "key": key, "method": self.command, "path": urlsplit(self.path).path, "request": body,
+            "status": response.status_code, "elapsed": time.perf_counter() - started, "body": response.text,
+            "headers": {name: value for name, value in response.headers.items()
+                        if name.lower() in ("content-type", "retry-after", "retry-after-ms")
+                        or name.lower().startswith("x-ratelimit")},
+        }
+        self.state.fixtures.record(entry)
+        self.state.count("recorded")
+        self._send(entry["status"], entry["body"].encode(), entry["headers"])
+
+    def _send(self, status, payload, headers=None):
+        self.send_response(status)
+        headers = dict(headers or {})
+        headers.setdefault("Content-Type", "application/json")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.send_header("Content-Length", str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def _json(self, status, value, headers=None):
+        self._send(status, json.dumps(value).encode(), headers)
+
+    def _chat(self, deployment, body):
+        state = self.state
+        message, finish_reason = state.model.respond(body)
+        usage = {"prompt_tokens": estimate_tokens(body.get("messages", [])) + estimate_tokens(body.get("functions") or body.get("tools") or ""),
+                 "completion_tokens": estimate_tokens(message)}
+        usage["total_tokens"] = usage["prompt_tokens"] + usage["completion_tokens"]
+        completion_id = "chatcmpl-" + hashlib.sha1(json.dumps(body, sort_keys=True).encode()).hexdigest()[:24]
+        headers = self._rate_limit_headers(deployment)
+        time.sleep(state.sample_latency("chat"))
+        if body.get("stream"):
+            return self._stream(completion_id, deployment, message, finish_reason, headers)
+        self._json(200, {"id": completion_id, "object": "chat.completion", "created": int(time.time()), "model": deployment,
+                         "choices": [{"index": 0, "finish_reason": finish_reason, "message": message}], "usage": usage},
+                   headers)
+
+    def _stream(self, completion_id, deployment, message, finish_reason, headers):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Cache-Control", "no-cache")
+        self.send_header("Connection", "close")
+        for name, value in headers.items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.close_connection = True
+
+        def chunk(delta, finish=None):
+            event = {"id": completion_id, "object": "chat.completion.chunk", "created": int(time.time()), "model": deployment,
+                     "choices": [{"index": 0, "finish_reason": finish, "delta": delta}]}
+            self.wfile.write(f"data: {json.dumps(event)}\n\n".encode())
+            self.wfile.flush()
+            time.sleep(self.state.sample_latency("chunk"))
+
+        # like Azure, the first event carries no choices (content filter results only)
+        self.wfile.write(f"data: {json.dumps({'id': '', 'object': '', 'created': 0, 'model': '', 'choices': []})}\n\n".encode())
+        chunk({"role": "assistant", "content": None if "function_call" in message else ""})
+        if message.get("function_call"):
+            arguments = message["function_call"]["arguments"]
+            chunk({"function_call": {"name": message["function_call"]["name"], "arguments": ""}})
+            for start in range(0, len(arguments), 16):
+                chunk({"function_call": {"arguments": arguments[start:start + 16]}})
+        elif message.get("tool_calls"):
+            for position, tool_call in enumerate(message["tool_calls"]):
+                chunk({"tool_calls": [{"index": position, "id": tool_call["id"], "type": "function",
+                                       "function": {"name": tool_call["function"]["name"],
+                                                    "arguments": tool_call["function"]["arguments"]}}]})
+        else:
+            for word in re.findall(r"\S+\s*", message["content"]):
+                chunk({"content": word})
+        chunk({}, finish_reason)
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+    def _embeddings(self, deployment, body):
+        state = self.state
+        texts = body.get("input", [])
+        texts = [texts] if isinstance(texts, str) else texts
+        data = []
+        for position, text in enumerate(texts):
+            vector = mock_embedding(text if isinstance(text, str) else json.dumps(text), state.dimensions)
+            # openai 0.28 asks for base64 and decodes it back to floats
+            embedding = base64.b64encode(vector.tobytes()).decode() if body.get("encoding_format") == "base64" \
+                else vector.tolist()
+            data.append({"object": "embedding", "index": position, "embedding": embedding})
+        tokens = estimate_tokens(texts)
+        time.sleep(state.sample_latency("embeddings"))
+        self._json(200, {"object": "list", "model": deployment, "data": data,
+                         "usage": {"prompt_tokens": tokens, "total_tokens": tokens}},
+                   self._rate_limit_headers(deployment))
+
+    def _search(self, index_name, body):
+        from odata_filter import ODataFilterError
+        try:
+            results = self.state.search_index(index_name).search(body)
+        except ODataFilterError as error:
+            return self._json(400, {"error": {"code": "InvalidRequestParameter", "message": f"Invalid expression: {error}"}})
+        time.sleep(self.state.sample_latency("search"))
+        response = {"value": results}
+        if body.get("count"):
+            response["@odata.count"] = len(results)
+        self._json(200, response)
+
+    def _index_documents(self, index_name, body):
+        results = self.state.search_index(index_name).index(body.get("value", []))
+        time.sleep(self.state.sample_latency("search"))
+        self._json(200 if all(result["status"] for result in results) else 207, {"value": results})
+
+    def _count_documents(self, index_name, body):
+        self._send(200, str(len(self.state.search_index(index_name).documents)).encode(), {"Content-Type": "text/plain"})
+
+    def _get_index(self, index_name, body):
+        index = self.state.indexes.get(index_name)
+        if index is None or index.definition is None:
+            return self._json(404, {"error": {"code": "", "message": f"No index with the name '{index_name}' was found in the service."}})
+        self._json(200, index.definition)
+
+    def _put_index(self, index_name, body):
+        index_name = index_name or body.get("name")
+        index = self.state.search_index(index_name)
+        index.definition = body
+        index.key_field = next((field["name"] for field in body.get("fields", []) if field.get("key")), index.key_field)
+        self._json(201, body)
+
+    def _delete_index(self, index_name, body):
+        with self.state._lock:
+            self.state.indexes.pop(index_name, None)
+        self._send(204, b"")
+
+    def _get_stats(self, name, body):
+        self._json(200, dict(self.state.stats))
+
+
+class MockServer:
+    def __init__(self, host="127.0.0.1", port=0, certfile=None, keyfile=None, **options):
+        self.state = MockState(**options)
+        handler = type("BoundMockHandler", (MockHandler,), {"state": self.state})
+        self.httpd = ThreadingHTTPServer((host, port), handler)
+        self.httpd.daemon_threads = True
+        self.scheme = "http"
+        if certfile:
+            import ssl
+            context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+            context.load_cert_chain(certfile, keyfile)
+            self.httpd.socket = context.wrap_socket(self.httpd.socket, server_side=True)
+            self.scheme = "https"
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.httpd.server_address[:2]
+        return f"{self.scheme}://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.httpd.serve_forever, name="mock-server", daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.httpd.shutdown()
+        self.httpd.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Offline Azure OpenAI + Azure Cognitive Search stand-in")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--chat-latency", default="lognormal:400:0.5", help="time to the response / first chunk")
+    parser.add_argument("--chunk-latency", default="fixed:15", help="time between streamed chunks")
+    parser.add_argument("--embedding-latency", default="lognormal:60:0.4")
+    parser.add_argument("--search-latency", default="lognormal:80:0.4")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="fraction of requests answered with 429")
+    parser.add_argument("--rpm", type=int, default=None, help="requests per minute per deployment")
+    parser.add_argument("--tpm", type=int, default=None, help="tokens per minute per deployment")
+    parser.add_argument("--dimensions", type=int, default=1536)
+    parser.add_argument("--function-rounds", type=int, default=1, help="function calls before the model answers")
+    parser.add_argument("--mode", choices=["synthetic", "record", "replay"], default="synthetic")
+    parser.add_argument("--fixtures", default=None, help="JSONL file of recorded sessions")
+    parser.add_argument("--upstream", default=None, help="real endpoint to forward to in record mode")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--certfile", default=None)
+    parser.add_argument("--keyfile", default=None)
+    args = parser.parse_args()
+
+    server = MockServer(args.host, args.port, args.certfile, args.keyfile,
+                        chat_latency=args.chat_latency, chunk_latency=args.chunk_latency,
+                        embedding_latency=args.embedding_latency, search_latency=args.search_latency,
+                        error_rate=args.error_rate, rpm=args.rpm, tpm=args.tpm, dimensions=args.dimensions,
+                        function_rounds=args.function_rounds, fixtures=args.fixtures, mode=args.mode,
+                        upstream=args.upstream, seed=args.seed)
+    print(f"Mock server listening on {server.url} ({args.mode})")
+    try:
+        server.httpd.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.httpd.server_close()
+
+
+if __name__ == "__main__":
+    main()
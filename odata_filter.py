@@ -0,0 +1,298 @@
+import re
+import bisect
+import numpy as np
+from functools import lru_cache
+
+# parser and evaluator for the subset of OData $filter used by query_recipes:
+#   ingredients/any(i: i eq 'salt' or i eq 'pepper')
+#   total_time lt 25
+#   recipe_category eq 'Italian' and not (total_time ge 60)
+# filters are parsed once into a small tree and evaluated against precomputed structures:
+# a posting bitmap per ingredient / category value and a sorted total_time array searched with bisect.
+# bitmaps are plain Python ints (bit n set = recipe at row n matches), so and/or/not are single int operations
+
+collection_fields = {"ingredients"}
+string_fields = {"recipe_id", "recipe_category"}
+numeric_fields = {"total_time"}
+
+comparison_operators = {"eq", "ne", "lt", "le", "gt", "ge"}
+
+
+class ODataFilterError(ValueError):
+    def __init__(self, message, filter_text=None, position=None):
+        self.message = message
+        self.filter_text = filter_text
+        self.position = position
+        if position is not None:
+            message = f"{message} at position {position}"
+        super().__init__(message)
+
+
+_token_pattern = re.compile(r"""
+    (?P<space>\s+)
+  | (?P<string>'(?:[^']|'')*')
+  | (?P<number>-?\d+(?:\.\d+)?)
+  | (?P<name>[A-Za-z_][A-Za-z0-9_]*(?:/[A-Za-z_][A-Za-z0-9_]*)*)
+  | (?P<punct>[():,])
+""", re.VERBOSE)
+
+
+def _tokenize(text):
+    tokens = []
+    position = 0
+    while position < len(text):
+        match = _token_pattern.match(text, position)
+        if match is None:
+            raise ODataFilterError(f"Unexpected character {text[position]!r}", text, position)
+        kind = match.lastgroup
+        value = match.group()
+        if kind == "string":
+            tokens.append(("string", value[1:-1].replace("''", "'"), position))
+        elif kind == "number":
+            tokens.append(("number", float(value) if "." in value else int(value), position))
+        elif kind != "space":
+            tokens.append((kind, value, position))
+        position = match.end()
+    tokens.append(("end", None, len(text)))
+    return tokens
+
+
+# recursive descent parser producing tuples:
+#   ("or", left, right) ("and", left, right) ("not", operand)
+#   ("cmp", field, operator, value) ("any", field, variable, body)
+class _Parser:
+    def __init__(self, text):
+        self.text = text
+        self.tokens = _tokenize(text)
+        self.index = 0
+        self.variable = None
+
+    def peek(self):
+        return self.tokens[self.index]
+
+    def advance(self):
+        token = self.tokens[self.index]
+        self.index += 1
+        return token
+
+    def error(self, message, token=None):
+        token = token or self.peek()
+        return ODataFilterError(message, self.text, token[2])
+
+    def expect(self, kind, value=None):
+        token = self.advance()
+        if token[0] != kind or (value is not None and token[1] != value):
+            expected = value if value is not None else kind
+            raise self.error(f"Expected {expected!r} but found {token[1]!r}", token)
+        return token
+
+    def keyword(self, word):
+        token = self.peek()
+        return token[0] == "name" and token[1].lower() == word
+
+    def parse(self):
+        if self.peek()[0] == "end":
+            raise self.error("Empty filter")
+        node = self.parse_or()
+        if self.peek()[0] != "end":
+            raise self.error(f"Unexpected {self.peek()[1]!r}")
+        return node
+
+    def parse_or(self):
+        node = self.parse_and()
+        while self.keyword("or"):
+            self.advance()
+            node = ("or", node, self.parse_and())
+        return node
+
+    def parse_and(self):
+        node = self.parse_not()
+        while self.keyword("and"):
+            self.advance()
+            node = ("and", node, self.parse_not())
+        return node
+
+    def parse_not(self):
+        if self.keyword("not"):
+            self.advance()
+            return ("not", self.parse_not())
+        return self.parse_primary()
+
+    def parse_primary(self):
+        token = self.peek()
+        if token[0] == "punct" and token[1] == "(":
+            self.advance()
+            node = self.parse_or()
+            self.expect("punct", ")")
+            return node
+        if token[0] != "name":
+            raise self.error(f"Expected a field name but found {token[1]!r}")
+        self.advance()
+
+        name = token[1]
+        if "/" in name:
+            return self.parse_lambda(name, token)
+        return self.parse_comparison(name, token)
+
+    def parse_lambda(self, name, token):
+        field, _, operator = name.partition("/")
+        if operator.lower() != "any":
+            raise self.error(f"Unsupported collection operator {operator!r}, only 'any' is supported", token)
+        if field not in collection_fields:
+            raise self.error(f"Field {field!r} is not a collection", token)
+        if self.variable is not None:
+            raise self.error("Nested lambda expressions are not supported", token)
+        self.expect("punct", "(")
+        variable = self.expect("name")[1]
+        self.expect("punct", ":")
+        self.variable = variable
+        body = self.parse_or()
+        self.variable = None
+        self.expect("punct", ")")
+        return ("any", field, variable, body)
+
+    def parse_comparison(self, name, token):
+        operator_token = self.advance()
+        operator = operator_token[1].lower() if operator_token[0] == "name" else None
+        if operator not in comparison_operators:
+            raise self.error(f"Expected a comparison operator after {name!r}", operator_token)
+        value_token = self.advance()
+        if value_token[0] not in ("string", "number"):
+            raise self.error(f"Expected a literal value but found {value_token[1]!r}", value_token)
+        value = value_token[1]
+
+        if self.variable is not None:
+            if name != self.variable:
+                raise self.error(f"Unknown range variable {name!r}, expected {self.variable!r}", token)
+            if operator not in ("eq", "ne") or value_token[0] != "string":
+                raise self.error("Only 'eq' and 'ne' with a string are supported inside any()", operator_token)
+        elif name in numeric_fields:
+            if value_token[0] != "number":
+                raise self.error(f"Field {name!r} must be compared with a number", value_token)
+        elif name in string_fields:
+            if operator not in ("eq", "ne") or value_token[0] != "string":
+                raise self.error(f"Field {name!r} only supports 'eq' and 'ne' with a string", operator_token)
+        elif name in collection_fields:
+            raise self.error(f"Collection field {name!r} must be filtered with {name}/any(...)", token)
+        else:
+            raise self.error(f"Unknown or non-filterable field {name!r}", token)
+        return ("cmp", name, operator, value)
+
+
+@lru_cache(maxsize=1024)
+def parse_filter(text):
+    return _Parser(text).parse()
+
+
+# join the separate filters produced by the model into one expression
+def combine_filters(*filters):
+    filters = [f for f in filters if f]
+    if not filters:
+        return ""
+    if len(filters) == 1:
+        return filters[0]
+    return " and ".join(f"({f})" for f in filters)
+
+
+def _matches_value(body, value):
+    kind = body[0]
+    if kind == "or":
+        return _matches_value(body[1], value) or _matches_value(body[2], value)
+    if kind == "and":
+        return _matches_value(body[1], value) and _matches_value(body[2], value)
+    if kind == "not":
+        return not _matches_value(body[1], value)
+    _, _, operator, literal = body
+    return (value == literal) if operator == "eq" else (value != literal)
+
+
+def _equality_values(body):
+    # values matched by a lambda body made only of "eq" joined with "or", or None for anything else
+    if body[0] == "or":
+        left, right = _equality_values(body[1]), _equality_values(body[2])
+        return None if left is None or right is None else left + right
+    if body[0] == "cmp" and body[2] == "eq":
+        return [body[3]]
+    return None
+
+
+class FilterIndex:
+    def __init__(self, recipes):
+        self.size = len(recipes)
+        self.all_bits = (1 << self.size) - 1
+        self.postings = {field: {} for field in collection_fields | string_fields}
+        for position, recipe in enumerate(recipes):
+            bit = 1 << position
+            for field in collection_fields:
+                for value in set(recipe.get(field) or []):
+                    self.postings[field][value] = self.postings[field].get(value, 0) | bit
+            for field in string_fields:
+                value = recipe.get(field)
+                if value is not None:
+                    self.postings[field][value] = self.postings[field].get(value, 0) | bit
+
+        # numeric fields: values sorted once, with the row position of each value alongside
+        self.sorted_values = {}
+        for field in numeric_fields:
+            values = np.asarray([recipe.get(field) for recipe in recipes], dtype=np.float64)
+            order = np.argsort(values, kind="stable")
+            self.sorted_values[field] = (values[order].tolist(), order)
+
+    def _positions_to_bits(self, positions):
+        if len(positions) == 0:
+            return 0
+        mask = np.zeros(self.size, dtype=bool)
+        mask[positions] = True
+        return int.from_bytes(np.packbits(mask, bitorder="little").tobytes(), "little")
+
+    def _range(self, field, operator, value):
+        values, order = self.sorted_values[field]
+        if operator == "lt":
+            selected = order[:bisect.bisect_left(values, value)]
+        elif operator == "le":
+            selected = order[:bisect.bisect_right(values, value)]
+        elif operator == "gt":
+            selected = order[bisect.bisect_right(values, value):]
+        elif operator == "ge":
+            selected = order[bisect.bisect_left(values, value):]
+        else:
+            start, end = bisect.bisect_left(values, value), bisect.bisect_right(values, value)
+            selected = order[start:end]
+            if operator == "ne":
+                return self.all_bits & ~self._positions_to_bits(selected)
+        return self._positions_to_bits(selected)
+
+    def evaluate(self, node):
+        kind = node[0]
+        if kind == "or":
+            return self.evaluate(node[1]) | self.evaluate(node[2])
+        if kind == "and":
+            return self.evaluate(node[1]) & self.evaluate(node[2])
+        if kind == "not":
+            return self.all_bits & ~self.evaluate(node[1])
+        if kind == "any":
+            _, field, _, body = node
+            postings = self.postings[field]
+            values = _equality_values(body)
+            if values is None:
+                # general lambda body: test it against every distinct value of the field once
+                values = [value for value in postings if _matches_value(body, value)]
+            bits = 0
+            for value in values:
+                bits |= postings.get(value, 0)
+            return bits
+        _, field, operator, value = node
+        if field in numeric_fields:
+            return self._range(field, operator, value)
+        bits = self.postings[field].get(value, 0)
+        return bits if operator == "eq" else self.all_bits & ~bits
+
+    # row positions matching the filter text, or None when there is no filter
+    def candidates(self, filter_text):
+        if not filter_text:
+            return None
+        bits = self.evaluate(parse_filter(filter_text))
+        if bits == 0:
+            return np.empty(0, dtype=np.int64)
+        raw = np.frombuffer(bits.to_bytes((self.size + 7) // 8, "little"), dtype=np.uint8)
+        return np.flatnonzero(np.unpackbits(raw, bitorder="little")[:self.size])
@@ -0,0 +1,102 @@
+import json
+import time
+import contextvars
+from concurrent.futures import ThreadPoolExecutor, TimeoutError
+from tracing import tracer
+
+# helpers for the parallel tool-call format (tools / tool_calls), where one assistant message can ask for
+# several function calls at once. the calls run concurrently on a shared thread pool, each with its own
+# timeout, and every result is appended before the next completion is requested
+
+_executor = ThreadPoolExecutor(max_workers=16, thread_name_prefix="tool")
+
+
+# wrap the functions schema list in the tools format
+def as_tools(functions):
+    return [{"type": "function", "function": function} for function in functions]
+
+
+def assistant_tool_calls_message(response_message):
+    return {
+        "role": response_message["role"],
+        "tool_calls": [
+            {
+                "id": tool_call["id"],
+                "type": "function",
+                "function": {
+                    "name": tool_call["function"]["name"],
+                    "arguments": tool_call["function"]["arguments"],
+                },
+            }
+            for tool_call in response_message["tool_calls"]
+        ],
+        "content": None,
+    }
+
+
+# run every tool call of one assistant message concurrently and return the "tool" messages in call order
+# problems (unknown function, bad JSON, invalid arguments, timeout, exception) are returned to the model
+# as the tool result so it can correct itself in the next round. validate(function, args) works as in
+# streaming.stream_conversation: a string replaces the tool result
+def execute_tool_calls(tool_calls, available_functions, timeout=30, validate=None):
+    futures = []
+    for tool_call in tool_calls:
+        function_name = tool_call["function"]["name"]
+        function_to_call = available_functions.get(function_name)
+        if function_to_call is None:
+            futures.append("Function " + function_name + " does not exist")
+            continue
+        try:
+            function_args = json.loads(tool_call["function"]["arguments"])
+        except ValueError:
+            futures.append("Invalid JSON arguments for function: " + function_name)
+            continue
+        if validate is not None:
+            result = validate(function_to_call, function_args)
+            if isinstance(result, str):
+                futures.append(result)
+                continue
+        # each call gets a tool span, in a copy of the caller's context so it joins the conversation's trace
+        futures.append(_executor.submit(contextvars.copy_context().run,
+                                        tracer.traced(function_name, kind="tool")(function_to_call), **function_args))
+
+    deadline = time.monotonic() + timeout
+    tool_messages = []
+    for tool_call, future in zip(tool_calls, futures):
+        if isinstance(future, str):
+            content = future
+        else:
+            try:
+                content = future.result(timeout=max(deadline - time.monotonic(), 0))
+            except TimeoutError:
+                # the thread cannot be interrupted; its result is simply not waited for
+                content = f"Function {tool_call['function']['name']} timed out after {timeout} seconds"
+            except Exception as error:
+                content = f"Function {tool_call['function']['name']} failed: {error}"
+        tool_messages.append({"role": "tool", "tool_call_id": tool_call["id"], "content": str(content)})
+    return tool_messages
+
+
+class ToolCallTrace:
+    def __init__(self):
+        self.model_calls = 0
+        self.tool_rounds = []
+        self.started = time.perf_counter()
+
+    def record_model_call(self):
+        self.model_calls += 1
+
+    def record_round(self, tool_calls, seconds):
+        self.tool_rounds.append({"tool_calls": tool_calls, "seconds": seconds})
+
+    def summary(self):
+        tool_calls = sum(round_["tool_calls"] for round_ in self.tool_rounds)
+        # answering one call per round trip would need one extra model call for every additional tool call
+        return {
+            "model_calls": self.model_calls,
+            "tool_calls": tool_calls,
+            "tool_rounds": len(self.tool_rounds),
+            "round_trips_saved": tool_calls - len(self.tool_rounds),
+            "tool_seconds": sum(round_["seconds"] for round_ in self.tool_rounds),
+            "total_seconds": time.perf_counter() - self.started,
+        }
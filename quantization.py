@@ -0,0 +1,175 @@
+import numpy as np
+from vector_ops import normalize_rows, top_k
+
+# compact storage for the recipe embeddings used by the local search backend
+#   float32 - 4 bytes per dimension, exact
+#   float16 - 2 bytes per dimension, scores are practically unchanged
+#   int8    - 1 byte per dimension plus one float32 scale per vector
+#   pq      - product quantization, one byte per sub-vector (e.g. 96 bytes for 1536 dims with m=96);
+#             the best candidates are re-scored at full precision from a separate rerank source
+# every store scores (m, d) query matrices and can be restricted to a subset of rows. float16 and int8 codes are
+# converted to float32 block_rows rows at a time, so a query never holds a float32 copy of the whole store
+
+
+class Float32Store:
+    kind = "float32"
+    block_rows = 4096
+
+    def __init__(self, vectors):
+        self.codes = np.ascontiguousarray(vectors, dtype=np.float32)
+
+    def __len__(self):
+        return len(self.codes)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes
+
+    # per-vector cost, excluding fixed overhead such as PQ codebooks
+    @property
+    def bytes_per_vector(self):
+        return self.codes[0].nbytes if len(self.codes) else 0
+
+    def decode(self, rows=None):
+        return self.codes if rows is None else self.codes[rows]
+
+    def scores(self, queries, rows=None):
+        return queries @ self.decode(rows).T
+
+    # score_block(block) scores the rows selected by block, a slice or an index array into the codes
+    def _scores_in_blocks(self, queries, rows, score_block):
+        queries = np.asarray(queries)
+        rows = None if rows is None else np.asarray(rows)
+        count = len(self.codes) if rows is None else len(rows)
+        scores = np.empty(queries.shape[:-1] + (count,), dtype=np.result_type(queries.dtype, np.float32))
+        for start in range(0, count, self.block_rows):
+            block = slice(start, start + self.block_rows)
+            scores[..., block] = score_block(block if rows is None else rows[block])
+        return scores
+
+    def search(self, queries, k, rows=None):
+        scores = self.scores(queries, rows)
+        order = top_k(scores, k)
+        positions = order if rows is None else np.asarray(rows)[order]
+        return positions, np.take_along_axis(scores, order, axis=-1)
+
+
+class Float16Store(Float32Store):
+    kind = "float16"
+
+    def __init__(self, vectors):
+        self.codes = np.ascontiguousarray(vectors, dtype=np.float16)
+
+    def decode(self, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        return codes.astype(np.float32)
+
+    def scores(self, queries, rows=None):
+        return self._scores_in_blocks(queries, rows, lambda block: queries @ self.codes[block].astype(np.float32).T)
+
+
+class Int8Store(Float32Store):
+    kind = "int8"
+
+    def __init__(self, vectors):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        # symmetric scalar quantization with one scale per vector
+        self.scales = np.abs(vectors).max(axis=1) / 127.0
+        self.scales[self.scales == 0] = 1.0
+        self.codes = np.round(vectors / self.scales[:, None]).astype(np.int8)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.scales.nbytes
+
+    @property
+    def bytes_per_vector(self):
+        return self.codes[0].nbytes + self.scales.itemsize if len(self.codes) else 0
+
+    def decode(self, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        scales = self.scales if rows is None else self.scales[rows]
+        return codes.astype(np.float32) * scales[:, None]
+
+    def scores(self, queries, rows=None):
+        # the scale is per vector, so it applies to the dot product with the codes
+        return self._scores_in_blocks(queries, rows, lambda block: (
+            queries @ self.codes[block].astype(np.float32).T) * self.scales[block])
+
+
+def _kmeans_l2(vectors, n_clusters, iterations, rng):
+    n_clusters = min(n_clusters, len(vectors))
+    centroids = vectors[rng.choice(len(vectors), n_clusters, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (vectors ** 2).sum(1)[:, None] - 2 * vectors @ centroids.T + (centroids ** 2).sum(1)[None, :]
+        assignments = np.argmin(distances, axis=1)
+        counts = np.bincount(assignments, minlength=n_clusters)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+    return centroids
+
+
+class PQStore(Float32Store):
+    kind = "pq"
+
+    # m: number of sub-vectors (must divide the dimension), ks: centroids per sub-space (at most 256)
+    # rerank_source: float32/float16 array or memmap of the full vectors, rerank: candidates re-scored per query
+    def __init__(self, vectors, m=96, ks=256, iterations=15, rerank_source=None, rerank=50, seed=0):
+        vectors = np.asarray(vectors, dtype=np.float32)
+        dim = vectors.shape[1]
+        if dim % m:
+            raise ValueError(f"PQStore needs m to divide the dimension, got m={m} for {dim} dimensions")
+        self.m = m
+        self.sub_dim = dim // m
+        self.rerank_source = rerank_source
+        self.rerank = rerank
+        rng = np.random.default_rng(seed)
+        subspaces = vectors.reshape(len(vectors), m, self.sub_dim)
+        self.codebooks = np.stack([_kmeans_l2(subspaces[:, i], ks, iterations, rng) for i in range(m)])
+        self.codes = np.empty((len(vectors), m), dtype=np.uint8)
+        for i in range(m):
+            distances = (-2 * subspaces[:, i] @ self.codebooks[i].T
+                         + (self.codebooks[i] ** 2).sum(1)[None, :])
+            self.codes[:, i] = np.argmin(distances, axis=1)
+
+    @property
+    def nbytes(self):
+        return self.codes.nbytes + self.codebooks.nbytes
+
+    def decode(self, rows=None):
+        codes = self.codes if rows is None else self.codes[rows]
+        return self.codebooks[np.arange(self.m), codes].reshape(len(codes), -1)
+
+    def scores(self, queries, rows=None):
+        # asymmetric distance computation: one (m, ks) lookup table per query, then m table reads per vector
+        codes = self.codes if rows is None else self.codes[rows]
+        queries = np.atleast_2d(queries).reshape(len(queries), self.m, self.sub_dim)
+        tables = np.einsum("qmd,mkd->qmk", queries, self.codebooks)
+        return np.stack([table[np.arange(self.m), codes].sum(axis=1) for table in tables])
+
+    def search(self, queries, k, rows=None):
+        if self.rerank_source is None:
+            return super().search(queries, k, rows)
+        scores = self.scores(queries, rows)
+        shortlist = top_k(scores, max(k, self.rerank))
+        candidates = shortlist if rows is None else np.asarray(rows)[shortlist]
+        positions, best_scores = [], []
+        for query, query_candidates in zip(queries, candidates):
+            # sorted reads keep access to a memory-mapped rerank source sequential
+            query_candidates = np.sort(query_candidates)
+            exact = np.asarray(self.rerank_source[query_candidates], dtype=np.float32) @ query
+            order = top_k(exact, k)
+            positions.append(query_candidates[order])
+            best_scores.append(exact[order])
+        return np.stack(positions), np.stack(best_scores)
+
+
+vector_stores = {"float32": Float32Store, "float16": Float16Store, "int8": Int8Store, "pq": PQStore}
+
+
+def build_vector_store(kind, vectors, **kwargs):
+    if kind not in vector_stores:
+        raise ValueError(f"Unknown vector storage {kind!r}, choose from {', '.join(vector_stores)}")
+    return vector_stores[kind](normalize_rows(vectors), **kwargs)
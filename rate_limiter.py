@@ -0,0 +1,340 @@
+import re
+import json
+import time
+import heapq
+import asyncio
+import itertools
+import threading
+from collections import deque
+from context_window import TokenCounter
+
+# client-side requests-per-minute / tokens-per-minute scheduler for the Azure OpenAI deployments
+#   with rate_limiter.acquire(deployment, estimate_chat_tokens(messages, functions)) as ticket:
+#       response = openai.ChatCompletion.create(deployment_id=deployment, ...)
+#       ticket.settle(response)
+# router.create(..., estimated_tokens=...) does this for every request it sends
+# each deployment has a request bucket and a token bucket that refill continuously at rpm/60 and tpm/60 per
+# second. a request waits until both hold enough for it, and waiting requests are served by priority, so an
+# interactive conversation overtakes queued bulk indexing. the token cost is estimated before sending (prompt
+# plus the completion budget) and the difference to the usage the service reports is handed back on settle().
+# instrument_session() adapts to the service through the shared requests.Session of clients.py:
+#   - x-ratelimit-remaining-requests / -tokens lower the buckets to what the service says is left
+#   - a 429 holds every request to that deployment until its Retry-After has passed, instead of each
+#     worker backing off on its own and retrying at the same moment, and cuts the refill rate by
+#     rate_decrease; successful responses raise it again by rate_increase up to the configured limit
+#   - a deployment without configured limits gets its limit from the request rate at its first 429
+# acquire_async() is the asyncio counterpart for the async runner; its requests do not go through the session,
+# so the caller reports their 429s with observe()
+# deployments are keyed by the deployment name, which is also the engine name of the embedding calls. with
+# several endpoints the router takes a ticket per attempt under "endpoint/deployment", so a 429 from one
+# endpoint does not hold back the others; instrument_session(session, key_for=router.limit_key) records the
+# responses under the same keys
+
+INTERACTIVE = 0
+BULK = 10
+
+# completion tokens counted for a chat request that sets no max_tokens
+default_completion_tokens = 256
+
+deployment_pattern = re.compile(r"/openai/deployments/([^/?]+)/")
+
+counter = TokenCounter()
+
+
+def estimate_chat_tokens(messages, functions=None, max_tokens=None):
+    tokens = sum(4 + counter.count(message.get("content") or "")
+                 + counter.count(json.dumps(message["function_call"]) if message.get("function_call") else "")
+                 + counter.count(json.dumps(message["tool_calls"]) if message.get("tool_calls") else "")
+                 for message in messages)
+    if functions:
+        tokens += counter.count(json.dumps(functions))
+    return tokens + 3 + (max_tokens or default_completion_tokens)
+
+
+def estimate_embedding_tokens(texts):
+    if isinstance(texts, str):
+        texts = [texts]
+    return sum(counter.count(text) for text in texts)
+
+
+# seconds from the retry-after-ms or Retry-After header of a 429, None when neither is usable
+def parse_retry_after(headers):
+    if headers.get("retry-after-ms"):
+        return float(headers["retry-after-ms"]) / 1000
+    if headers.get("Retry-After", "").replace(".", "", 1).isdigit():
+        return float(headers["Retry-After"])
+    return None
+
+
+class RateLimitTimeout(Exception):
+    pass
+
+
+class TokenBucket:
+    def __init__(self, per_minute, burst_seconds=60):
+        self.limit = per_minute
+        self.rate = per_minute / 60
+        self.capacity = max(self.rate * burst_seconds, 1)
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def refill(self, now):
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+
+    # seconds until amount is available
+    def wait_time(self, amount, now):
+        self.refill(now)
+        # a request larger than the bucket could never start; let it through once the bucket is full
+        amount = min(amount, self.capacity)
+        return 0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        self.level -= amount
+
+    def give_back(self, amount):
+        self.level = min(self.capacity, self.level + amount)
+
+    def lower_to(self, remaining, now):
+        self.refill(now)
+        self.level = min(self.level, remaining)
+
+    def scale_rate(self, factor, floor=0.05):
+        self.rate = min(max(self.rate * factor, self.limit / 60 * floor), self.limit / 60)
+
+
+class DeploymentLimit:
+    def __init__(self, name, rpm=None, tpm=None, burst_seconds=60):
+        self.name = name
+        self.burst_seconds = burst_seconds
+        self.requests = TokenBucket(rpm, burst_seconds) if rpm else None
+        self.tokens = TokenBucket(tpm, burst_seconds) if tpm else None
+        self.blocked_until = 0.0
+        self.waiting = []
+        self.sent = deque()
+        self.stats = {"requests": 0, "tokens": 0, "waits": 0, "wait_seconds": 0.0, "throttled": 0,
+                      "refunded_tokens": 0}
+
+    def wait_time(self, tokens, now):
+        wait = self.blocked_until - now
+        if self.requests is not None:
+            wait = max(wait, self.requests.wait_time(1, now))
+        if self.tokens is not None:
+            wait = max(wait, self.tokens.wait_time(tokens, now))
+        return wait
+
+    def take(self, tokens, now):
+        if self.requests is not None:
+            self.requests.take(1)
+        if self.tokens is not None:
+            self.tokens.take(min(tokens, self.tokens.capacity))
+        self.sent.append(now)
+        while self.sent and self.sent[0] <= now - 60:
+            self.sent.popleft()
+        self.stats["requests"] += 1
+        self.stats["tokens"] += tokens
+
+
+class Ticket:
+    def __init__(self, limiter, deployment, tokens):
+        self.limiter = limiter
+        self.deployment = deployment
+        self.tokens = tokens
+
+    # hand back the part of the estimate the response did not use
+    def settle(self, response):
+        # a stream reports no usage, so its estimate stays charged
+        usage = response.get("usage") if isinstance(response, dict) else None
+        if usage and "total_tokens" in usage:
+            self.limiter.refund(self.deployment, self.tokens - usage["total_tokens"])
+        return response
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+
+class RateLimiter:
+    # burst_seconds: how much of the per-minute budget may be sent at once; Azure OpenAI evaluates RPM over
+    # 10 second windows
+    # rate_decrease: refill rate multiplier on a 429, rate_increase: multiplier on each successful response
+    def __init__(self, burst_seconds=10, rate_decrease=0.7, rate_increase=1.02):
+        self.burst_seconds = burst_seconds
+        self.rate_decrease = rate_decrease
+        self.rate_increase = rate_increase
+        self._limits = {}
+        self._configured = {}
+        self._sequence = itertools.count()
+        self._condition = threading.Condition()
+
+    # the limits also apply to the deployment on each endpoint of the router ("endpoint/deployment"), every one
+    # of which has its own quota
+    def configure(self, deployment, rpm=None, tpm=None):
+        with self._condition:
+            self._configured[deployment] = (rpm, tpm)
+            for name in [name for name in self._limits if name.rpartition("/")[2] == deployment]:
+                self._limits[name] = DeploymentLimit(name, rpm, tpm, self.burst_seconds)
+            self._limits[deployment] = DeploymentLimit(deployment, rpm, tpm, self.burst_seconds)
+            self._condition.notify_all()
+        return self
+
+    # RATE_LIMITS in config.json: {"gpt-35-turbo": {"rpm": 300, "tpm": 50000}, "text-embedding-ada-002": {...}}
+    def configure_from(self, config):
+        for deployment, limits in (config.get("RATE_LIMITS") or {}).items():
+            self.configure(deployment, limits.get("rpm"), limits.get("tpm"))
+        return self
+
+    def _limit(self, deployment):
+        limit = self._limits.get(deployment)
+        if limit is None:
+            rpm, tpm = self._configured.get(deployment.rpartition("/")[2], (None, None))
+            limit = self._limits[deployment] = DeploymentLimit(deployment, rpm, tpm, self.burst_seconds)
+        return limit
+
+    # block until the deployment can take a request costing tokens; raises RateLimitTimeout after timeout seconds
+    def acquire(self, deployment, tokens=0, priority=INTERACTIVE, timeout=None):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            limit = self._limit(deployment)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(limit.waiting, entry)
+            started = time.monotonic()
+            waited = False
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = None
+                    if limit.waiting[0] == entry:
+                        wait = limit.wait_time(tokens, now)
+                        if wait <= 0:
+                            limit.take(tokens, now)
+                            break
+                    if deadline is not None:
+                        if now >= deadline:
+                            raise RateLimitTimeout(f"No capacity on deployment {deployment} within {timeout}s")
+                        wait = deadline - now if wait is None else min(wait, deadline - now)
+                    waited = True
+                    self._condition.wait(wait)
+            finally:
+                limit.waiting.remove(entry)
+                heapq.heapify(limit.waiting)
+                if waited:
+                    limit.stats["waits"] += 1
+                    limit.stats["wait_seconds"] += time.monotonic() - started
+                # the next request in line may be able to go now
+                self._condition.notify_all()
+        return Ticket(self, deployment, tokens)
+
+    # acquire() for coroutines: waits without blocking the event loop. the condition cannot wake a coroutine,
+    # so the request first in line sleeps until its capacity is due and the ones behind it check every
+    # poll_interval seconds; both notice a 429 reported meanwhile the next time they look
+    async def acquire_async(self, deployment, tokens=0, priority=INTERACTIVE, timeout=None, poll_interval=0.05):
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            limit = self._limit(deployment)
+            entry = (priority, next(self._sequence))
+            heapq.heappush(limit.waiting, entry)
+        started = time.monotonic()
+        waited = False
+        try:
+            while True:
+                with self._condition:
+                    now = time.monotonic()
+                    wait = poll_interval
+                    if limit.waiting[0] == entry:
+                        wait = limit.wait_time(tokens, now)
+                        if wait <= 0:
+                            limit.take(tokens, now)
+                            break
+                if deadline is not None:
+                    if now >= deadline:
+                        raise RateLimitTimeout(f"No capacity on deployment {deployment} within {timeout}s")
+                    wait = min(wait, deadline - now)
+                waited = True
+                await asyncio.sleep(wait)
+        finally:
+            with self._condition:
+                limit.waiting.remove(entry)
+                heapq.heapify(limit.waiting)
+                if waited:
+                    limit.stats["waits"] += 1
+                    limit.stats["wait_seconds"] += time.monotonic() - started
+                self._condition.notify_all()
+        return Ticket(self, deployment, tokens)
+
+    # seconds a 429 still holds the deployment back
+    def blocked_for(self, deployment):
+        with self._condition:
+            limit = self._limits.get(deployment)
+            return max(limit.blocked_until - time.monotonic(), 0.0) if limit is not None else 0.0
+
+    def refund(self, deployment, tokens):
+        with self._condition:
+            limit = self._limit(deployment)
+            if tokens > 0 and limit.tokens is not None:
+                limit.tokens.give_back(tokens)
+                limit.stats["refunded_tokens"] += tokens
+                self._condition.notify_all()
+
+    # rate-limit headers of a response from deployment; retry_after in seconds for a 429
+    def observe(self, deployment, status, headers, retry_after=None):
+        with self._condition:
+            limit = self._limit(deployment)
+            now = time.monotonic()
+            if status == 429:
+                limit.stats["throttled"] += 1
+                # requests already in flight when the first 429 arrived belong to the same episode;
+                # only the first one slows the deployment down
+                if now >= limit.blocked_until:
+                    if limit.requests is None and limit.tokens is None:
+                        # nothing configured: the rate sent over the last minute is more than the deployment
+                        # allows. a minute that has not passed yet since the first request is scaled up to a
+                        # full one, so a 429 early in a run does not set a fraction of the real rate
+                        elapsed = min(max(now - limit.sent[0], 1.0), 60.0) if limit.sent else 60.0
+                        limit.requests = TokenBucket(max(len(limit.sent) * 60 / elapsed, 1), self.burst_seconds)
+                    for bucket in (limit.requests, limit.tokens):
+                        if bucket is not None:
+                            bucket.scale_rate(self.rate_decrease)
+                            bucket.level = 0
+                limit.blocked_until = max(limit.blocked_until, now + (retry_after or 1.0))
+            elif status < 400:
+                for bucket in (limit.requests, limit.tokens):
+                    if bucket is not None:
+                        bucket.scale_rate(self.rate_increase)
+            remaining_requests = headers.get("x-ratelimit-remaining-requests")
+            remaining_tokens = headers.get("x-ratelimit-remaining-tokens")
+            if remaining_requests is not None and limit.requests is not None:
+                limit.requests.lower_to(float(remaining_requests), now)
+            if remaining_tokens is not None and limit.tokens is not None:
+                limit.tokens.lower_to(float(remaining_tokens), now)
+            self._condition.notify_all()
+
+    # read the rate-limit headers of every Azure OpenAI response sent through session
+    # key_for(url, deployment) gives the name the response is recorded under, for the deployment name found in
+    # the URL; router.limit_key maps an endpoint's own deployment name back to the one the code acquires with
+    def instrument_session(self, session, key_for=None):
+        def record(response, *args, **kwargs):
+            match = deployment_pattern.search(response.url)
+            if match is not None:
+                key = key_for(response.url, match.group(1)) if key_for is not None else match.group(1)
+                retry_after = parse_retry_after(response.headers) if response.status_code == 429 else None
+                self.observe(key, response.status_code, response.headers, retry_after)
+            return response
+
+        session.hooks["response"].append(record)
+        return session
+
+    def stats(self):
+        with self._condition:
+            stats = {}
+            for name, limit in self._limits.items():
+                stats[name] = dict(limit.stats, queued=len(limit.waiting),
+                                   rpm=limit.requests.rate * 60 if limit.requests else None,
+                                   tpm=limit.tokens.rate * 60 if limit.tokens else None)
+            return stats
+
+
+# the process-wide limiter; without configured limits it only honours the service's 429s and headers
+rate_limiter = RateLimiter()
@@ -0,0 +1,423 @@
+import json
+import time
+import random
+import threading
+import contextvars
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+import openai
+from tracing import current_span, quantile
+from rate_limiter import rate_limiter, parse_retry_after, INTERACTIVE
+
+# spreads chat and embedding requests over a pool of Azure OpenAI endpoints (regions / resources)
+#   router.configure([{"name": "eastus", "api_base": "https://....openai.azure.com/", "api_key": "..."},
+#                     {"name": "swedencentral", "api_base": ..., "deployments": {"gpt-35-turbo": "gpt-35-turbo-0613"}}])
+#   response = router.create(openai.ChatCompletion, "gpt-35-turbo", messages=messages, ...)
+# code keeps using one deployment name; "deployments" maps it to the name on an endpoint where they differ,
+# and an endpoint listing deployments only serves those.
+# each request goes to the endpoint with the fewest requests in flight ("least_outstanding"), or to a random
+# endpoint weighted by the inverse of its recent latency and load ("latency"). an endpoint that fails
+# failure_threshold times in a row is taken out of rotation (circuit open) for cooldown seconds, then gets a
+# single trial request (half open) that closes the circuit again if it succeeds. a 429 rests the endpoint for
+# its Retry-After. failed requests move on to the next endpoint, up to max_attempts endpoints.
+# with hedge_after set, a request still unanswered after that many seconds ("p95": the endpoint's own p95) is
+# sent to a second endpoint too and the first answer wins; this trims the tail latency for the price of the
+# duplicated requests, so it is off by default.
+# acreate() does the same for coroutines (openai's acreate), without hedging.
+# with a limiter (the process-wide rate_limiter for the module's router) every attempt takes its ticket for the
+# endpoint it goes to, so a failover waits for the budget of the endpoint it moves to and a 429 only holds back
+# the endpoint that sent it; create(..., estimated_tokens=estimate_chat_tokens(messages)) sets the ticket's cost.
+# with no endpoints configured create() calls openai directly with the global openai settings
+
+# errors that are the request's fault, not the endpoint's: the same request fails everywhere
+caller_errors = (openai.error.InvalidRequestError,)
+
+
+def _is_endpoint_failure(error):
+    if isinstance(error, caller_errors):
+        # a missing deployment (404) is the endpoint's problem, a bad request (400) is not
+        return getattr(error, "http_status", None) == 404
+    return isinstance(error, (openai.error.OpenAIError, OSError))
+
+
+def _retry_after(error, default=1.0):
+    headers = getattr(error, "headers", None) or {}
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        return float(headers.get("Retry-After", default))
+    except (TypeError, ValueError):
+        return default
+
+
+class Endpoint:
+    def __init__(self, name, api_base, api_key, api_version=None, api_type="azure", deployments=None, weight=1.0,
+                 window=512):
+        self.name = name
+        self.api_base = api_base
+        self.api_key = api_key
+        self.api_version = api_version
+        self.api_type = api_type
+        self.deployments = deployments
+        self.weight = weight
+        self.outstanding = 0
+        self.latency = None  # exponentially weighted moving average, seconds
+        self.latencies = deque(maxlen=window)
+        self.consecutive_failures = 0
+        self.state = "closed"
+        self.open_until = 0.0
+        self.trial_in_flight = False
+        self.rest_until = 0.0
+        self.stats = {"requests": 0, "errors": 0, "throttled": 0, "failovers": 0, "hedges": 0, "hedge_wins": 0,
+                      "circuit_opened": 0}
+
+    def serves(self, deployment):
+        return self.deployments is None or deployment in self.deployments
+
+    def deployment(self, deployment):
+        return self.deployments.get(deployment, deployment) if self.deployments else deployment
+
+    def request_options(self):
+        return {"api_base": self.api_base, "api_key": self.api_key, "api_version": self.api_version,
+                "api_type": self.api_type}
+
+    def percentile(self, q):
+        return quantile(self.latencies, q / 100) if self.latencies else None
+
+
+class NoEndpointAvailable(Exception):
+    pass
+
+
+class Router:
+    def __init__(self, endpoints=(), strategy="least_outstanding", failure_threshold=5, cooldown=30,
+                 hedge_after=None, max_attempts=3, session=None, limiter=None):
+        if strategy not in ("least_outstanding", "latency"):
+            raise ValueError(f"Unknown strategy {strategy!r}, use 'least_outstanding' or 'latency'")
+        self.endpoints = list(endpoints)
+        self.strategy = strategy
+        self.failure_threshold = failure_threshold
+        self.cooldown = cooldown
+        self.hedge_after = hedge_after
+        self.max_attempts = max_attempts
+        self.session = session
+        self.limiter = limiter
+        self._lock = threading.Lock()
+        self._executor = None
+        self._health_thread = None
+        self._stop = threading.Event()
+
+    # entries: dicts with name, api_base, api_key and optionally api_version, api_type, deployments and weight;
+    # api_version and api_key default to the global openai settings
+    def configure(self, entries, **options):
+        for option, value in options.items():
+            setattr(self, option, value)
+        self.endpoints = [Endpoint(entry.get("name", entry["api_base"]), entry["api_base"],
+                                   entry.get("api_key", openai.api_key), entry.get("api_version", openai.api_version),
+                                   entry.get("api_type", openai.api_type or "azure"), entry.get("deployments"),
+                                   entry.get("weight", 1.0))
+                       for entry in entries]
+        return self
+
+    # OPENAI_ENDPOINTS, ROUTING_STRATEGY, HEDGE_AFTER in config.json, or the same variables in os.environ,
+    # where OPENAI_ENDPOINTS holds the list as JSON
+    def configure_from(self, config, session=None):
+        entries = config.get("OPENAI_ENDPOINTS")
+        if isinstance(entries, str):
+            entries = json.loads(entries)
+        if entries:
+            hedge_after = config.get("HEDGE_AFTER", self.hedge_after)
+            if isinstance(hedge_after, str) and hedge_after != "p95":
+                hedge_after = float(hedge_after)
+            self.configure(entries, strategy=config.get("ROUTING_STRATEGY", self.strategy), hedge_after=hedge_after,
+                           session=session or self.session)
+        return self
+
+    # the rate limiter key of a response from url, which names deployment on its endpoint: the endpoint and the
+    # deployment name code uses, the same key the router takes that request's ticket under
+    def limit_key(self, url, deployment):
+        for endpoint in self.endpoints:
+            if url.startswith(endpoint.api_base.rstrip("/")):
+                for name, endpoint_name in (endpoint.deployments or {}).items():
+                    if endpoint_name == deployment:
+                        return self._limit_name(endpoint, name)
+                return self._limit_name(endpoint, deployment)
+        return deployment
+
+    def _available(self, endpoint, deployment, now):
+        if endpoint.rest_until > now:
+            return False
+        # a 429 the limiter saw on the shared session rests the endpoint like one the router saw itself
+        if self.limiter is not None and self.limiter.blocked_for(self._limit_name(endpoint, deployment)) > 0:
+            return False
+        if endpoint.state == "open":
+            if now < endpoint.open_until:
+                return False
+            endpoint.state = "half_open"
+        return not (endpoint.state == "half_open" and endpoint.trial_in_flight)
+
+    def _choose(self, deployment, exclude):
+        with self._lock:
+            now = time.monotonic()
+            serving = [endpoint for endpoint in self.endpoints if endpoint.serves(deployment) and endpoint not in exclude]
+            candidates = [endpoint for endpoint in serving if self._available(endpoint, deployment, now)]
+            if not candidates:
+                if exclude or not serving:
+                    return None
+                # everything is resting or open: use the one that comes back first rather than fail outright
+                candidates = [min(serving, key=lambda endpoint: max(endpoint.rest_until, endpoint.open_until))]
+            if self.strategy == "least_outstanding":
+                random.shuffle(candidates)
+                endpoint = min(candidates, key=lambda endpoint: (endpoint.outstanding / endpoint.weight,
+                                                                 endpoint.latency or 0.0))
+            else:
+                known = [endpoint.latency for endpoint in candidates if endpoint.latency is not None]
+                # endpoints without measurements yet get the best known latency, so they are tried early
+                default = min(known) if known else 1.0
+                weights = [endpoint.weight / ((endpoint.latency or default) * (1 + endpoint.outstanding))
+                           for endpoint in candidates]
+                endpoint = random.choices(candidates, weights)[0]
+            if endpoint.state == "half_open":
+                endpoint.trial_in_flight = True
+            endpoint.outstanding += 1
+            endpoint.stats["requests"] += 1
+            return endpoint
+
+    def _record(self, endpoint, elapsed=None, error=None):
+        with self._lock:
+            endpoint.outstanding -= 1
+            endpoint.trial_in_flight = False
+            now = time.monotonic()
+            if error is None:
+                endpoint.latencies.append(elapsed)
+                endpoint.latency = elapsed if endpoint.latency is None else 0.8 * endpoint.latency + 0.2 * elapsed
+                endpoint.consecutive_failures = 0
+                endpoint.state = "closed"
+            elif isinstance(error, openai.error.RateLimitError):
+                endpoint.stats["throttled"] += 1
+                endpoint.rest_until = max(endpoint.rest_until, now + _retry_after(error))
+            elif _is_endpoint_failure(error):
+                endpoint.stats["errors"] += 1
+                endpoint.consecutive_failures += 1
+                if endpoint.state == "half_open" or endpoint.consecutive_failures >= self.failure_threshold:
+                    if endpoint.state != "open":
+                        endpoint.stats["circuit_opened"] += 1
+                    endpoint.state = "open"
+                    endpoint.open_until = now + self.cooldown
+
+    # the rate limiter key of deployment on endpoint: every endpoint has its own quota, so a 429 from one of
+    # them only holds back the requests to that one; without endpoints it is the deployment name
+    @staticmethod
+    def _limit_name(endpoint, deployment):
+        return deployment if endpoint is None else f"{endpoint.name}/{deployment}"
+
+    # limit: (deployment, estimated tokens, priority) to take a rate limiter ticket for before sending
+    def _ticket(self, endpoint, limit):
+        if self.limiter is None or limit is None:
+            return None
+        deployment, tokens, priority = limit
+        return self.limiter.acquire(self._limit_name(endpoint, deployment), tokens, priority)
+
+    def _attempt(self, endpoint, function, limit=None):
+        span = current_span.get()
+        if span is not None:
+            span.set(endpoint=endpoint.name)
+        ticket = self._ticket(endpoint, limit)
+        started = time.perf_counter()
+        try:
+            result = function(endpoint)
+        except Exception as error:
+            self._record(endpoint, error=error)
+            raise
+        self._record(endpoint, time.perf_counter() - started)
+        return ticket.settle(result) if ticket is not None else result
+
+    def _hedge_delay(self, endpoint):
+        if self.hedge_after == "p95":
+            return endpoint.percentile(95) if len(endpoint.latencies) >= 20 else None
+        return self.hedge_after
+
+    def _submit(self, endpoint, function, limit):
+        if self._executor is None:
+            with self._lock:
+                if self._executor is None:
+                    self._executor = ThreadPoolExecutor(max_workers=32, thread_name_prefix="router")
+        # the worker sees the caller's context variables, e.g. the open tracing span
+        return self._executor.submit(contextvars.copy_context().run, self._attempt, endpoint, function, limit)
+
+    def _hedged(self, deployment, endpoint, function, delay, tried, limit):
+        primary = self._submit(endpoint, function, limit)
+        done, _ = wait([primary], timeout=delay)
+        if done:
+            return primary.result()
+        second = self._choose(deployment, tried)
+        if second is None:
+            return primary.result()
+        tried.add(second)
+        with self._lock:
+            endpoint.stats["hedges"] += 1
+        futures = {primary: endpoint, self._submit(second, function, limit): second}
+        error = None
+        while futures:
+            done, _ = wait(list(futures), return_when=FIRST_COMPLETED)
+            for future in done:
+                winner = futures.pop(future)
+                if future.exception() is None:
+                    if winner is second:
+                        with self._lock:
+                            second.stats["hedge_wins"] += 1
+                    # the slower request cannot be cancelled mid-flight; its outcome is still recorded
+                    return future.result()
+                error = future.exception()
+        raise error
+
+    @staticmethod
+    def _fails_over(error):
+        return _is_endpoint_failure(error) or isinstance(error, openai.error.RateLimitError)
+
+    # function(endpoint) sends the request to endpoint; failed attempts move on to the next endpoint.
+    # with a limiter, every attempt first takes a ticket for estimated_tokens on the endpoint it goes to
+    def call(self, deployment, function, estimated_tokens=0, priority=INTERACTIVE):
+        limit = (deployment, estimated_tokens, priority)
+        tried = set()
+        error = None
+        for _ in range(max(self.max_attempts, 1)):
+            endpoint = self._choose(deployment, tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint)
+            delay = self._hedge_delay(endpoint)
+            try:
+                if delay is None:
+                    return self._attempt(endpoint, function, limit)
+                return self._hedged(deployment, endpoint, function, delay, tried, limit)
+            except Exception as attempt_error:
+                if not self._fails_over(attempt_error):
+                    raise
+                error = attempt_error
+                with self._lock:
+                    endpoint.stats["failovers"] += 1
+        if error is not None:
+            raise error
+        raise NoEndpointAvailable(f"No endpoint serves deployment {deployment}")
+
+    # resource: openai.ChatCompletion, openai.Embedding, ...; deployment: the name used in code
+    # estimated_tokens, priority: what the request takes from the rate limiter, see rate_limiter.estimate_*
+    def create(self, resource, deployment, estimated_tokens=0, priority=INTERACTIVE, **kwargs):
+        if not self.endpoints:
+            ticket = self._ticket(None, (deployment, estimated_tokens, priority))
+            response = resource.create(deployment_id=deployment, **kwargs)
+            return ticket.settle(response) if ticket is not None else response
+        return self.call(deployment, lambda endpoint: resource.create(
+            deployment_id=endpoint.deployment(deployment), **endpoint.request_options(), **kwargs),
+            estimated_tokens, priority)
+
+    # aiohttp requests are not seen by an instrumented session, so their outcome is reported to the limiter
+    # here: a 429 holds the endpoint's deployment back for its Retry-After, a success lets the rate rise again
+    async def _send_async(self, endpoint, deployment, estimated_tokens, priority, send):
+        if self.limiter is None:
+            return await send()
+        name = self._limit_name(endpoint, deployment)
+        ticket = await self.limiter.acquire_async(name, estimated_tokens, priority)
+        try:
+            response = await send()
+        except openai.error.RateLimitError as error:
+            headers = error.headers or {}
+            self.limiter.observe(name, 429, headers, parse_retry_after(headers))
+            raise
+        self.limiter.observe(name, 200, {})
+        return ticket.settle(response)
+
+    # create() for coroutines: the same endpoint choice, circuit breaker, failover and rate limiting; requests
+    # are not hedged
+    async def acreate(self, resource, deployment, estimated_tokens=0, priority=INTERACTIVE, **kwargs):
+        if not self.endpoints:
+            return await self._send_async(None, deployment, estimated_tokens, priority,
+                                          lambda: resource.acreate(deployment_id=deployment, **kwargs))
+        tried = set()
+        error = None
+        for _ in range(max(self.max_attempts, 1)):
+            endpoint = self._choose(deployment, tried)
+            if endpoint is None:
+                break
+            tried.add(endpoint)
+            span = current_span.get()
+            if span is not None:
+                span.set(endpoint=endpoint.name)
+            started = None
+            try:
+                async def send():
+                    nonlocal started
+                    started = time.perf_counter()
+                    return await resource.acreate(deployment_id=endpoint.deployment(deployment),
+                                                  **endpoint.request_options(), **kwargs)
+
+                result = await self._send_async(endpoint, deployment, estimated_tokens, priority, send)
+            except Exception as attempt_error:
+                self._record(endpoint, error=attempt_error)
+                if not self._fails_over(attempt_error):
+                    raise
+                error = attempt_error
+                with self._lock:
+                    endpoint.stats["failovers"] += 1
+                continue
+            self._record(endpoint, time.perf_counter() - started)
+            return result
+        if error is not None:
+            raise error
+        raise NoEndpointAvailable(f"No endpoint serves deployment {deployment}")
+
+    # any HTTP answer means the endpoint is reachable; connection errors and 5xx count as failures
+    def check_health(self, timeout=5):
+        import requests
+        get = self.session.get if self.session is not None else requests.get
+        results = {}
+        for endpoint in self.endpoints:
+            try:
+                response = get(endpoint.api_base, timeout=timeout)
+                response.close()
+                healthy = response.status_code < 500
+            except requests.RequestException:
+                healthy = False
+            with self._lock:
+                if healthy and endpoint.state == "open":
+                    # let the next request try it instead of waiting out the cooldown
+                    endpoint.open_until = 0.0
+                elif not healthy:
+                    endpoint.stats["errors"] += 1
+                    if endpoint.state != "open":
+                        endpoint.stats["circuit_opened"] += 1
+                    endpoint.state = "open"
+                    endpoint.open_until = time.monotonic() + self.cooldown
+            results[endpoint.name] = healthy
+        return results
+
+    def start_health_checks(self, interval=30):
+        def loop():
+            while not self._stop.wait(interval):
+                self.check_health()
+
+        self._health_thread = threading.Thread(target=loop, name="router-health", daemon=True)
+        self._health_thread.start()
+        return self
+
+    # per endpoint: share of the requests, latency, errors, circuit state
+    def stats(self):
+        with self._lock:
+            total = sum(endpoint.stats["requests"] for endpoint in self.endpoints) or 1
+            return {endpoint.name: dict(endpoint.stats, share=endpoint.stats["requests"] / total,
+                                        state=endpoint.state, outstanding=endpoint.outstanding,
+                                        latency_ms=endpoint.latency * 1000 if endpoint.latency is not None else None,
+                                        p50_ms=endpoint.percentile(50) * 1000 if endpoint.latencies else None,
+                                        p95_ms=endpoint.percentile(95) * 1000 if endpoint.latencies else None)
+                    for endpoint in self.endpoints}
+
+    def close(self):
+        self._stop.set()
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+
+
+# the process-wide router; it sends everything to the global openai settings until configured, and takes the
+# tickets of the process-wide rate limiter
+router = Router(limiter=rate_limiter)
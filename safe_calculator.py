@@ -0,0 +1,170 @@
+import ast
+import math
+import json
+import operator
+import numpy as np
+
+# arithmetic for the calculator tool without eval(): expressions are parsed with ast and only numbers,
+# + - * / ** (binary and unary) and sqrt(...) are allowed. batches of (num1, num2, operator) triples are
+# computed with NumPy, one vectorised operation per operator, so many steps cost one tool call
+
+binary_operators = {
+    ast.Add: operator.add,
+    ast.Sub: operator.sub,
+    ast.Mult: operator.mul,
+    ast.Div: operator.truediv,
+    ast.Pow: lambda base, exponent: _power(base, exponent),
+}
+unary_operators = {ast.USub: operator.neg, ast.UAdd: operator.pos}
+
+# guards against expressions such as 9 ** 9 ** 9 that would take forever with Python integers
+max_exponent = 1000
+max_result_digits = 4000
+max_expression_length = 1000
+
+
+class CalculatorError(ValueError):
+    pass
+
+
+def _power(base, exponent):
+    if abs(exponent) > max_exponent:
+        raise CalculatorError(f"exponent larger than {max_exponent}")
+    if isinstance(base, int) and isinstance(exponent, int) and abs(base) > 1 \
+            and exponent * math.log10(abs(base)) > max_result_digits:
+        raise CalculatorError("result too large")
+    result = base ** exponent
+    # a negative base to a fractional exponent gives a complex number in Python
+    if isinstance(result, complex):
+        raise CalculatorError("result is not a real number")
+    return result
+
+
+# float arithmetic gives inf (1e308 * 10) or nan (inf - inf) instead of raising OverflowError
+def _finite(value):
+    if isinstance(value, float) and not math.isfinite(value):
+        raise CalculatorError("result is not a finite number")
+    return value
+
+
+def _evaluate(node):
+    if isinstance(node, ast.Expression):
+        return _evaluate(node.body)
+    if isinstance(node, ast.Constant) and type(node.value) in (int, float):
+        return _finite(node.value)
+    if isinstance(node, ast.BinOp) and type(node.op) in binary_operators:
+        left, right = _evaluate(node.left), _evaluate(node.right)
+        try:
+            return _finite(binary_operators[type(node.op)](left, right))
+        except ZeroDivisionError:
+            raise CalculatorError("division by zero")
+        except OverflowError:
+            raise CalculatorError("result too large")
+    if isinstance(node, ast.UnaryOp) and type(node.op) in unary_operators:
+        return unary_operators[type(node.op)](_evaluate(node.operand))
+    if (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == "sqrt"
+            and len(node.args) == 1 and not node.keywords):
+        value = _evaluate(node.args[0])
+        if isinstance(value, complex):
+            raise CalculatorError("result is not a real number")
+        if value < 0:
+            raise CalculatorError("square root of a negative number")
+        return math.sqrt(value)
+    if isinstance(node, ast.Name):
+        raise CalculatorError(f"unsupported name: {node.id}")
+    raise CalculatorError(f"unsupported syntax: {type(node).__name__}")
+
+
+def evaluate_expression(expression):
+    if len(expression) > max_expression_length:
+        raise CalculatorError("expression too long")
+    try:
+        tree = ast.parse(expression.replace("^", "**"), mode="eval")
+    except SyntaxError:
+        raise CalculatorError("invalid expression")
+    return _evaluate(tree)
+
+
+def _exact(num1, num2, operator_symbol):
+    if operator_symbol == "sqrt":
+        if num1 < 0:
+            raise CalculatorError("square root of a negative number")
+        return math.sqrt(num1)
+    if operator_symbol == "**":
+        return _power(num1, num2)
+    if operator_symbol == "/" and num2 == 0:
+        raise CalculatorError("division by zero")
+    return {"+": operator.add, "-": operator.sub, "*": operator.mul, "/": operator.truediv}[operator_symbol](num1, num2)
+
+
+# operations: list of {"num1": ..., "num2": ..., "operator": ...}; returns one result string per operation
+def calculate_batch(operations):
+    results = [None] * len(operations)
+    float_groups = {}
+    for position, operation in enumerate(operations):
+        operator_symbol = operation.get("operator")
+        num1, num2 = operation.get("num1"), operation.get("num2")
+        if num2 is None and operator_symbol == "sqrt":
+            num2 = 0
+        if operator_symbol not in ("+", "-", "*", "/", "**", "sqrt"):
+            results[position] = "Invalid operator"
+        elif not isinstance(num1, (int, float)) or not isinstance(num2, (int, float)):
+            results[position] = "Error: num1 and num2 must be numbers"
+        elif isinstance(num1, int) and isinstance(num2, int) and operator_symbol != "sqrt":
+            # integer operands keep Python's exact integer arithmetic, like the scalar calculator
+            try:
+                results[position] = str(_finite(_exact(num1, num2, operator_symbol)))
+            except CalculatorError as error:
+                results[position] = f"Error: {error}"
+            except OverflowError:
+                # true division of integers too large for a float
+                results[position] = "Error: result too large"
+        else:
+            float_groups.setdefault(operator_symbol, []).append((position, num1, num2))
+
+    with np.errstate(all="ignore"):
+        for operator_symbol, group in float_groups.items():
+            positions = [item[0] for item in group]
+            left = np.asarray([item[1] for item in group], dtype=np.float64)
+            right = np.asarray([item[2] for item in group], dtype=np.float64)
+            if operator_symbol == "+":
+                values = left + right
+            elif operator_symbol == "-":
+                values = left - right
+            elif operator_symbol == "*":
+                values = left * right
+            elif operator_symbol == "/":
+                values = left / right
+            elif operator_symbol == "**":
+                values = np.power(left, right)
+            else:
+                values = np.sqrt(left)
+            for position, value, num1, num2 in zip(positions, values.tolist(), left, right):
+                if operator_symbol == "/" and num2 == 0:
+                    results[position] = "Error: division by zero"
+                elif operator_symbol == "sqrt" and num1 < 0:
+                    results[position] = "Error: square root of a negative number"
+                elif operator_symbol == "**" and num1 < 0 and not float(num2).is_integer():
+                    results[position] = "Error: result is not a real number"
+                elif math.isinf(value) or math.isnan(value):
+                    results[position] = "Error: result is not a finite number"
+                else:
+                    results[position] = str(value)
+    return results
+
+
+def calculate(expression=None, operations=None):
+    response = {}
+    if expression is not None:
+        try:
+            response["expression"] = str(evaluate_expression(expression))
+        except ValueError as error:
+            # CalculatorError, or an integer too long to convert to a string
+            response["expression"] = f"Error: {error}"
+    if operations is not None:
+        response["operations"] = calculate_batch(operations)
+    if operations is None:
+        return response["expression"]
+    if expression is None:
+        return json.dumps(response["operations"])
+    return json.dumps(response)
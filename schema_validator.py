@@ -0,0 +1,146 @@
+import json
+import inspect
+
+# argument validation for function calls, compiled from the `functions` schema list
+# every function's "parameters" schema is turned once into nested closures that check types, enums and
+# required properties, and each Python function's signature is inspected once and cached, so checking
+# a call is a few dict lookups. errors are collected as {"argument", "error"} dicts and returned to the
+# model as the function result, so it can fix the call in its next message instead of failing in the tool
+
+json_types = {
+    "string": lambda value: isinstance(value, str),
+    "number": lambda value: isinstance(value, (int, float)) and not isinstance(value, bool),
+    "integer": lambda value: isinstance(value, int) and not isinstance(value, bool),
+    "boolean": lambda value: isinstance(value, bool),
+    "array": lambda value: isinstance(value, list),
+    "object": lambda value: isinstance(value, dict),
+    "null": lambda value: value is None,
+}
+
+
+def json_type_name(value):
+    for name in ("boolean", "integer", "number", "string", "array", "object", "null"):
+        if json_types[name](value):
+            return name
+    return type(value).__name__
+
+
+def _join(path, name):
+    return f"{path}.{name}" if path else name
+
+
+# compile a JSON schema into check(value, path, errors), which appends one dict per problem to errors
+def compile_schema(schema):
+    checks = []
+
+    types = schema.get("type")
+    if types is not None:
+        types = [types] if isinstance(types, str) else list(types)
+        type_checks = [json_types[name] for name in types if name in json_types]
+        expected = " or ".join(types)
+
+        def check_type(value, path, errors):
+            if not any(type_check(value) for type_check in type_checks):
+                errors.append({"argument": path, "error": f"expected {expected}, got {json_type_name(value)}"})
+                return False
+            return True
+        checks.append(check_type)
+
+    if "enum" in schema:
+        allowed = list(schema["enum"])
+
+        def check_enum(value, path, errors):
+            if value in allowed:
+                return True
+            errors.append({"argument": path, "error": f"must be one of {json.dumps(allowed)}, got {json.dumps(value)}"})
+            return False
+        checks.append(check_enum)
+
+    properties = {name: compile_schema(property_schema)
+                  for name, property_schema in schema.get("properties", {}).items()}
+    required = list(schema.get("required", []))
+    if properties or required:
+        def check_object(value, path, errors):
+            if not isinstance(value, dict):
+                return True  # reported by the type check
+            for name in required:
+                if name not in value:
+                    errors.append({"argument": _join(path, name), "error": "missing required argument"})
+            for name, property_value in value.items():
+                check = properties.get(name)
+                if check is not None:
+                    check(property_value, _join(path, name), errors)
+            return True
+        checks.append(check_object)
+
+    if "items" in schema:
+        check_item = compile_schema(schema["items"])
+
+        def check_array(value, path, errors):
+            if isinstance(value, list):
+                for position, item in enumerate(value):
+                    check_item(item, f"{path}[{position}]", errors)
+            return True
+        checks.append(check_array)
+
+    def check(value, path, errors):
+        for check_step in checks:
+            # skip enum and nested checks once the type is already wrong
+            if check_step(value, path, errors) is False:
+                return
+
+    return check
+
+
+def format_errors(function_name, errors):
+    return json.dumps({"error": "Invalid arguments for function: " + function_name, "details": errors})
+
+
+class ArgumentValidator:
+    def __init__(self, functions, available_functions):
+        self.schemas = {function["name"]: compile_schema(function.get("parameters", {"type": "object"}))
+                        for function in functions}
+        self.names = {function: name for name, function in available_functions.items()}
+        self._signatures = {}
+
+    def signature(self, function):
+        parameters = self._signatures.get(function)
+        if parameters is None:
+            # inspect.signature follows __wrapped__, so memoized tools report their real parameters
+            params = inspect.signature(function).parameters.values()
+            parameters = self._signatures[function] = (
+                {param.name for param in params},
+                [param.name for param in params if param.default is param.empty
+                 and param.kind not in (param.VAR_POSITIONAL, param.VAR_KEYWORD)],
+                any(param.kind == param.VAR_KEYWORD for param in params),
+                {param.name for param in params if param.default is None},
+            )
+        return parameters
+
+    # list of {"argument", "error"} dicts, empty when the call is valid
+    def errors(self, function_name, function, args):
+        if not isinstance(args, dict):
+            return [{"argument": "", "error": f"expected an object of arguments, got {json_type_name(args)}"}]
+        errors = []
+        names, required, accepts_any, none_defaults = self.signature(function)
+        check = self.schemas.get(function_name)
+        if check is not None:
+            # the model sends null for an optional argument it leaves unset; a function whose default for it is
+            # None handles that, whatever type the schema gives it (Optional[str] is described as "string")
+            check({name: value for name, value in args.items() if value is not None or name not in none_defaults},
+                  "", errors)
+        reported = {error["argument"] for error in errors}
+        for name in args:
+            if name not in names and not accepts_any:
+                errors.append({"argument": name, "error": "unexpected argument"})
+        for name in required:
+            if name not in args and name not in reported:
+                errors.append({"argument": name, "error": "missing required argument"})
+        return errors
+
+    # validate(function, args) hook for the conversation loops: None when valid, otherwise the error
+    # message to send back to the model instead of the function result
+    def check(self, function, args):
+        function_name = self.names.get(function, getattr(function, "__name__", "function"))
+        errors = self.errors(function_name, function, args)
+        return format_errors(function_name, errors) if errors else None
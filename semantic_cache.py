@@ -0,0 +1,207 @@
+import os
+import re
+import time
+import json
+import hashlib
+import threading
+import numpy as np
+from vector_ops import normalize_rows
+
+# semantic cache in front of the conversation runner
+# the last user turn is normalised and embedded; if a cached turn is close enough (cosine similarity above
+# the threshold) under the same conversation context, its final answer and tool trace are returned
+# without calling the model, the tools or the search index again.
+# entries expire after ttl_seconds, the least recently used entry is evicted past max_entries,
+# and entries can be invalidated per function, e.g. query_recipes after the recipe index is re-synced
+
+
+def normalize_turn(text):
+    text = re.sub(r"\s+", " ", text.lower()).strip()
+    return text.strip(" ?!.")
+
+
+# exact-match namespace for everything before the last user turn (system prompt, earlier turns)
+def context_key(messages):
+    return hashlib.sha256(json.dumps(messages[:-1], sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+
+class SemanticCache:
+    # embed(text) -> vector, e.g. functools.partial(generate_embeddings, cache=embedding_cache)
+    def __init__(self, embed, threshold=0.95, ttl_seconds=3600, max_entries=1000):
+        self.embed = embed
+        self.threshold = threshold
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.entries = []
+        self._vectors = None
+        self._watched = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.latency_saved = 0.0
+
+    def _remove(self, positions):
+        positions = set(positions)
+        if not positions:
+            return
+        keep = [i for i in range(len(self.entries)) if i not in positions]
+        self.entries = [self.entries[i] for i in keep]
+        self._vectors = self._vectors[keep] if keep else None
+
+    def _expire(self, now):
+        self._remove(i for i, entry in enumerate(self.entries) if now - entry["created"] > self.ttl_seconds)
+
+    def _check_watched_files(self):
+        for path, (function_names, mtime) in list(self._watched.items()):
+            current = os.path.getmtime(path) if os.path.exists(path) else None
+            if current != mtime:
+                self._watched[path] = (function_names, current)
+                for function_name in function_names:
+                    self._invalidate(function_name)
+
+    # drop entries whose answer used the given function whenever the file changes,
+    # e.g. watch_file("index_manifest.json", "query_recipes") after the loader re-syncs the index
+    def watch_file(self, path, *function_names):
+        with self._lock:
+            self._watched[path] = (function_names, os.path.getmtime(path) if os.path.exists(path) else None)
+
+    def lookup(self, messages):
+        started = time.perf_counter()
+        vector = normalize_rows(self.embed(normalize_turn(messages[-1]["content"])))
+        namespace = context_key(messages)
+        with self._lock:
+            now = time.time()
+            self._check_watched_files()
+            self._expire(now)
+            if self._vectors is not None:
+                scores = self._vectors @ vector
+                for position in np.argsort(-scores):
+                    if scores[position] < self.threshold:
+                        break
+                    entry = self.entries[position]
+                    if entry["context"] != namespace:
+                        continue
+                    entry["last_used"] = now
+                    self.hits += 1
+                    self.latency_saved += max(entry["latency"] - (time.perf_counter() - started), 0.0)
+                    return entry, vector
+            self.misses += 1
+            return None, vector
+
+    def store(self, messages, vector, answer, tool_trace, latency):
+        now = time.time()
+        entry = {
+            "context": context_key(messages),
+            "turn": messages[-1]["content"],
+            "answer": answer,
+            "tool_trace": tool_trace,
+            "functions": {call["name"] for call in tool_trace},
+            "latency": latency,
+            "created": now,
+            "last_used": now,
+        }
+        with self._lock:
+            if len(self.entries) >= self.max_entries:
+                oldest = min(range(len(self.entries)), key=lambda i: self.entries[i]["last_used"])
+                self._remove([oldest])
+            self.entries.append(entry)
+            row = np.asarray(vector, dtype=np.float32)[None, :]
+            self._vectors = row if self._vectors is None else np.vstack([self._vectors, row])
+
+    def _invalidate(self, function_name):
+        self._remove(i for i, entry in enumerate(self.entries) if function_name in entry["functions"])
+
+    def invalidate_function(self, function_name):
+        with self._lock:
+            self._invalidate(function_name)
+
+    def clear(self):
+        with self._lock:
+            self.entries = []
+            self._vectors = None
+
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self.entries),
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "latency_saved_seconds": self.latency_saved,
+        }
+
+
+# function calls and results the runner appended to messages, in order
+def tool_trace_from_messages(messages):
+    trace = []
+    for message in messages:
+        if message.get("function_call"):
+            trace.append({"name": message["function_call"]["name"],
+                          "arguments": message["function_call"]["arguments"]})
+        elif message.get("role") == "function" and trace and "response" not in trace[-1]:
+            trace[-1]["response"] = message["content"]
+    return trace
+
+
+# wrap run_conversation / run_multiturn_conversation: (messages, functions, available_functions, deployment_id)
+# cache hits return a response shaped like a ChatCompletion with "cached" and "tool_trace" added
+def cached_conversation(cache, run_conversation):
+    def run(messages, functions, available_functions, deployment_id):
+        entry, vector = cache.lookup(messages)
+        if entry is not None:
+            return {
+                "choices": [{"finish_reason": "stop",
+                             "message": {"role": "assistant", "content": entry["answer"]}}],
+                "cached": True,
+                "tool_trace": entry["tool_trace"],
+            }
+
+        started = time.perf_counter()
+        original = list(messages)
+        first_new = len(messages)
+        response = run_conversation(messages, functions, available_functions, deployment_id)
+        if isinstance(response, str):
+            return response  # an error message from the runner, never cached
+        choice = response["choices"][0]
+        answer = choice["message"].get("content")
+        # a truncated ("length") or filtered ("content_filter") answer would be served for every similar turn
+        if answer and choice["finish_reason"] == "stop":
+            cache.store(original, vector, answer, tool_trace_from_messages(messages[first_new:]),
+                        time.perf_counter() - started)
+        return response
+
+    return run
+
+
+# the same for a streaming runner, a generator of content deltas like streaming.stream_conversation that returns
+# the finish reason of its last model call (None after an error): a hit yields the cached answer as one delta,
+# a miss passes the deltas through and caches the answer they add up to
+def cached_stream(cache, stream_conversation):
+    def run(messages, functions, available_functions, deployment_id):
+        entry, vector = cache.lookup(messages)
+        if entry is not None:
+            yield entry["answer"]
+            return "stop"
+
+        started = time.perf_counter()
+        original = list(messages)
+        first_new = len(messages)
+        stream = stream_conversation(messages, functions, available_functions, deployment_id)
+        deltas = []
+        while True:
+            try:
+                delta = next(stream)
+            except StopIteration as stop:
+                finish_reason = stop.value
+                break
+            deltas.append(delta)
+            yield delta
+        answer = "".join(deltas)
+        # only complete answers are cached: error messages of the runner end the stream with no finish reason,
+        # truncated and filtered answers with "length" and "content_filter"
+        if finish_reason == "stop" and answer:
+            cache.store(original, vector, answer, tool_trace_from_messages(messages[first_new:]),
+                        time.perf_counter() - started)
+        return finish_reason
+
+    return run
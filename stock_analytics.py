@@ -0,0 +1,115 @@
+import json
+import numpy as np
+
+# analytics over the columnar stock store, exposed to the model as tools
+# each question ("how much did S&P 500 change between July 12 and July 13?") is answered in one call,
+# computed with NumPy on the server side, instead of sending the raw history into the prompt and
+# chaining several calculator calls
+
+fields = ["Open", "High", "Low", "Close", "Volume"]
+
+invalid_index_message = "Invalid index. Please choose from 'S&P 500', 'NASDAQ Composite', 'Dow Jones Industrial Average', 'Financial Times Stock Exchange 100 Index'."
+invalid_date_message = "Invalid date. Please use the YYYY-MM-DD format."
+
+
+def _round(value):
+    return round(float(value), 4)
+
+
+class StockAnalytics:
+    def __init__(self, store):
+        self.store = store
+
+    def _series(self, index, start_date, end_date, field):
+        if index not in self.store.indices():
+            return None, invalid_index_message
+        if field not in fields:
+            return None, f"Invalid field. Please choose from {', '.join(fields)}."
+        try:
+            series = self.store.get(index, start_date, end_date)
+        except ValueError:
+            return None, invalid_date_message
+        if len(series) == 0:
+            return None, f"No {index} data between {start_date or 'the first date'} and {end_date or 'the last date'}."
+        return series, None
+
+    # absolute and percent change of a field between the first and last trading day in the range
+    def get_stock_change(self, index, start_date, end_date, field="Close"):
+        series, error = self._series(index, start_date, end_date, field)
+        if error:
+            return error
+        values = series.column(field)
+        start_value, end_value = values[0], values[-1]
+        return json.dumps({
+            "index": index,
+            "field": field,
+            "start_date": str(series.dates[0]),
+            "start_value": _round(start_value),
+            "end_date": str(series.dates[-1]),
+            "end_value": _round(end_value),
+            "absolute_change": _round(end_value - start_value),
+            "percent_change": _round((end_value - start_value) / start_value * 100) if start_value else None,
+        })
+
+    # day-over-day percent returns and the cumulative return over the range
+    def get_stock_returns(self, index, start_date=None, end_date=None, field="Close"):
+        series, error = self._series(index, start_date, end_date, field)
+        if error:
+            return error
+        values = series.column(field).astype(np.float64)
+        returns = np.diff(values) / values[:-1] * 100
+        return json.dumps({
+            "index": index,
+            "field": field,
+            "daily_returns_percent": {str(date): _round(value) for date, value in zip(series.dates[1:], returns)},
+            "cumulative_return_percent": _round((values[-1] / values[0] - 1) * 100) if values[0] else None,
+        })
+
+    # min, max (with their dates), mean and standard deviation of a field over the range
+    def get_stock_statistics(self, index, start_date=None, end_date=None, field="Close"):
+        series, error = self._series(index, start_date, end_date, field)
+        if error:
+            return error
+        values = series.column(field).astype(np.float64)
+        low, high = int(np.argmin(values)), int(np.argmax(values))
+        return json.dumps({
+            "index": index,
+            "field": field,
+            "days": len(values),
+            "min": _round(values[low]),
+            "min_date": str(series.dates[low]),
+            "max": _round(values[high]),
+            "max_date": str(series.dates[high]),
+            "mean": _round(values.mean()),
+            "std": _round(values.std()),
+        })
+
+    # change of several indices over the same range, best performer first
+    def compare_stock_indices(self, indices, start_date, end_date, field="Close"):
+        rows = []
+        for index in indices:
+            series, error = self._series(index, start_date, end_date, field)
+            if error:
+                return error
+            values = series.column(field)
+            rows.append((index, values[0], values[-1]))
+        start_values = np.asarray([row[1] for row in rows], dtype=np.float64)
+        end_values = np.asarray([row[2] for row in rows], dtype=np.float64)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            percent = (end_values - start_values) / start_values * 100
+        order = np.argsort(-np.nan_to_num(percent, nan=-np.inf))
+        return json.dumps({
+            "start_date": start_date,
+            "end_date": end_date,
+            "field": field,
+            "indices": [
+                {
+                    "index": rows[i][0],
+                    "start_value": _round(start_values[i]),
+                    "end_value": _round(end_values[i]),
+                    "absolute_change": _round(end_values[i] - start_values[i]),
+                    "percent_change": None if np.isnan(percent[i]) else _round(percent[i]),
+                }
+                for i in order
+            ],
+        })
@@ -0,0 +1,109 @@
+import os
+import csv
+import json
+import threading
+import numpy as np
+
+# stock_data.csv loaded once into a columnar store indexed by Index and Date
+# every index keeps its rows as NumPy columns sorted by date, so a lookup is a dict access and a date range
+# is two binary searches. the JSON that get_stock_market_data returns is built once per index and cached.
+# the file's modification time is checked on access and the store reloads itself when the CSV changes
+
+value_columns = ["Open", "High", "Low", "Close"]
+columns = ["Date"] + value_columns + ["Volume"]
+
+
+class StockSeries:
+    def __init__(self, rows, dates, values, volume):
+        self.rows = rows
+        self.dates = dates
+        self.values = values
+        self.volume = volume
+
+    def __len__(self):
+        return len(self.dates)
+
+    def column(self, name):
+        if name == "Date":
+            return self.dates
+        if name == "Volume":
+            return self.volume
+        return self.values[name]
+
+    # rows between start_date and end_date inclusive (ISO dates, either bound optional)
+    def between(self, start_date=None, end_date=None):
+        start = 0 if start_date is None else np.searchsorted(self.dates, np.datetime64(start_date, "D"), "left")
+        end = len(self.dates) if end_date is None else np.searchsorted(self.dates, np.datetime64(end_date, "D"), "right")
+        return StockSeries(self.rows[start:end], self.dates[start:end],
+                           {name: values[start:end] for name, values in self.values.items()}, self.volume[start:end])
+
+    # same layout as DataFrame.to_dict() on the original CSV rows: {column: {row number: value}}
+    def to_dict(self):
+        keys = [str(row) for row in self.rows.tolist()]
+        data = {"Date": dict(zip(keys, np.datetime_as_string(self.dates, unit="D").tolist()))}
+        for name in value_columns:
+            data[name] = dict(zip(keys, self.values[name].tolist()))
+        data["Volume"] = dict(zip(keys, self.volume.tolist()))
+        return data
+
+
+class StockDataStore:
+    def __init__(self, path="stock_data.csv"):
+        self.path = path
+        self._lock = threading.Lock()
+        self._mtime = None
+        self.series = {}
+        self._json = {}
+        self.reloads = 0
+        self._load()
+
+    def _load(self):
+        mtime = os.stat(self.path).st_mtime_ns
+        grouped = {}
+        with open(self.path, newline="") as csv_file:
+            for row_number, row in enumerate(csv.DictReader(csv_file)):
+                grouped.setdefault(row["Index"], []).append((row_number, row))
+
+        series = {}
+        for index, rows in grouped.items():
+            rows.sort(key=lambda item: item[1]["Date"])
+            series[index] = StockSeries(
+                rows=np.asarray([row_number for row_number, _ in rows], dtype=np.int64),
+                dates=np.asarray([row["Date"] for _, row in rows], dtype="datetime64[D]"),
+                values={name: np.asarray([float(row[name]) for _, row in rows]) for name in value_columns},
+                volume=np.asarray([int(float(row["Volume"])) for _, row in rows], dtype=np.int64),
+            )
+        self.series = series
+        self._json = {}
+        self._mtime = mtime
+        self.reloads += 1
+
+    def _refresh(self):
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            return  # keep serving the last good copy
+        if mtime != self._mtime:
+            with self._lock:
+                if mtime != self._mtime:
+                    self._load()
+
+    def indices(self):
+        self._refresh()
+        return list(self.series)
+
+    def get(self, index, start_date=None, end_date=None):
+        self._refresh()
+        series = self.series[index]
+        if start_date is None and end_date is None:
+            return series
+        return series.between(start_date, end_date)
+
+    def get_json(self, index, start_date=None, end_date=None):
+        self._refresh()
+        if start_date is not None or end_date is not None:
+            return json.dumps(self.get(index, start_date, end_date).to_dict())
+        cached = self._json.get(index)
+        if cached is None:
+            cached = self._json[index] = json.dumps(self.series[index].to_dict())
+        return cached
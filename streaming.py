@@ -0,0 +1,192 @@
+import json
+import time
+import contextvars
+import openai
+from concurrent.futures import ThreadPoolExecutor
+from tracing import tracer
+from rate_limiter import estimate_chat_tokens
+from router import router
+
+# streaming (stream=True) support for the conversation loops
+# content deltas are handed to the caller as soon as they arrive, function_call name/arguments fragments
+# are assembled incrementally, and the tool is started the moment the arguments JSON closes,
+# while the model is still finishing its response
+
+
+class FunctionCallAssembler:
+    def __init__(self):
+        self.name = ""
+        self.arguments = ""
+        self._depth = 0
+        self._in_string = False
+        self._escaped = False
+        self._started = False
+        self.complete = False
+
+    def feed(self, function_call_delta):
+        self.name += function_call_delta.get("name") or ""
+        fragment = function_call_delta.get("arguments") or ""
+        self.arguments += fragment
+        # track brace depth outside of strings so completion is known without re-parsing every fragment
+        for char in fragment:
+            if self._in_string:
+                if self._escaped:
+                    self._escaped = False
+                elif char == "\\":
+                    self._escaped = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+                self._started = True
+            elif char == "}":
+                self._depth -= 1
+                if self._started and self._depth == 0:
+                    self.complete = True
+
+    def parsed_arguments(self):
+        return json.loads(self.arguments)
+
+    def as_message(self):
+        return {"role": "assistant", "function_call": {"name": self.name, "arguments": self.arguments}, "content": None}
+
+
+# start_tool(function, args) -> future: how a tool is launched early, e.g. on a thread pool or as an asyncio task
+class StreamState:
+    def __init__(self, available_functions=None, start_tool=None, validate=None):
+        self.available_functions = available_functions or {}
+        self.start_tool = start_tool
+        self.validate = validate
+        self.started = time.perf_counter()
+        self.first_token_at = None
+        self.finished_at = None
+        self.content = ""
+        self.finish_reason = None
+        self.function_call = None
+        self.tool_future = None
+        self.tool_started_at = None
+        self.validation_error = None
+
+    # returns the content delta of a chunk, or None
+    def update(self, chunk):
+        choices = chunk.get("choices") or []
+        if not choices:
+            return None  # e.g. the prompt filter results Azure sends first
+        choice = choices[0]
+        delta = choice.get("delta") or {}
+        if choice.get("finish_reason"):
+            self.finish_reason = choice["finish_reason"]
+        content = delta.get("content")
+        function_call_delta = delta.get("function_call")
+        if (content or function_call_delta) and self.first_token_at is None:
+            self.first_token_at = time.perf_counter()
+        if function_call_delta:
+            if self.function_call is None:
+                self.function_call = FunctionCallAssembler()
+            self.function_call.feed(function_call_delta)
+            self._maybe_start_tool()
+        if content:
+            self.content += content
+            return content
+        return None
+
+    def _maybe_start_tool(self):
+        call = self.function_call
+        if self.tool_future is not None or not call.complete or self.start_tool is None:
+            return
+        function_to_call = self.available_functions.get(call.name)
+        if function_to_call is None:
+            return
+        try:
+            function_args = call.parsed_arguments()
+        except ValueError:
+            return  # not valid JSON after all; handled once the stream ends
+        if self.validate is not None:
+            result = self.validate(function_to_call, function_args)
+            if isinstance(result, str):
+                self.validation_error = result
+                return
+        self.tool_future = self.start_tool(function_to_call, function_args)
+        self.tool_started_at = time.perf_counter()
+
+    def finish(self):
+        self.finished_at = time.perf_counter()
+        if self.function_call is not None:
+            self._maybe_start_tool()
+
+    @property
+    def metrics(self):
+        end = self.finished_at or time.perf_counter()
+        head_start = None
+        if self.tool_started_at is not None:
+            head_start = max(end - self.tool_started_at, 0.0)
+        return {
+            "time_to_first_token": (self.first_token_at - self.started) if self.first_token_at else None,
+            "total_time": end - self.started,
+            "function_call": self.function_call.name if self.function_call else None,
+            # how long before the end of the stream the tool could already start
+            "tool_head_start": head_start,
+        }
+
+
+def append_function_messages(messages, function_call, function_response):
+    messages.append(function_call.as_message())
+    messages.append({"role": "function", "name": function_call.name, "content": function_response})
+
+
+# generator over the content deltas of a whole function-calling conversation
+# metrics: optional list that receives one dict per model call (time to first token, total time, ...)
+# validate(function, args): optional argument check, e.g. ArgumentValidator.check in schema_validator.py
+#   a string is sent back to the model as the function result so it can retry, None lets the call through
+# context_window: optional context_window.ContextWindow that decides what part of messages each request sends
+# model calls go through the rate limiter and the router and get a span each, like the non-streaming loops.
+# the generator returns the finish reason of the last model call, or None when the conversation ended on an error
+def stream_conversation(messages, functions, available_functions, deployment_id, temperature=0,
+                        max_rounds=10, metrics=None, validate=None, context_window=None):
+    with ThreadPoolExecutor(max_workers=1, thread_name_prefix="tool") as executor:
+        def start_tool(function, args):
+            # the pool thread runs the tool in a copy of this context, so its span joins the conversation's trace
+            return executor.submit(contextvars.copy_context().run, tracer.traced(kind="tool")(function), **args)
+
+        for round_number in range(max_rounds + 1):
+            # after max_rounds tool calls the model may not call another one, so none is started early
+            state = StreamState(available_functions, start_tool if round_number < max_rounds else None, validate)
+            request_messages = context_window.fit(messages, functions) if context_window is not None else messages
+            with tracer.span("chat_completion", kind="model", deployment=deployment_id, stream=True):
+                # a stream reports no usage, so the estimate stays charged
+                response = router.create(
+                    openai.ChatCompletion,
+                    deployment_id,
+                    estimate_chat_tokens(request_messages, functions),
+                    messages=request_messages,
+                    functions=functions,
+                    function_call="auto",
+                    temperature=temperature,
+                    stream=True,
+                )
+                for chunk in response:
+                    content = state.update(chunk)
+                    if content:
+                        yield content
+            state.finish()
+            if metrics is not None:
+                metrics.append(state.metrics)
+
+            call = state.function_call
+            if call is None:
+                return state.finish_reason
+            if round_number == max_rounds:
+                yield "Too many function calls: stopped after " + str(max_rounds) + " rounds"
+                return
+            if call.name not in available_functions:
+                yield "Function " + call.name + " does not exist"
+                return
+            if state.validation_error is not None:
+                append_function_messages(messages, call, state.validation_error)
+                continue
+            if state.tool_future is None:
+                yield "Invalid arguments for function: " + call.name
+                return
+            append_function_messages(messages, call, state.tool_future.result())
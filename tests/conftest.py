@@ -0,0 +1,22 @@
+import os
+import sys
+
+# the modules live at the top of the repository, next to the numbered scripts
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import openai
+import pytest
+from mock_server import MockServer
+
+
+# an offline Azure OpenAI stand-in with the global openai settings pointed at it; options go to MockServer
+@pytest.fixture
+def mock_openai(request, monkeypatch):
+    options = getattr(request, "param", {})
+    server = MockServer(**options).start()
+    monkeypatch.setattr(openai, "api_key", "mock")
+    monkeypatch.setattr(openai, "api_type", "azure")
+    monkeypatch.setattr(openai, "api_base", server.url)
+    monkeypatch.setattr(openai, "api_version", "2023-07-01-preview")
+    yield server
+    server.stop()
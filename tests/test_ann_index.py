@@ -0,0 +1,52 @@
+import numpy as np
+from ann_index import IVFIndex
+
+
+def random_vectors(count, dim=16, seed=0):
+    return np.random.default_rng(seed).normal(size=(count, dim)).astype(np.float32)
+
+
+def trained_index(count=200, nlist=8):
+    vectors = random_vectors(count)
+    index = IVFIndex(vectors.shape[1], nlist=nlist, nprobe=nlist)
+    index.train(vectors)
+    index.add([f"r{number}" for number in range(count)], vectors, hashes=[str(number) for number in range(count)])
+    return index, vectors
+
+
+def test_saved_index_loads_with_the_same_results(tmp_path):
+    index, vectors = trained_index()
+    index.save(tmp_path)
+    loaded = IVFIndex.load(tmp_path)
+
+    assert len(loaded) == len(index)
+    assert loaded.hash_by_id == index.hash_by_id
+    assert loaded.search(vectors[:5], 3) == index.search(vectors[:5], 3)
+
+
+def test_load_delete_save_search_on_the_same_path(tmp_path):
+    index, vectors = trained_index()
+    index.save(tmp_path)
+
+    loaded = IVFIndex.load(tmp_path)
+    loaded.delete([f"r{number}" for number in range(0, 200, 2)])
+    loaded.save(tmp_path)
+    results = loaded.search(vectors[:10], 5)
+
+    assert len(loaded) == 100
+    assert all(int(recipe_id[1:]) % 2 for result in results for recipe_id, _ in result)
+    # every odd query finds itself, every even one is gone
+    assert [result[0][0] for result in results[1::2]] == [f"r{number}" for number in range(1, 10, 2)]
+    assert IVFIndex.load(tmp_path).search(vectors[:10], 5) == results
+
+
+def test_add_after_load_replaces_the_changed_vector(tmp_path):
+    index, vectors = trained_index()
+    index.save(tmp_path)
+
+    loaded = IVFIndex.load(tmp_path)
+    loaded.add(["r3"], vectors[7], hashes=["changed"])
+
+    assert len(loaded) == 200
+    assert loaded.hash_by_id["r3"] == "changed"
+    assert {recipe_id for recipe_id, _ in loaded.search(vectors[7], 2)[0]} == {"r3", "r7"}
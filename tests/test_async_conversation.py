@@ -0,0 +1,76 @@
+import asyncio
+import openai
+import pytest
+from tenacity import wait_fixed
+import async_conversation
+import embeddings
+from async_conversation import AsyncConversationRunner
+
+
+class FakeRouter:
+    # fails the first `failures` requests with a 429, then answers
+    def __init__(self, runner, failures):
+        self.runner = runner
+        self.failures = failures
+        self.in_flight_seen = []
+
+    async def acreate(self, resource, deployment, estimated_tokens=0, priority=0, **kwargs):
+        self.in_flight_seen.append(self.runner.in_flight().get(deployment))
+        if self.failures:
+            self.failures -= 1
+            raise openai.error.RateLimitError("Too many requests")
+        return {"choices": [{"finish_reason": "stop", "message": {"role": "assistant", "content": "ok"}}],
+                "data": [{"index": 0, "embedding": [0.5, 0.5]}]}
+
+
+def run(runner, coroutine):
+    try:
+        return asyncio.run(coroutine)
+    finally:
+        runner.close()
+
+
+def test_stream_retries_release_the_slot_between_attempts(monkeypatch):
+    runner = AsyncConversationRunner({}, max_concurrent_requests=1)
+    fake = FakeRouter(runner, failures=2)
+    monkeypatch.setattr(async_conversation, "router", fake)
+
+    async def open_and_read():
+        await runner._open_stream("gpt-35-turbo", messages=[{"role": "user", "content": "hi"}])
+        held = runner.in_flight()["gpt-35-turbo"]
+        runner._release_slot("gpt-35-turbo")
+        # with one slot, a second request only gets through if every attempt gave its slot back
+        await asyncio.wait_for(runner._create_chat("gpt-35-turbo", messages=[]), timeout=1)
+        return held
+
+    assert run(runner, open_and_read()) == 1
+    assert fake.in_flight_seen == [1, 1, 1, 1]
+    assert runner.in_flight() == {"gpt-35-turbo": 0}
+
+
+def test_failed_stream_leaves_no_slot_taken(monkeypatch):
+    runner = AsyncConversationRunner({}, max_concurrent_requests=1)
+    monkeypatch.setattr(async_conversation, "router", FakeRouter(runner, failures=100))
+
+    with pytest.raises(openai.error.RateLimitError):
+        run(runner, runner._open_stream("gpt-35-turbo", messages=[]))
+    assert runner.in_flight() == {"gpt-35-turbo": 0}
+
+
+def test_embedding_retries_release_the_slot_between_attempts(monkeypatch):
+    runner = AsyncConversationRunner({}, max_concurrent_requests=1)
+    fake = FakeRouter(runner, failures=1)
+    monkeypatch.setattr(embeddings, "router", fake)
+    monkeypatch.setattr(embeddings._create_embeddings_async.retry, "wait", wait_fixed(0.3))
+
+    async def embed_while_checking_the_slot():
+        embedding = asyncio.ensure_future(runner.embed("hi", engine="text-embedding-ada-002"))
+        await asyncio.sleep(0.1)
+        # the first attempt got a 429 and the request is backing off
+        during_backoff = runner.in_flight()
+        return during_backoff, await embedding
+
+    during_backoff, vector = run(runner, embed_while_checking_the_slot())
+    assert during_backoff == {"text-embedding-ada-002": 0}
+    assert vector == [0.5, 0.5]
+    assert fake.in_flight_seen == [1, 1]
@@ -0,0 +1,89 @@
+import json
+import asyncio
+from async_conversation import AsyncConversationRunner
+from batch_runner import BatchRunner, read_conversations, load_checkpoint
+from schema_validator import ArgumentValidator
+from tools import registry
+
+
+def write_lines(path, records):
+    path.write_text("".join((record if isinstance(record, str) else json.dumps(record)) + "\n" for record in records))
+
+
+def read_output(path):
+    return [json.loads(line) for line in path.read_text().splitlines()]
+
+
+def run_batch(input_path, output_path, retry_errors=True):
+    available_functions = registry.available_functions()
+    runner = AsyncConversationRunner(available_functions, max_concurrent_requests=4,
+                                     validate=ArgumentValidator(registry.functions(), available_functions).check)
+    batch = BatchRunner(runner, concurrency=4, retries=1, retry_errors=retry_errors, report_every=3600)
+    try:
+        return asyncio.run(batch.run(read_conversations(str(input_path), "gpt-35-turbo"), str(output_path)))
+    finally:
+        runner.close()
+
+
+conversations = [
+    {"id": "time", "prompt": "What time is it in Europe/London?"},
+    {"id": "stock", "prompt": "How much did S&P 500 change between July 12 and July 13?"},
+    {"id": "same-time", "prompt": "What time is it in Europe/London?"},
+    "not json",
+    {"id": "unknown", "prompt": "Hello", "functions": ["get_weather"]},
+    [1, 2],
+    '"x"',
+    3,
+    {"id": "no-messages", "messages": []},
+    {"id": "bad-messages", "messages": ["Hello"]},
+    {"id": "bad-functions", "prompt": "Hello", "functions": "calculator"},
+]
+invalid_lines = ["4", "6", "7", "8", "9", "10", "11"]
+
+
+def test_batch_writes_one_line_per_conversation(tmp_path, mock_openai):
+    write_lines(tmp_path / "input.jsonl", conversations)
+    stats = run_batch(tmp_path / "input.jsonl", tmp_path / "output.jsonl")
+
+    records = {record["id"]: record for record in read_output(tmp_path / "output.jsonl")}
+    assert len(read_output(tmp_path / "output.jsonl")) == len(records) == 11
+    assert records["time"]["status"] == records["stock"]["status"] == "ok"
+    assert records["stock"]["tool_calls"][0]["name"] == "get_stock_change"
+    assert records["same-time"] == {"id": "same-time", "key": records["time"]["key"], "status": "duplicate",
+                                    "duplicate_of": "time"}
+    assert records["unknown"]["status"] == "error"
+    # lines that are not a conversation are reported and do not stop the batch
+    assert all(records[line]["status"] == "error" and records[line]["error"].startswith(f"Invalid input line {line}:")
+               for line in invalid_lines)
+    assert (stats.completed, stats.errors, stats.duplicates) == (3, 8, 1)
+
+
+def test_resume_cuts_a_torn_line_and_only_reruns_retryable_errors(tmp_path, mock_openai):
+    write_lines(tmp_path / "input.jsonl", conversations)
+    run_batch(tmp_path / "input.jsonl", tmp_path / "output.jsonl")
+    first_run = read_output(tmp_path / "output.jsonl")
+    # the "stock" conversation hit a 429 on every retry, and the crash cut the next line in half
+    lines = [json.dumps(record) for record in first_run if record["id"] != "stock"]
+    lines.append(json.dumps({"id": "stock", "key": "k", "status": "error", "error": "RateLimitError: 429",
+                             "retryable": True}))
+    (tmp_path / "output.jsonl").write_text("\n".join(lines) + "\n" + '{"id": "late", "sta')
+
+    stats = run_batch(tmp_path / "input.jsonl", tmp_path / "output.jsonl")
+
+    records = read_output(tmp_path / "output.jsonl")
+    ids = [record["id"] for record in records]
+    # the invalid lines and the unknown function failed for good and are not written again
+    assert sorted(ids) == sorted(["time", "same-time", "unknown", "stock", "stock"] + invalid_lines)
+    assert records[-1]["id"] == "stock" and records[-1]["status"] == "ok"
+    assert (stats.resumed, stats.completed) == (10, 1)
+
+
+def test_keep_errors_treats_every_error_as_done(tmp_path):
+    write_lines(tmp_path / "output.jsonl", [
+        {"id": "a", "key": "ka", "status": "error", "error": "APIError", "retryable": True},
+        {"id": "b", "key": "kb", "status": "error", "error": "Unknown functions: x"},
+        {"id": "c", "key": "kc", "status": "ok"},
+        {"id": "d", "key": "kc", "status": "duplicate", "duplicate_of": "c"}])
+
+    assert load_checkpoint(str(tmp_path / "output.jsonl")) == ({"kc": "c"}, {"b", "c", "d"})
+    assert load_checkpoint(str(tmp_path / "output.jsonl"), retry_errors=False) == ({"kc": "c"}, {"a", "b", "c", "d"})
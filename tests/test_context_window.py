@@ -0,0 +1,53 @@
+import json
+import pytest
+from context_window import ContextWindow
+
+
+def tool_rounds(count, words=5000):
+    messages = []
+    for number in range(count):
+        messages.append({"role": "assistant", "content": None,
+                         "function_call": {"name": "query_recipes", "arguments": json.dumps({"query": f"pasta {number}"})}})
+        messages.append({"role": "function", "name": "query_recipes",
+                         "content": " ".join(f"word{number}_{position}" for position in range(words))})
+    return messages
+
+
+def conversation(rounds):
+    return ([{"role": "system", "content": "Assistant helps users find recipes."},
+             {"role": "user", "content": "I want to make a pasta dish that takes less than 60 minutes to make."}]
+            + tool_rounds(rounds))
+
+
+@pytest.mark.parametrize("policy", ["drop", "summarize"])
+def test_long_tool_chain_after_one_question_fits_the_budget(policy):
+    messages = conversation(8)
+    window = ContextWindow(max_prompt_tokens=3000, policy=policy)
+    fitted = window.fit(messages)
+
+    assert window.count(fitted) <= window.max_prompt_tokens
+    assert not window.last_stats["over_budget"]
+    # the system message, the question and the last two tool rounds are kept
+    assert fitted[0] == messages[0]
+    assert messages[1] in fitted
+    assert [message.get("function_call") for message in fitted[-4:]] == \
+           [messages[-4]["function_call"], None, messages[-2]["function_call"], None]
+    # the history itself is not changed
+    assert len(messages) == 18
+
+
+def test_function_call_is_not_separated_from_its_result():
+    fitted = ContextWindow(max_prompt_tokens=3000).fit(conversation(8))
+    for position, message in enumerate(fitted):
+        if message.get("function_call"):
+            assert fitted[position + 1]["role"] == "function"
+        if message["role"] == "function":
+            assert fitted[position - 1].get("function_call")
+
+
+def test_prompt_under_budget_is_sent_unchanged():
+    messages = conversation(1)
+    window = ContextWindow(max_prompt_tokens=3000)
+    fitted = window.fit(messages)
+    assert len(fitted) == len(messages)
+    assert window.last_stats["dropped_messages"] == 0
@@ -0,0 +1,37 @@
+from azure.search.documents.indexes.models import SearchField, SearchFieldDataType, SearchIndex, SimpleField
+from index_manifest import same_fields, live_documents, diff_documents
+
+
+def recipe_index(dimensions=1536):
+    return SearchIndex(name="recipes", fields=[
+        SimpleField(name="recipe_id", type=SearchFieldDataType.String, key=True),
+        SearchField(name="recipe_vector", type=SearchFieldDataType.Collection(SearchFieldDataType.Single),
+                    searchable=True, vector_search_dimensions=dimensions, vector_search_configuration="my-vector-config")])
+
+
+def test_live_index_with_the_same_fields_is_adopted():
+    # the service answers with its own serialization, including defaults the local definition leaves out
+    live = SearchIndex.deserialize(dict(recipe_index().serialize(), **{"@odata.etag": "0x1"}))
+    assert same_fields(live, recipe_index())
+
+
+def test_live_index_with_other_vector_dimensions_is_not():
+    assert not same_fields(SearchIndex.deserialize(recipe_index(768).serialize()), recipe_index())
+
+
+class SearchClient:
+    def __init__(self, keys):
+        self.keys = keys
+
+    def search(self, search_text, select):
+        assert (search_text, select) == ("*", ["recipe_id"])
+        return [{"recipe_id": key} for key in self.keys]
+
+
+def test_documents_of_an_adopted_index_that_left_the_source_are_removed():
+    previous = live_documents(SearchClient(["1", "2", "3"]))
+    diff = diff_documents(previous, {"1": "hash 1", "2": "hash 2", "4": "hash 4"})
+    assert diff["removed"] == ["3"]
+    assert diff["added"] == ["4"]
+    # their hashes are unknown, so every recipe the index holds is sent again
+    assert diff["changed"] == ["1", "2"]
@@ -0,0 +1,41 @@
+import threading
+import pytest
+from ingest_pipeline import run_pipeline
+
+
+def embed(documents):
+    return [dict(document, vector=[float(document["id"])]) for document in documents]
+
+
+def test_every_record_is_embedded_and_uploaded_once_in_bounded_batches():
+    uploaded = []
+    lock = threading.Lock()
+
+    def upload(batch):
+        assert len(batch) <= 10
+        with lock:
+            uploaded.extend(batch)
+
+    report = run_pipeline(({"id": number} for number in range(137)), embed, upload,
+                          embedding_batch_size=4, batch_size=10, embed_workers=3, upload_workers=2)
+
+    assert sorted(document["id"] for document in uploaded) == list(range(137))
+    assert all(document["vector"] == [float(document["id"])] for document in uploaded)
+    assert [stage["docs"] for stage in report.as_dicts()] == [137] * 4
+
+
+def test_a_failing_stage_stops_the_pipeline_and_raises():
+    read = []
+
+    def records():
+        for number in range(100000):
+            read.append(number)
+            yield {"id": number}
+
+    def failing_upload(batch):
+        raise RuntimeError("upload failed")
+
+    with pytest.raises(RuntimeError, match="upload failed"):
+        run_pipeline(records(), embed, failing_upload, embedding_batch_size=4, batch_size=8, queue_size=2)
+    # the bounded queues stop the reader long before the end of the input
+    assert len(read) < 1000
@@ -0,0 +1,39 @@
+import numpy as np
+from ann_index import IVFIndex
+from local_search import LocalRecipeIndex
+from vector_ops import normalize_rows
+
+
+def recipes(count):
+    return [{"recipe_id": str(number), "recipe_name": f"dish {number}", "description": "", "recipe": f"recipe {number}",
+             "ingredients": ["salt"], "total_time": 10 + number % 50} for number in range(count)]
+
+
+def pq_index(count=300, dim=32):
+    vectors = normalize_rows(np.random.default_rng(1).normal(size=(count, dim)))
+    index = LocalRecipeIndex(recipes(count), vectors, vector_storage="pq",
+                             store_options={"m": 8, "ks": 16, "rerank_source": vectors, "rerank": 20})
+    return index, vectors
+
+
+def vector_positions(index, query, k=5):
+    return [int(result["recipe_id"]) for result in index.search(None, query, vector_k=k)]
+
+
+def test_vectors_of_a_pq_store_are_the_full_rerank_vectors():
+    index, vectors = pq_index()
+    assert np.array_equal(index.vectors, vectors)
+
+
+def test_ann_candidates_are_reranked_against_the_full_vectors():
+    index, vectors = pq_index()
+    exact = [list(np.argsort(-(vectors @ vectors[number]), kind="stable")[:5]) for number in range(10)]
+
+    ann = IVFIndex(vectors.shape[1], nlist=4, nprobe=4)
+    ann.train(index.vectors)
+    ann.add([recipe["recipe_id"] for recipe in index.recipes], index.vectors)
+    index.ann = ann
+
+    # probing every list, the shortlist holds the true neighbours, and the rerank puts them in exact order
+    assert [vector_positions(index, vectors[number]) for number in range(10)] == exact
+    assert [positions[0] for positions in exact] == list(range(10))
@@ -0,0 +1,9 @@
+import pytest
+from mock_server import MockServer
+
+
+def test_record_mode_needs_an_upstream_and_a_fixtures_file(tmp_path):
+    with pytest.raises(ValueError, match="upstream"):
+        MockServer(mode="record", fixtures=str(tmp_path / "fixtures.jsonl"))
+    with pytest.raises(ValueError, match="fixtures file"):
+        MockServer(mode="record", upstream="https://example.openai.azure.com")
@@ -0,0 +1,61 @@
+import random
+import pytest
+from odata_filter import FilterIndex, ODataFilterError, combine_filters, parse_filter
+
+ingredient_names = ["salt", "pepper", "garlic", "basil", "tomato", "o'nion"]
+
+
+def random_recipes(count=200, seed=0):
+    rng = random.Random(seed)
+    return [{"recipe_id": str(number), "recipe_category": rng.choice(["Italian", "Thai", "Dessert"]),
+             "ingredients": rng.sample(ingredient_names, rng.randint(0, 4)), "total_time": rng.randint(5, 120)}
+            for number in range(count)]
+
+
+recipes = random_recipes()
+index = FilterIndex(recipes)
+
+# each filter with the same condition in Python
+cases = [
+    ("ingredients/any(i: i eq 'salt')", lambda recipe: "salt" in recipe["ingredients"]),
+    ("ingredients/any(i: i eq 'salt' or i eq 'pepper')",
+     lambda recipe: bool({"salt", "pepper"} & set(recipe["ingredients"]))),
+    ("ingredients/any(i: i ne 'salt')", lambda recipe: any(value != "salt" for value in recipe["ingredients"])),
+    ("ingredients/any(i: i eq 'o''nion')", lambda recipe: "o'nion" in recipe["ingredients"]),
+    ("total_time lt 25", lambda recipe: recipe["total_time"] < 25),
+    ("total_time le 25", lambda recipe: recipe["total_time"] <= 25),
+    ("total_time gt 60", lambda recipe: recipe["total_time"] > 60),
+    ("total_time ge 60", lambda recipe: recipe["total_time"] >= 60),
+    ("total_time eq 30", lambda recipe: recipe["total_time"] == 30),
+    ("total_time ne 30", lambda recipe: recipe["total_time"] != 30),
+    ("recipe_category eq 'Italian' and not (total_time ge 60)",
+     lambda recipe: recipe["recipe_category"] == "Italian" and not recipe["total_time"] >= 60),
+    ("recipe_category eq 'Thai' or total_time lt 10 and ingredients/any(i: i eq 'basil')",
+     lambda recipe: recipe["recipe_category"] == "Thai" or (recipe["total_time"] < 10 and "basil" in recipe["ingredients"])),
+    ("ingredients/any(i: i eq 'saffron')", lambda recipe: False),
+]
+
+
+@pytest.mark.parametrize("filter_text, condition", cases, ids=[case[0] for case in cases])
+def test_candidates_match_the_filter_evaluated_per_recipe(filter_text, condition):
+    expected = [position for position, recipe in enumerate(recipes) if condition(recipe)]
+    assert index.candidates(filter_text).tolist() == expected
+
+
+def test_combined_filters_keep_their_own_precedence():
+    combined = combine_filters("total_time lt 30", "ingredients/any(i: i eq 'salt') or ingredients/any(i: i eq 'basil')")
+    expected = [position for position, recipe in enumerate(recipes)
+                if recipe["total_time"] < 30 and {"salt", "basil"} & set(recipe["ingredients"])]
+    assert index.candidates(combined).tolist() == expected
+    assert combine_filters(None, "total_time lt 30", "") == "total_time lt 30"
+
+
+def test_no_filter_means_no_restriction():
+    assert index.candidates("") is None
+
+
+@pytest.mark.parametrize("filter_text", ["total_time lt", "total_time between 5", "ingredients/any(i: i eq 'salt'",
+                                         "cuisine eq 'Thai'", "total_time lt 25 and"])
+def test_malformed_filters_are_rejected(filter_text):
+    with pytest.raises(ODataFilterError):
+        parse_filter(filter_text)
@@ -0,0 +1,37 @@
+import tracemalloc
+import numpy as np
+import pytest
+from quantization import build_vector_store
+from vector_ops import normalize_rows
+
+
+def vectors(count=1000, dim=64):
+    return normalize_rows(np.random.default_rng(2).normal(size=(count, dim))).astype(np.float32)
+
+
+@pytest.mark.parametrize("kind", ["float16", "int8"])
+def test_block_scores_match_the_decoded_store(kind, monkeypatch):
+    store = build_vector_store(kind, vectors())
+    queries = vectors(3)
+    expected = queries @ store.decode().T
+    rows = np.arange(5, 900, 7)
+
+    monkeypatch.setattr(type(store), "block_rows", 64)
+    assert np.allclose(store.scores(queries, rows), expected[:, rows], atol=1e-5)
+    assert np.allclose(store.scores(queries), expected, atol=1e-5)
+    assert np.allclose(store.scores(queries[0]), expected[0], atol=1e-5)
+
+
+@pytest.mark.parametrize("kind", ["float16", "int8"])
+def test_scoring_does_not_convert_the_whole_store(kind):
+    store = build_vector_store(kind, vectors(40000, 64))
+    full_float32 = 40000 * 64 * 4
+    queries = vectors(1)
+
+    tracemalloc.start()
+    try:
+        store.scores(queries)
+        _, peak = tracemalloc.get_traced_memory()
+    finally:
+        tracemalloc.stop()
+    assert peak < full_float32 / 4
@@ -0,0 +1,156 @@
+import time
+import threading
+import openai
+import pytest
+import requests
+from rate_limiter import RateLimiter, RateLimitTimeout, BULK, INTERACTIVE
+from router import Router
+
+
+def response(url, status, headers=None):
+    result = requests.Response()
+    result.url = url
+    result.status_code = status
+    result.headers.update(headers or {})
+    return result
+
+
+def test_token_bucket_lets_a_burst_through_then_paces_requests():
+    # 600 rpm with a 1 second burst: 10 requests at once, then one every 0.1s
+    limiter = RateLimiter(burst_seconds=1).configure("gpt-35-turbo", rpm=600)
+    started = time.monotonic()
+    for _ in range(10):
+        limiter.acquire("gpt-35-turbo")
+    assert time.monotonic() - started < 0.05
+    for _ in range(3):
+        limiter.acquire("gpt-35-turbo")
+    assert time.monotonic() - started >= 0.25
+    assert limiter.stats()["gpt-35-turbo"]["requests"] == 13
+
+
+def test_token_budget_is_refunded_by_the_usage_of_the_response():
+    limiter = RateLimiter(burst_seconds=1).configure("gpt-35-turbo", tpm=6000)
+    ticket = limiter.acquire("gpt-35-turbo", tokens=100)
+    ticket.settle({"usage": {"total_tokens": 30}})
+    assert limiter.stats()["gpt-35-turbo"]["refunded_tokens"] == 70
+    # a stream reports no usage and keeps its estimate charged
+    limiter.acquire("gpt-35-turbo", tokens=50).settle(iter(()))
+    assert limiter.stats()["gpt-35-turbo"]["refunded_tokens"] == 70
+
+
+def test_interactive_requests_overtake_queued_bulk_requests():
+    limiter = RateLimiter(burst_seconds=1).configure("gpt-35-turbo", rpm=120)
+    for _ in range(2):
+        limiter.acquire("gpt-35-turbo")
+    order = []
+
+    def acquire(priority):
+        limiter.acquire("gpt-35-turbo", priority=priority)
+        order.append(priority)
+
+    bulk = threading.Thread(target=acquire, args=(BULK,))
+    bulk.start()
+    time.sleep(0.05)
+    interactive = threading.Thread(target=acquire, args=(INTERACTIVE,))
+    interactive.start()
+    bulk.join(5)
+    interactive.join(5)
+    assert order == [INTERACTIVE, BULK]
+
+
+def test_acquire_gives_up_after_timeout():
+    limiter = RateLimiter(burst_seconds=1).configure("gpt-35-turbo", rpm=60)
+    limiter.acquire("gpt-35-turbo")
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire("gpt-35-turbo", timeout=0.1)
+
+
+@pytest.mark.parametrize("mock_openai", [{"rpm": 2}], indirect=True)
+def test_429_from_the_service_holds_the_deployment_back(mock_openai, monkeypatch):
+    limiter = RateLimiter().configure("gpt-35-turbo", rpm=600)
+    monkeypatch.setattr(openai, "requestssession", limiter.instrument_session(requests.Session()))
+    messages = [{"role": "user", "content": "Hello"}]
+
+    for _ in range(2):
+        openai.ChatCompletion.create(deployment_id="gpt-35-turbo", messages=messages)
+    with pytest.raises(openai.error.RateLimitError):
+        openai.ChatCompletion.create(deployment_id="gpt-35-turbo", messages=messages)
+
+    stats = limiter.stats()["gpt-35-turbo"]
+    assert stats["throttled"] == 1
+    # the Retry-After of the mock's minute window, and a slower refill from now on
+    assert limiter.blocked_for("gpt-35-turbo") > 1
+    assert stats["rpm"] < 600
+    with pytest.raises(RateLimitTimeout):
+        limiter.acquire("gpt-35-turbo", timeout=0.2)
+
+
+def test_429_from_a_renamed_deployment_holds_back_the_name_callers_acquire():
+    limiter = RateLimiter().configure("gpt-35-turbo", rpm=6000)
+    router = two_endpoints(limiter)
+    session = limiter.instrument_session(requests.Session(), key_for=router.limit_key)
+
+    for hook in session.hooks["response"]:
+        hook(response("https://west.example.com/openai/deployments/gpt-35-turbo-0613/chat/completions",
+                      429, {"retry-after-ms": "500"}))
+
+    assert limiter.stats()["west/gpt-35-turbo"]["throttled"] == 1
+    started = time.monotonic()
+    limiter.acquire("west/gpt-35-turbo")
+    assert time.monotonic() - started >= 0.4
+
+
+class FlakyResource:
+    # answers like openai.ChatCompletion; endpoints listed in throttled answer 429
+    def __init__(self, throttled=()):
+        self.throttled = set(throttled)
+        self.calls = []
+
+    def create(self, deployment_id, api_base, **kwargs):
+        self.calls.append((api_base, deployment_id))
+        if api_base in self.throttled:
+            raise openai.error.RateLimitError("Too many requests", headers={"retry-after-ms": "60000"})
+        return {"usage": {"total_tokens": 10}}
+
+
+def two_endpoints(limiter):
+    return Router(limiter=limiter).configure([
+        {"name": "east", "api_base": "https://east.example.com/", "api_key": "key"},
+        {"name": "west", "api_base": "https://west.example.com/", "api_key": "key",
+         "deployments": {"gpt-35-turbo": "gpt-35-turbo-0613"}}])
+
+
+def test_failover_takes_a_ticket_on_the_endpoint_it_moves_to():
+    limiter = RateLimiter().configure("gpt-35-turbo", rpm=600, tpm=100000)
+    router = two_endpoints(limiter)
+    resource = FlakyResource(throttled={"https://east.example.com/"})
+    router.strategy = "latency"
+    router.endpoints[1].weight = 1e-9  # east first
+
+    router.create(resource, "gpt-35-turbo", estimated_tokens=100, messages=[])
+
+    assert resource.calls == [("https://east.example.com/", "gpt-35-turbo"),
+                              ("https://west.example.com/", "gpt-35-turbo-0613")]
+    stats = limiter.stats()
+    assert stats["east/gpt-35-turbo"]["requests"] == 1
+    assert stats["west/gpt-35-turbo"]["requests"] == 1
+    # the configured limits apply to each endpoint, and the answered request gets its unused tokens back
+    assert stats["west/gpt-35-turbo"]["rpm"] == 600
+    assert stats["west/gpt-35-turbo"]["refunded_tokens"] == 90
+
+
+def test_429_from_one_endpoint_does_not_hold_back_the_others():
+    limiter = RateLimiter().configure("gpt-35-turbo", rpm=6000)
+    router = two_endpoints(limiter)
+    session = limiter.instrument_session(requests.Session(), key_for=router.limit_key)
+    for hook in session.hooks["response"]:
+        hook(response("https://east.example.com/openai/deployments/gpt-35-turbo/chat/completions",
+                      429, {"retry-after-ms": "60000"}))
+
+    started = time.monotonic()
+    router.create(FlakyResource(), "gpt-35-turbo", messages=[])
+    router.create(FlakyResource(), "gpt-35-turbo", messages=[])
+
+    assert time.monotonic() - started < 1
+    assert limiter.stats()["east/gpt-35-turbo"]["throttled"] == 1
+    assert limiter.stats()["west/gpt-35-turbo"]["throttled"] == 0
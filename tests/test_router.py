@@ -0,0 +1,71 @@
+import time
+import openai
+import pytest
+from router import Router, NoEndpointAvailable
+
+messages = [{"role": "user", "content": "Hello"}]
+
+
+# a dead endpoint (nothing listens on port 1) tried first, and the mock server behind it
+def dead_then_live(server, **options):
+    router = Router(strategy="latency", **options).configure([
+        {"name": "dead", "api_base": "http://127.0.0.1:1", "api_key": "key"},
+        {"name": "live", "api_base": server.url, "api_key": "key"}])
+    router.endpoints[1].weight = 1e-9
+    return router
+
+
+def test_failover_moves_a_failed_request_to_the_next_endpoint(mock_openai):
+    router = dead_then_live(mock_openai)
+
+    response = router.create(openai.ChatCompletion, "gpt-35-turbo", messages=messages)
+
+    assert response["choices"][0]["message"]["role"] == "assistant"
+    dead, live = router.endpoints
+    assert dead.stats["errors"] == 1 and dead.stats["failovers"] == 1
+    assert live.stats["requests"] == 1 and live.latency is not None
+
+
+def test_circuit_opens_after_failure_threshold_and_half_opens_after_cooldown(mock_openai):
+    router = dead_then_live(mock_openai, failure_threshold=2, cooldown=60)
+    dead, live = router.endpoints
+
+    for _ in range(2):
+        router.create(openai.ChatCompletion, "gpt-35-turbo", messages=messages)
+    assert dead.state == "open" and dead.stats["circuit_opened"] == 1
+
+    # while open, requests go straight to the live endpoint
+    for _ in range(3):
+        router.create(openai.ChatCompletion, "gpt-35-turbo", messages=messages)
+    assert dead.stats["requests"] == 2
+    assert live.stats["requests"] == 5
+
+    # after the cooldown a single trial request fails and opens the circuit again
+    dead.open_until = time.monotonic()
+    router.create(openai.ChatCompletion, "gpt-35-turbo", messages=messages)
+    assert dead.stats["requests"] == 3
+    assert dead.state == "open" and dead.stats["circuit_opened"] == 2
+
+
+def test_bad_request_is_not_failed_over():
+    class BadRequest:
+        calls = 0
+
+        @classmethod
+        def create(cls, **kwargs):
+            cls.calls += 1
+            raise openai.error.InvalidRequestError("Bad request", None, http_status=400)
+
+    router = Router().configure([{"name": "east", "api_base": "https://east.example.com/", "api_key": "key"},
+                                 {"name": "west", "api_base": "https://west.example.com/", "api_key": "key"}])
+    with pytest.raises(openai.error.InvalidRequestError):
+        router.create(BadRequest, "gpt-35-turbo", messages=messages)
+    assert BadRequest.calls == 1
+    assert all(endpoint.state == "closed" for endpoint in router.endpoints)
+
+
+def test_deployment_no_endpoint_serves():
+    router = Router().configure([{"name": "east", "api_base": "https://east.example.com/", "api_key": "key",
+                                  "deployments": {"gpt-4": "gpt-4"}}])
+    with pytest.raises(NoEndpointAvailable):
+        router.create(openai.ChatCompletion, "gpt-35-turbo", messages=messages)
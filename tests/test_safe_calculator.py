@@ -0,0 +1,49 @@
+import pytest
+from safe_calculator import CalculatorError, evaluate_expression, calculate_batch
+from tools import calculator
+
+
+def test_scalar_mode_without_num2_returns_error():
+    assert calculator(num1=1, operator="+") == "Error: num1 and num2 must be numbers"
+    assert calculator(num2=2, operator="-") == "Error: num1 and num2 must be numbers"
+
+
+def test_scalar_mode_without_operator_returns_error():
+    assert calculator(num1=1, num2=2) == "Invalid operator"
+
+
+def test_scalar_mode_sqrt_needs_no_num2():
+    assert calculator(num1=9, operator="sqrt") == "3.0"
+
+
+def test_scalar_mode_keeps_results():
+    assert calculator(num1=2, num2=10, operator="**") == "1024"
+    assert calculator(num1=2.5, num2=2, operator="*") == "5.0"
+    assert calculator(num1=1, num2=0, operator="/") == "Error: division by zero"
+
+
+def test_negative_base_to_fractional_power_is_an_error():
+    with pytest.raises(CalculatorError):
+        evaluate_expression("(-8)**0.5")
+    assert calculator(expression="(-8)**0.5") == "Error: result is not a real number"
+    assert calculator(num1=-8, num2=0.5, operator="**") == "Error: result is not a real number"
+    assert calculate_batch([{"num1": -8.0, "num2": 2.0, "operator": "**"}]) == ["64.0"]
+
+
+def test_sqrt_of_complex_value_is_an_error():
+    with pytest.raises(CalculatorError):
+        evaluate_expression("sqrt((-1)**0.5)")
+    assert calculator(expression="sqrt((-1)**0.5)") == "Error: result is not a real number"
+
+
+@pytest.mark.parametrize("expression", ["1e308*10", "-1e308*10", "1e999", "1e308*10 - 1e308*10", "1/(1e308*10)"])
+def test_non_finite_results_are_an_error(expression):
+    with pytest.raises(CalculatorError):
+        evaluate_expression(expression)
+    assert calculator(expression=expression) == "Error: result is not a finite number"
+
+
+def test_non_finite_operation_results_are_an_error():
+    assert calculator(num1=1e308, num2=10, operator="*") == "Error: result is not a finite number"
+    assert calculator(num1=10 ** 400, num2=3, operator="/") == "Error: result too large"
+    assert calculator(expression="10.0**400") == "Error: result too large"
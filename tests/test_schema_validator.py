@@ -0,0 +1,22 @@
+import json
+from schema_validator import ArgumentValidator
+from tools import registry, get_stock_returns
+
+
+validator = ArgumentValidator(registry.functions(), registry.available_functions())
+
+
+def test_null_for_an_argument_defaulting_to_none_is_accepted():
+    assert validator.check(get_stock_returns, {"index": "S&P 500", "start_date": None}) is None
+
+
+def test_null_for_a_required_or_non_none_default_argument_is_rejected():
+    errors = json.loads(validator.check(get_stock_returns, {"index": None, "field": None}))["details"]
+    assert {error["argument"] for error in errors} == {"index", "field"}
+
+
+def test_wrong_type_and_unknown_argument_are_reported():
+    errors = json.loads(validator.check(get_stock_returns, {"index": "S&P 500", "start_date": 20230101,
+                                                            "period": "1y"}))["details"]
+    assert errors == [{"argument": "start_date", "error": "expected string, got integer"},
+                      {"argument": "period", "error": "unexpected argument"}]
@@ -0,0 +1,42 @@
+import pytest
+from semantic_cache import SemanticCache, cached_conversation, cached_stream
+
+
+def embed(text):
+    return [1.0, 0.0]
+
+
+def response(content, finish_reason):
+    return {"choices": [{"finish_reason": finish_reason, "message": {"role": "assistant", "content": content}}]}
+
+
+@pytest.mark.parametrize("finish_reason, cached", [("stop", True), ("length", False), ("content_filter", False)])
+def test_only_complete_answers_are_cached(finish_reason, cached):
+    cache = SemanticCache(embed)
+    calls = []
+
+    def run_conversation(messages, functions, available_functions, deployment_id):
+        calls.append(messages[-1]["content"])
+        return response("Pancakes", finish_reason)
+
+    run = cached_conversation(cache, run_conversation)
+    for _ in range(2):
+        run([{"role": "user", "content": "What's for breakfast?"}], [], {}, "gpt-35-turbo")
+    assert len(calls) == (1 if cached else 2)
+
+
+@pytest.mark.parametrize("finish_reason, cached", [("stop", True), ("length", False), (None, False)])
+def test_only_complete_streams_are_cached(finish_reason, cached):
+    cache = SemanticCache(embed)
+    calls = []
+
+    def stream_conversation(messages, functions, available_functions, deployment_id):
+        calls.append(messages[-1]["content"])
+        yield "Pan"
+        yield "cakes"
+        return finish_reason
+
+    run = cached_stream(cache, stream_conversation)
+    for _ in range(2):
+        assert "".join(run([{"role": "user", "content": "What's for breakfast?"}], [], {}, "gpt-35-turbo")) == "Pancakes"
+    assert len(calls) == (1 if cached else 2)
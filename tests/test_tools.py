@@ -0,0 +1,9 @@
+import json
+import tools
+
+
+def test_stock_tools_work_from_another_working_directory(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tools.stock_store.cache_clear()
+    data = json.loads(tools.get_stock_market_data("S&P 500", "2023-07-12", "2023-07-13"))
+    assert list(data["Date"].values()) == ["2023-07-12", "2023-07-13"]
@@ -0,0 +1,144 @@
+import json
+import time
+import sqlite3
+import functools
+import threading
+from collections import OrderedDict
+
+# memoization of tool results, applied when available_functions is built
+# the key is the function name plus its arguments as canonical JSON, so {"a": 1, "b": 2} and {"b": 2, "a": 1}
+# hit the same entry. every function gets its own TTL, functions whose answer changes on every call
+# (get_current_time) are left alone, and results live in a size-bounded LRU in memory or in a SQLite
+# file that several worker processes can share
+
+
+def canonical_key(function_name, function_args):
+    return function_name + ":" + json.dumps(function_args, sort_keys=True, separators=(",", ":"), default=str)
+
+
+class MemoryBackend:
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            value, expires = entry
+            if expires < time.time():
+                del self._entries[key]
+                return None
+            self._entries.move_to_end(key)
+            return entry
+
+    def set(self, key, value, ttl):
+        with self._lock:
+            self._entries[key] = (value, time.time() + ttl)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, function_name):
+        prefix = function_name + ":"
+        with self._lock:
+            for key in [key for key in self._entries if key.startswith(prefix)]:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+
+class SqliteBackend:
+    # a SQLite file shared by several processes; each thread gets its own connection
+    def __init__(self, path="tool_cache.sqlite", max_entries=10000):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        with self._connection() as connection:
+            connection.execute("CREATE TABLE IF NOT EXISTS tool_cache "
+                               "(key TEXT PRIMARY KEY, value TEXT, expires REAL, used REAL)")
+
+    def _connection(self):
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=5, isolation_level=None)
+            connection.execute("PRAGMA journal_mode=WAL")
+            self._local.connection = connection
+        return connection
+
+    def get(self, key):
+        connection = self._connection()
+        row = connection.execute("SELECT value, expires FROM tool_cache WHERE key = ?", (key,)).fetchone()
+        if row is None:
+            return None
+        if row[1] < time.time():
+            connection.execute("DELETE FROM tool_cache WHERE key = ?", (key,))
+            return None
+        connection.execute("UPDATE tool_cache SET used = ? WHERE key = ?", (time.time(), key))
+        return json.loads(row[0]), row[1]
+
+    def set(self, key, value, ttl):
+        connection = self._connection()
+        now = time.time()
+        connection.execute("INSERT OR REPLACE INTO tool_cache VALUES (?, ?, ?, ?)",
+                           (key, json.dumps(value), now + ttl, now))
+        # evict expired and least recently used rows beyond the size bound
+        connection.execute("DELETE FROM tool_cache WHERE expires < ?", (now,))
+        connection.execute("DELETE FROM tool_cache WHERE key IN (SELECT key FROM tool_cache "
+                           "ORDER BY used DESC LIMIT -1 OFFSET ?)", (self.max_entries,))
+
+    def invalidate(self, function_name):
+        self._connection().execute("DELETE FROM tool_cache WHERE substr(key, 1, ?) = ?",
+                                   (len(function_name) + 1, function_name + ":"))
+
+    def __len__(self):
+        return self._connection().execute("SELECT COUNT(*) FROM tool_cache").fetchone()[0]
+
+
+class ToolCacheStats:
+    def __init__(self):
+        self.hits = {}
+        self.misses = {}
+
+    def record(self, function_name, hit):
+        counter = self.hits if hit else self.misses
+        counter[function_name] = counter.get(function_name, 0) + 1
+
+    def as_dict(self):
+        names = sorted(set(self.hits) | set(self.misses))
+        return {name: {"hits": self.hits.get(name, 0), "misses": self.misses.get(name, 0)} for name in names}
+
+
+def memoize_tool(function_name, function, ttl, backend, stats=None):
+    # functools.wraps keeps __wrapped__, so inspect.signature (schema_validator.ArgumentValidator) still sees the real parameters
+    @functools.wraps(function)
+    def wrapper(**function_args):
+        key = canonical_key(function_name, function_args)
+        cached = backend.get(key)
+        if stats is not None:
+            stats.record(function_name, cached is not None)
+        if cached is not None:
+            return cached[0]
+        result = function(**function_args)
+        backend.set(key, result, ttl)
+        return result
+
+    return wrapper
+
+
+# returns a new available_functions dict with every cacheable tool memoized
+# ttls: seconds per function name, default_ttl for the others, non_cacheable: names that are never cached
+def memoize_functions(available_functions, ttls=None, default_ttl=300, non_cacheable=(), backend=None, stats=None):
+    backend = backend if backend is not None else MemoryBackend()
+    ttls = ttls or {}
+    memoized = {}
+    for function_name, function in available_functions.items():
+        if function_name in non_cacheable:
+            memoized[function_name] = function
+        else:
+            memoized[function_name] = memoize_tool(function_name, function, ttls.get(function_name, default_ttl),
+                                                   backend, stats)
+    return memoized
@@ -0,0 +1,168 @@
+import re
+import inspect
+import importlib
+import typing
+
+# registry of the functions the model can call
+# @registry.tool() derives the "functions" schema entry from the function itself: the description is the first
+# paragraph of the docstring, argument descriptions come from its "Args:" section, and JSON types from the type
+# hints (Literal[...] becomes an enum, TypedDict an object, arguments without a default are required). the
+# schema is built on first use and cached. tools can declare keywords so that only the tools relevant to a
+# conversation are sent to the model, which keeps the prompt small
+
+
+def lazy_import(module_name):
+    return LazyModule(module_name)
+
+
+# stands in for a module and imports it on first attribute access, so heavy dependencies (pandas, pytz, numpy)
+# are only loaded by the first call of a tool that needs them
+class LazyModule:
+    def __init__(self, module_name):
+        self._module_name = module_name
+        self._module = None
+
+    def __getattr__(self, name):
+        if self._module is None:
+            self._module = importlib.import_module(self._module_name)
+        return getattr(self._module, name)
+
+
+json_types = {str: "string", int: "integer", float: "number", bool: "boolean", list: "array", dict: "object"}
+
+
+def type_schema(hint):
+    origin = typing.get_origin(hint)
+    args = typing.get_args(hint)
+    if origin is typing.Annotated:
+        return type_schema(args[0])
+    if origin is typing.Literal:
+        schema = type_schema(type(args[0]))
+        schema["enum"] = list(args)
+        return schema
+    if origin is typing.Union:
+        # Optional[X]: optional arguments are expressed by leaving them out of "required"
+        options = [arg for arg in args if arg is not type(None)]
+        if len(options) == 1:
+            return type_schema(options[0])
+        return {"type": [type_schema(option).get("type") for option in options]}
+    if origin in (list, tuple, set):
+        schema = {"type": "array"}
+        if args:
+            schema["items"] = type_schema(args[0])
+        return schema
+    if origin is dict:
+        return {"type": "object"}
+    if typing.is_typeddict(hint):
+        hints = typing.get_type_hints(hint)
+        return {
+            "type": "object",
+            "properties": {name: type_schema(field) for name, field in hints.items()},
+            "required": [name for name in hints if name in hint.__required_keys__],
+        }
+    if hint in json_types:
+        return {"type": json_types[hint]}
+    if hint is inspect.Parameter.empty or hint is typing.Any:
+        return {}
+    raise TypeError(f"No JSON schema type for {hint!r}")
+
+
+# description and per-argument descriptions from a docstring with an "Args:" section
+def parse_docstring(docstring):
+    docstring = inspect.cleandoc(docstring or "")
+    description, _, rest = docstring.partition("\n\n")
+    arguments = {}
+    name = None
+    in_args = False
+    for line in rest.splitlines():
+        if line.strip() in ("Args:", "Arguments:", "Parameters:"):
+            in_args = True
+            continue
+        if not in_args:
+            continue
+        match = re.match(r"^\s{2,}(\w+)(?:\s*\(.*?\))?:\s*(.*)$", line)
+        if match and len(line) - len(line.lstrip()) <= 4:
+            name = match.group(1)
+            arguments[name] = match.group(2).strip()
+        elif line.strip() and name is not None and line.startswith(" "):
+            arguments[name] = (arguments[name] + " " + line.strip()).strip()
+        elif not line.strip():
+            continue
+        else:
+            in_args = False
+    return " ".join(description.split()), arguments
+
+
+def function_schema(function, name=None, description=None):
+    docstring_description, argument_descriptions = parse_docstring(function.__doc__)
+    hints = typing.get_type_hints(function, include_extras=True)
+    properties = {}
+    required = []
+    for parameter in inspect.signature(function).parameters.values():
+        if parameter.kind in (parameter.VAR_POSITIONAL, parameter.VAR_KEYWORD):
+            continue
+        schema = type_schema(hints.get(parameter.name, parameter.empty))
+        if parameter.name in argument_descriptions:
+            schema["description"] = argument_descriptions[parameter.name]
+        properties[parameter.name] = schema
+        if parameter.default is parameter.empty:
+            required.append(parameter.name)
+    return {
+        "name": name or function.__name__,
+        "description": description or docstring_description,
+        "parameters": {"type": "object", "properties": properties, "required": required},
+    }
+
+
+class Tool:
+    def __init__(self, function, name=None, description=None, keywords=()):
+        self.function = function
+        self.name = name or function.__name__
+        self.description = description
+        self.keywords = tuple(keyword.lower() for keyword in keywords)
+        self._schema = None
+
+    @property
+    def schema(self):
+        if self._schema is None:
+            self._schema = function_schema(self.function, self.name, self.description)
+        return self._schema
+
+    # tools without keywords are always offered
+    def matches(self, text):
+        return not self.keywords or any(keyword in text for keyword in self.keywords)
+
+
+class ToolRegistry:
+    def __init__(self):
+        self.tools = {}
+
+    def register(self, function, name=None, description=None, keywords=()):
+        tool = Tool(function, name, description, keywords)
+        self.tools[tool.name] = tool
+        return function
+
+    def tool(self, name=None, description=None, keywords=()):
+        def decorator(function):
+            return self.register(function, name, description, keywords)
+        return decorator
+
+    def _selected(self, names):
+        if names is None:
+            return list(self.tools.values())
+        return [self.tools[name] for name in names]
+
+    # the "functions" list for ChatCompletion.create
+    def functions(self, names=None):
+        return [tool.schema for tool in self._selected(names)]
+
+    def available_functions(self, names=None):
+        return {tool.name: tool.function for tool in self._selected(names)}
+
+    # names of the tools whose keywords appear in the user messages; every tool when none match
+    def select(self, messages):
+        text = " ".join(message.get("content") or "" for message in messages if message["role"] == "user").lower()
+        selected = [tool.name for tool in self.tools.values() if tool.keywords and tool.matches(text)]
+        if not selected:
+            return list(self.tools)
+        return [tool.name for tool in self.tools.values() if tool.matches(text)]
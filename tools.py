@@ -0,0 +1,167 @@
+import os
+import functools
+from datetime import datetime
+from typing import List, Literal, Optional, TypedDict
+from tool_registry import ToolRegistry, lazy_import
+
+# the tools of 5_multiple_functions.py, registered with their schemas derived from the signatures below
+# pytz, the stock store (NumPy + CSV load) and the calculator's NumPy path are imported on the first call
+# of a tool that needs them, so importing this module is cheap
+
+pytz = lazy_import("pytz")
+stock_store_module = lazy_import("stock_store")
+stock_analytics_module = lazy_import("stock_analytics")
+safe_calculator = lazy_import("safe_calculator")
+
+registry = ToolRegistry()
+
+StockIndex = Literal["S&P 500", "NASDAQ Composite", "Dow Jones Industrial Average", "Financial Times Stock Exchange 100 Index"]
+StockField = Literal["Open", "High", "Low", "Close", "Volume"]
+Operator = Literal["+", "-", "*", "/", "**", "sqrt"]
+
+stock_keywords = ("stock", "index", "indices", "market", "s&p", "nasdaq", "dow jones", "ftse", "financial times")
+calculator_keywords = ("calculat", "how much", "change", "difference", "percent", "sum", "average", "total",
+                       "multiply", "divide", "sqrt", "square root", "+", "*", "/")
+
+
+class _OperationRequired(TypedDict):
+    num1: float
+    operator: Operator
+
+
+# num2 is optional for sqrt
+class Operation(_OperationRequired, total=False):
+    num2: float
+
+
+# load the CSV next to this module once, on first use, whatever the working directory; the store reloads it
+# by itself when the file changes
+@functools.lru_cache(maxsize=None)
+def stock_store():
+    return stock_store_module.StockDataStore(os.path.join(os.path.dirname(os.path.abspath(__file__)), 'stock_data.csv'))
+
+
+@functools.lru_cache(maxsize=None)
+def stock_analytics():
+    return stock_analytics_module.StockAnalytics(stock_store())
+
+
+# function 1 get current time
+
+@registry.tool(keywords=("time", "clock", "timezone", "hour"))
+def get_current_time(location: str):
+    """Get the current time in a given location
+
+    Args:
+        location: The location name. The pytz is used to get the timezone for that location. Location names
+            should be in a format like America/New_York, Asia/Bangkok, Europe/London
+    """
+    try:
+        # get the timezone for the city
+        timezone = pytz.timezone(location)
+
+        # get current time in timezone
+        now = datetime.now(timezone)
+        current_time = now.strftime("%I:%M:%S %p")
+
+        return current_time
+    except:
+        return "Sorry, I couldn't find the timezone for that location"
+
+
+# function 2 get stock market data
+
+@registry.tool(keywords=stock_keywords)
+def get_stock_market_data(index: StockIndex, start_date: Optional[str] = None, end_date: Optional[str] = None):
+    """Get the stock market data for a given index
+
+    Args:
+        start_date: First date to include, YYYY-MM-DD. Omit for the full history.
+        end_date: Last date to include, YYYY-MM-DD. Omit for the full history.
+    """
+
+    available_indices = ["S&P 500", "NASDAQ Composite", "Dow Jones Industrial Average", "Financial Times Stock Exchange 100 Index"]
+
+    if index not in available_indices:
+        return "Invalid index. Please choose from 'S&P 500', 'NASDAQ Composite', 'Dow Jones Industrial Average', 'Financial Times Stock Exchange 100 Index'."
+
+    # same JSON as before ({column: {row: value}}), served from the preloaded store and cached per index
+    try:
+        return stock_store().get_json(index, start_date, end_date)
+    except ValueError:
+        # a malformed date is reported to the model like the analytics tools do
+        return stock_analytics_module.invalid_date_message
+
+
+# analytics tools (changes, returns, aggregates, comparisons) computed over the same store in a single call
+
+@registry.tool(keywords=stock_keywords)
+def get_stock_change(index: StockIndex, start_date: str, end_date: str, field: StockField = "Close"):
+    """Get the absolute and percent change of a stock market index between two dates, computed from the stock market data
+
+    Args:
+        start_date: Start date, YYYY-MM-DD
+        end_date: End date, YYYY-MM-DD
+        field: Column to compare, defaults to Close
+    """
+    return stock_analytics().get_stock_change(index, start_date, end_date, field)
+
+
+@registry.tool(keywords=stock_keywords)
+def get_stock_returns(index: StockIndex, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                      field: StockField = "Close"):
+    """Get the daily percent returns and the cumulative return of a stock market index over a date range
+
+    Args:
+        start_date: Start date, YYYY-MM-DD. Omit for the full history.
+        end_date: End date, YYYY-MM-DD. Omit for the full history.
+        field: Column to use, defaults to Close
+    """
+    return stock_analytics().get_stock_returns(index, start_date, end_date, field)
+
+
+@registry.tool(keywords=stock_keywords)
+def get_stock_statistics(index: StockIndex, start_date: Optional[str] = None, end_date: Optional[str] = None,
+                         field: StockField = "Close"):
+    """Get the minimum, maximum, mean and standard deviation of a stock market index over a date range
+
+    Args:
+        start_date: Start date, YYYY-MM-DD. Omit for the full history.
+        end_date: End date, YYYY-MM-DD. Omit for the full history.
+        field: Column to use, defaults to Close
+    """
+    return stock_analytics().get_stock_statistics(index, start_date, end_date, field)
+
+
+@registry.tool(keywords=stock_keywords)
+def compare_stock_indices(indices: List[StockIndex], start_date: str, end_date: str, field: StockField = "Close"):
+    """Compare the absolute and percent change of several stock market indices between two dates
+
+    Args:
+        start_date: Start date, YYYY-MM-DD
+        end_date: End date, YYYY-MM-DD
+        field: Column to compare, defaults to Close
+    """
+    return stock_analytics().compare_stock_indices(indices, start_date, end_date, field)
+
+
+# function 3 calculator
+
+# one operation with num1/num2/operator as before, or a whole expression and/or a list of operations
+# evaluated in a single call (see safe_calculator.py), so multi-step arithmetic needs one round trip
+@registry.tool(keywords=calculator_keywords)
+def calculator(num1: Optional[float] = None, num2: Optional[float] = None, operator: Optional[Operator] = None,
+               expression: Optional[str] = None, operations: Optional[List[Operation]] = None):
+    """A calculator for arithmetic. Use num1, num2 and operator for one operation, expression for a whole
+    arithmetic expression such as '(4310.33 - 4325.74) / 4325.74 * 100', or operations to compute several
+    independent operations in one call
+
+    Args:
+        expression: Arithmetic expression using numbers, parentheses, + - * / ** and sqrt(x)
+        operations: Operations to compute at once; one result is returned per operation, in order
+    """
+    if expression is not None or operations is not None:
+        return safe_calculator.calculate(expression, operations)
+    # every parameter is optional in the schema, so a single operation goes through the same checks as a batch:
+    # a missing operator gives "Invalid operator", a missing num1 (or num2 for anything but sqrt) an error string
+    return safe_calculator.calculate_batch([{"num1": num1, "num2": num2, "operator": operator}])[0]
@@ -0,0 +1,423 @@
+import os
+import json
+import time
+import random
+import functools
+import threading
+import contextvars
+from collections import deque
+
+# span-based latency instrumentation for the conversation steps: model calls, tool calls, embeddings and searches
+#   with tracer.span("chat_completion", kind="model", deployment=deployment_id) as span:
+#       response = openai.ChatCompletion.create(...)
+#       span.record_usage(response)
+# every span records its duration, tokens in/out (from the response usage), tenacity retries and backoff time
+# (retry_hook below, passed as before_sleep= to @retry), the HTTP requests sent while it was open and their
+# payload sizes (instrument_session hooks the shared requests.Session of clients.py), and its parent span.
+# finished spans are aggregated per name (count, errors, sums and a sliding window of durations for
+# p50/p95/p99) and handed to the exporters: JSON lines, OTLP JSON lines for an OpenTelemetry collector's
+# file receiver, or a Prometheus text file written on flush().
+# a span costs two clock reads, a context variable set/reset and a dict update, a few microseconds, so the
+# tracer can stay on in production; exporters only see a sample_rate fraction of the traces if that is
+# still too much
+
+current_span = contextvars.ContextVar("current_span", default=None)
+
+quantiles = (0.5, 0.95, 0.99)
+
+
+# q-quantile of values with linear interpolation (numpy.percentile's default), without importing NumPy
+# into every script that traces
+def quantile(values, q):
+    ordered = sorted(values)
+    if not ordered:
+        return 0.0
+    position = (len(ordered) - 1) * q
+    lower = int(position)
+    upper = min(lower + 1, len(ordered) - 1)
+    return ordered[lower] + (ordered[upper] - ordered[lower]) * (position - lower)
+
+
+class Span:
+    __slots__ = ("tracer", "name", "kind", "attributes", "trace_id", "span_id", "parent_id", "sampled",
+                 "start_ns", "started", "duration", "error", "tokens_in", "tokens_out", "retries",
+                 "retry_wait", "http_requests", "bytes_out", "bytes_in", "_token")
+
+    def __init__(self, tracer, name, kind, attributes):
+        self.tracer = tracer
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.error = None
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.retries = 0
+        self.retry_wait = 0.0
+        self.http_requests = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+        self.duration = None
+
+    def __enter__(self):
+        parent = current_span.get()
+        if parent is None:
+            self.trace_id = random.getrandbits(128)
+            self.parent_id = None
+            self.sampled = self.tracer.sample_rate >= 1 or random.random() < self.tracer.sample_rate
+        else:
+            self.trace_id = parent.trace_id
+            self.parent_id = parent.span_id
+            self.sampled = parent.sampled
+        self.span_id = random.getrandbits(64)
+        self._token = current_span.set(self)
+        self.start_ns = time.time_ns()
+        self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        self.duration = time.perf_counter() - self.started
+        current_span.reset(self._token)
+        if error_type is not None:
+            self.error = error_type.__name__
+        self.tracer._finish(self)
+        return False
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+        return self
+
+    # usage of a chat completion or embeddings response
+    def record_usage(self, response):
+        usage = response.get("usage") if response is not None else None
+        if usage:
+            self.tokens_in += usage.get("prompt_tokens", 0)
+            self.tokens_out += usage.get("completion_tokens", 0)
+        return response
+
+    def as_dict(self):
+        return {
+            "name": self.name,
+            "kind": self.kind,
+            "trace_id": f"{self.trace_id:032x}",
+            "span_id": f"{self.span_id:016x}",
+            "parent_id": f"{self.parent_id:016x}" if self.parent_id is not None else None,
+            "start": self.start_ns / 1e9,
+            "duration_ms": self.duration * 1000,
+            "error": self.error,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "retries": self.retries,
+            "retry_wait_s": self.retry_wait,
+            "http_requests": self.http_requests,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+            "attributes": self.attributes,
+        }
+
+
+# stands in for Span when the tracer is disabled
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, error_type, error, traceback):
+        return False
+
+    def set(self, **attributes):
+        return self
+
+    def record_usage(self, response):
+        return response
+
+
+noop_span = _NoopSpan()
+
+
+class SpanStats:
+    __slots__ = ("kind", "count", "errors", "total", "durations", "tokens_in", "tokens_out", "retries",
+                 "http_requests", "bytes_out", "bytes_in")
+
+    def __init__(self, kind, window):
+        self.kind = kind
+        self.count = 0
+        self.errors = 0
+        self.total = 0.0
+        self.durations = deque(maxlen=window)
+        self.tokens_in = 0
+        self.tokens_out = 0
+        self.retries = 0
+        self.http_requests = 0
+        self.bytes_out = 0
+        self.bytes_in = 0
+
+    def add(self, span):
+        self.count += 1
+        self.errors += span.error is not None
+        self.total += span.duration
+        self.durations.append(span.duration)
+        self.tokens_in += span.tokens_in
+        self.tokens_out += span.tokens_out
+        self.retries += span.retries
+        self.http_requests += span.http_requests
+        self.bytes_out += span.bytes_out
+        self.bytes_in += span.bytes_in
+
+    def summary(self):
+        p50, p95, p99 = (quantile(self.durations, q) for q in quantiles)
+        return {
+            "kind": self.kind,
+            "count": self.count,
+            "errors": self.errors,
+            "mean_ms": self.total / self.count * 1000 if self.count else 0.0,
+            "p50_ms": float(p50) * 1000,
+            "p95_ms": float(p95) * 1000,
+            "p99_ms": float(p99) * 1000,
+            "tokens_in": self.tokens_in,
+            "tokens_out": self.tokens_out,
+            "retries": self.retries,
+            "http_requests": self.http_requests,
+            "bytes_out": self.bytes_out,
+            "bytes_in": self.bytes_in,
+        }
+
+
+class Tracer:
+    # window: durations kept per span name for the percentiles
+    def __init__(self, exporters=(), sample_rate=1.0, window=2048, enabled=True):
+        self.exporters = list(exporters)
+        self.sample_rate = sample_rate
+        self.window = window
+        self.enabled = enabled
+        self._stats = {}
+        self._lock = threading.Lock()
+
+    def add_exporter(self, exporter):
+        self.exporters.append(exporter)
+        return exporter
+
+    def span(self, name, kind="internal", **attributes):
+        if not self.enabled:
+            return noop_span
+        return Span(self, name, kind, attributes)
+
+    # decorator: run every call of the function in a span named after it
+    def traced(self, name=None, kind="internal"):
+        def decorator(function):
+            span_name = name or function.__name__
+
+            @functools.wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.span(span_name, kind):
+                    return function(*args, **kwargs)
+
+            return wrapper
+        return decorator
+
+    def _finish(self, span):
+        with self._lock:
+            stats = self._stats.get(span.name)
+            if stats is None:
+                stats = self._stats[span.name] = SpanStats(span.kind, self.window)
+            stats.add(span)
+        if span.sampled:
+            for exporter in self.exporters:
+                exporter.export(span)
+
+    # {span name: count, errors, mean/p50/p95/p99 in ms, tokens, retries, HTTP requests and bytes}
+    def stats(self):
+        with self._lock:
+            return {name: stats.summary() for name, stats in self._stats.items()}
+
+    def reset(self):
+        with self._lock:
+            self._stats = {}
+
+    # count the HTTP requests and payload bytes of every request sent through session against the open span
+    # the response size comes from Content-Length, so streamed (chunked) responses count 0 bytes in
+    def instrument_session(self, session):
+        def record(response, *args, **kwargs):
+            span = current_span.get()
+            if span is not None:
+                span.http_requests += 1
+                body = response.request.body
+                span.bytes_out += len(body) if body else 0
+                span.bytes_in += int(response.headers.get("Content-Length") or 0)
+            return response
+
+        session.hooks["response"].append(record)
+        return session
+
+    def flush(self):
+        for exporter in self.exporters:
+            exporter.flush(self)
+
+    def close(self):
+        for exporter in self.exporters:
+            exporter.flush(self)
+            exporter.close()
+
+    def print_summary(self):
+        print(f"{'span':<24}{'count':>7}{'errors':>8}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}"
+              f"{'tokens in/out':>16}{'retries':>9}{'KB out/in':>14}")
+        for name, stats in sorted(self.stats().items(), key=lambda item: -item[1]["p50_ms"] * item[1]["count"]):
+            print(f"{name:<24}{stats['count']:>7}{stats['errors']:>8}{stats['p50_ms']:>10.1f}{stats['p95_ms']:>10.1f}"
+                  f"{stats['p99_ms']:>10.1f}{stats['tokens_in']:>9}/{stats['tokens_out']:<6}{stats['retries']:>9}"
+                  f"{stats['bytes_out'] / 1024:>8.1f}/{stats['bytes_in'] / 1024:<5.1f}")
+
+
+# before_sleep hook for tenacity: @retry(..., before_sleep=retry_hook) counts each retry and its backoff
+# on the span open around the call
+def retry_hook(retry_state):
+    span = current_span.get()
+    if span is not None:
+        span.retries += 1
+        if retry_state.next_action is not None:
+            span.retry_wait += retry_state.next_action.sleep
+
+
+# exporters get every sampled span through export(span) and the tracer through flush(tracer)
+
+class Exporter:
+    def export(self, span):
+        pass
+
+    def flush(self, tracer):
+        pass
+
+    def close(self):
+        pass
+
+
+# one JSON object per span
+class JsonLinesExporter(Exporter):
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "a", encoding="utf-8")
+        self._lock = threading.Lock()
+
+    def _line(self, span):
+        return json.dumps(span.as_dict(), default=str)
+
+    def export(self, span):
+        line = self._line(span)
+        with self._lock:
+            self._file.write(line + "\n")
+
+    def flush(self, tracer):
+        with self._lock:
+            self._file.flush()
+
+    def close(self):
+        with self._lock:
+            self._file.close()
+
+
+def _otlp_value(value):
+    if isinstance(value, bool):
+        return {"boolValue": value}
+    if isinstance(value, int):
+        return {"intValue": str(value)}
+    if isinstance(value, float):
+        return {"doubleValue": value}
+    return {"stringValue": str(value)}
+
+
+otlp_span_kinds = {"model": 3, "embedding": 3, "search": 3}  # SPAN_KIND_CLIENT, everything else INTERNAL
+
+
+# OTLP/JSON, one ExportTraceServiceRequest per line, as read by the OpenTelemetry collector's otlpjsonfile receiver
+class OTLPJsonExporter(JsonLinesExporter):
+    def __init__(self, path, service_name="aoai-function-calling"):
+        super().__init__(path)
+        self.resource = {"attributes": [{"key": "service.name", "value": {"stringValue": service_name}}]}
+
+    def _line(self, span):
+        attributes = dict(span.attributes, **{
+            "span.kind": span.kind, "llm.tokens.input": span.tokens_in, "llm.tokens.output": span.tokens_out,
+            "retry.count": span.retries, "retry.wait_seconds": span.retry_wait, "http.request_count": span.http_requests,
+            "http.request.body.size": span.bytes_out, "http.response.body.size": span.bytes_in,
+        })
+        otlp_span = {
+            "traceId": f"{span.trace_id:032x}",
+            "spanId": f"{span.span_id:016x}",
+            "name": span.name,
+            "kind": otlp_span_kinds.get(span.kind, 1),
+            "startTimeUnixNano": str(span.start_ns),
+            "endTimeUnixNano": str(span.start_ns + int(span.duration * 1e9)),
+            "attributes": [{"key": key, "value": _otlp_value(value)} for key, value in attributes.items()],
+            "status": {"code": 2, "message": span.error} if span.error else {"code": 1},
+        }
+        if span.parent_id is not None:
+            otlp_span["parentSpanId"] = f"{span.parent_id:016x}"
+        return json.dumps({"resourceSpans": [{"resource": self.resource, "scopeSpans": [
+            {"scope": {"name": "tracing"}, "spans": [otlp_span]}]}]})
+
+
+def _label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+# Prometheus text exposition format of the tracer's aggregates
+def prometheus_text(tracer, prefix="aoai"):
+    stats = tracer.stats()
+    lines = []
+
+    def metric(name, metric_type, help_text, samples):
+        lines.append(f"# HELP {prefix}_{name} {help_text}")
+        lines.append(f"# TYPE {prefix}_{name} {metric_type}")
+        for suffix, labels, value in samples:
+            label_text = ",".join(f'{key}="{_label(label)}"' for key, label in labels.items())
+            lines.append(f"{prefix}_{name}{suffix}{{{label_text}}} {value}")
+
+    samples = []
+    for span_name, span_stats in stats.items():
+        labels = {"span": span_name, "kind": span_stats["kind"]}
+        for q in quantiles:
+            samples.append(("", dict(labels, quantile=q), span_stats[f"p{int(q * 100)}_ms"] / 1000))
+        samples.append(("_sum", labels, span_stats["mean_ms"] * span_stats["count"] / 1000))
+        samples.append(("_count", labels, span_stats["count"]))
+    metric("span_duration_seconds", "summary", "Duration of the traced steps, quantiles over a sliding window.", samples)
+
+    counters = [
+        ("span_errors_total", "Spans that ended with an exception.", [("errors", {})]),
+        ("tokens_total", "Tokens reported in the responses' usage.",
+         [("tokens_in", {"direction": "in"}), ("tokens_out", {"direction": "out"})]),
+        ("retries_total", "Retries made by the tenacity decorators.", [("retries", {})]),
+        ("http_requests_total", "HTTP requests sent while the span was open.", [("http_requests", {})]),
+        ("payload_bytes_total", "HTTP request and response body sizes.",
+         [("bytes_out", {"direction": "out"}), ("bytes_in", {"direction": "in"})]),
+    ]
+    for name, help_text, fields in counters:
+        metric(name, "counter", help_text, [
+            ("", dict({"span": span_name, "kind": span_stats["kind"]}, **labels), span_stats[field])
+            for span_name, span_stats in stats.items() for field, labels in fields])
+    return "\n".join(lines) + "\n"
+
+
+# writes prometheus_text() to path on every flush, e.g. for node_exporter's textfile collector
+class PrometheusExporter(Exporter):
+    def __init__(self, path, prefix="aoai"):
+        self.path = path
+        self.prefix = prefix
+
+    def flush(self, tracer):
+        with open(self.path + ".tmp", "w", encoding="utf-8") as metrics_file:
+            metrics_file.write(prometheus_text(tracer, self.prefix))
+        # replace in one step so a scrape never reads a half-written file
+        os.replace(self.path + ".tmp", self.path)
+
+
+# exporters from config, e.g. {"TRACE_JSONL": "spans.jsonl", "TRACE_OTLP": "otlp.jsonl", "TRACE_PROMETHEUS": "aoai.prom"}
+def exporters_from_config(config):
+    exporters = []
+    if config.get("TRACE_JSONL"):
+        exporters.append(JsonLinesExporter(config["TRACE_JSONL"]))
+    if config.get("TRACE_OTLP"):
+        exporters.append(OTLPJsonExporter(config["TRACE_OTLP"]))
+    if config.get("TRACE_PROMETHEUS"):
+        exporters.append(PrometheusExporter(config["TRACE_PROMETHEUS"]))
+    return exporters
+
+
+# the process-wide tracer; it aggregates without exporters until the scripts add some
+tracer = Tracer()